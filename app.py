@@ -1,6 +1,18 @@
+import atexit
+import glob
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import streamlit as st
 import pandas as pd
-import io
 from datetime import datetime
 from procesar_excel_directo import (
     formatear_campo,
@@ -11,8 +23,22 @@ from procesar_excel_directo import (
     mapear_sexo_hab,
     sanitizar_texto,
     aplicar_logica_apoderado,
+    mascara_apoderado,
     generar_linea_hab,
-    generar_archivo_hab
+    generar_contenido_hab,
+    generar_archivo_hab,
+    procesar_archivo_excel,
+    revisar_caracteres_hab,
+    validar_registros_hab,
+    leer_archivo_entrada,
+    nuevas_metricas,
+    medir_etapa,
+    metricas_etapas,
+    pico_memoria_mb,
+    TAMANO_BLOQUE,
+    MAX_WORKERS,
+    LAYOUT_HAB,
+    ANCHO_REGISTRO_HAB
 )
 
 # Configuración de la página
@@ -23,6 +49,471 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# ==================== CACHÉ ====================
+
+# Streamlit vuelve a ejecutar el script en cada interacción: la lectura del
+# Excel, sus revisiones y la generación del .HAB (ver trabajos_compartidos) se
+# cachean por hash del contenido subido.
+# La lectura y las revisiones comparten un presupuesto de CACHE_MAX_MB según
+# el tamaño estimado de sus DataFrames (los menos usados se descartan primero);
+# de los trabajos se conservan como máximo CACHE_MAX_ARCHIVOS. Todo vence a
+# las CACHE_TTL_SEGUNDOS.
+CACHE_MAX_MB = 512
+CACHE_MAX_ARCHIVOS = 4
+CACHE_TTL_SEGUNDOS = 3600
+
+
+def _tamano_mb(valor):
+    """Memoria estimada (MB) de un resultado cacheado: la de sus DataFrames, textos incluidos."""
+    if isinstance(valor, pd.DataFrame):
+        return valor.memory_usage(deep=True).sum() / 1024 / 1024
+    if isinstance(valor, tuple):
+        return sum(_tamano_mb(elemento) for elemento in valor)
+    return 0.0
+
+
+@st.cache_resource
+def resultados_compartidos():
+    """
+    Resultados por (etapa, hash del contenido), compartidos entre sesiones
+    y ordenados del uso más viejo al más reciente. Los DataFrames no se
+    copian: quien los recibe no los modifica.
+    
+    Returns:
+        Tupla (OrderedDict clave → (valor, MB, momento de cálculo), lock que lo protege)
+    """
+    return OrderedDict(), threading.Lock()
+
+
+def cacheado(clave, calcular):
+    """
+    Resultado de clave en resultados_compartidos, o calcular() si no está o
+    venció. Al guardar uno nuevo se descartan los vencidos y, de los menos
+    usados a los más usados, los necesarios para no superar CACHE_MAX_MB; un
+    resultado más grande que todo el presupuesto no se guarda.
+    """
+    cache, candado = resultados_compartidos()
+    with candado:
+        entrada = cache.get(clave)
+        if entrada is not None and time.monotonic() - entrada[2] <= CACHE_TTL_SEGUNDOS:
+            cache.move_to_end(clave)
+            return entrada[0]
+    
+    valor = calcular()
+    tamano = _tamano_mb(valor)
+    ahora = time.monotonic()
+    with candado:
+        cache.pop(clave, None)
+        for vencida in [c for c, (_, _, momento) in cache.items() if ahora - momento > CACHE_TTL_SEGUNDOS]:
+            del cache[vencida]
+        if tamano <= CACHE_MAX_MB:
+            cache[clave] = (valor, tamano, ahora)
+            usado = sum(mb for _, mb, _ in cache.values())
+            while usado > CACHE_MAX_MB:
+                _, (_, mb, _) = cache.popitem(last=False)
+                usado -= mb
+    return valor
+
+
+def leer_excel_subido(hash_contenido, archivo):
+    """
+    Lee el archivo subido (.xlsx, .csv o .parquet; cacheado por
+    hash_contenido).
+    Devuelve (df, metricas) con el tiempo de la lectura original.
+    """
+    def leer():
+        metricas = nuevas_metricas()
+        with st.spinner("Leyendo archivo..."), medir_etapa(metricas, 'lectura'):
+            df = leer_archivo_entrada(archivo, archivo.name)
+        return df, metricas
+    
+    return cacheado(('lectura', hash_contenido), leer)
+
+
+def revisar_caracteres_subido(hash_contenido, df):
+    """Valores del Excel subido con caracteres fuera de latin-1 (ver revisar_caracteres_hab)."""
+    return cacheado(('caracteres', hash_contenido), lambda: revisar_caracteres_hab(df))
+
+
+def validar_subido(hash_contenido, df):
+    """Problemas de validación previa del Excel subido (ver validar_registros_hab)."""
+    return cacheado(('validacion', hash_contenido), lambda: validar_registros_hab(df))
+
+
+# ==================== GENERACIÓN EN SEGUNDO PLANO ====================
+
+# La generación del .HAB corre en un pool de hilos compartido por todas las
+# sesiones: el script de Streamlit no se bloquea mientras tanto y una
+# interacción (que vuelve a ejecutar el script) no pierde el trabajo, que
+# queda en st.session_state. Como mucho MAX_TRABAJOS_SIMULTANEOS archivos se
+# generan a la vez; el resto espera su turno. El progreso se actualiza
+# bloque a bloque (TAMANO_BLOQUE filas) y se muestra cada INTERVALO_PROGRESO
+# segundos.
+MAX_TRABAJOS_SIMULTANEOS = 4
+INTERVALO_PROGRESO = 1.0
+
+
+class TrabajoHAB:
+    """
+    Generación de un .HAB en segundo plano. El hilo del pool actualiza
+    filas y total después de cada bloque (ver generar_contenido_hab); el
+    resultado queda en futuro: (contenido, lineas_generadas,
+    lineas_saltadas, metricas).
+    """
+    
+    def __init__(self, total):
+        self.total = total
+        self.filas = 0
+        self.inicio = None
+        self.fin = None
+        self.futuro = None
+    
+    def avance(self, filas, total):
+        if self.inicio is None:
+            self.inicio = time.monotonic()
+        self.filas, self.total = filas, total
+    
+    def terminado(self):
+        return self.futuro.done()
+    
+    def fallido(self):
+        return self.terminado() and self.futuro.exception() is not None
+    
+    def segundos(self):
+        if self.inicio is None:
+            return 0.0
+        return (self.fin or time.monotonic()) - self.inicio
+    
+    def filas_por_segundo(self):
+        segundos = self.segundos()
+        return self.filas / segundos if segundos > 0 else 0.0
+    
+    def eta(self):
+        """Segundos estimados hasta terminar (None si todavía no hay avance)."""
+        velocidad = self.filas_por_segundo()
+        return (self.total - self.filas) / velocidad if velocidad > 0 else None
+
+
+@st.cache_resource
+def ejecutor_trabajos():
+    """Pool de hilos compartido por todas las sesiones."""
+    return ThreadPoolExecutor(max_workers=MAX_TRABAJOS_SIMULTANEOS, thread_name_prefix='generar_hab')
+
+
+@st.cache_resource
+def trabajos_compartidos():
+    """
+    Trabajos por (hash del contenido, FECHA ALTA), compartidos entre
+    sesiones: el mismo archivo subido dos veces (o por dos usuarios) se
+    genera una sola vez. Se conservan como máximo CACHE_MAX_ARCHIVOS
+    trabajos terminados, de hasta CACHE_TTL_SEGUNDOS.
+    
+    Returns:
+        Tupla (dict de trabajos, lock que lo protege)
+    """
+    return {}, threading.Lock()
+
+
+def _generar_en_segundo_plano(trabajo, df, fecha_alta):
+    try:
+        metricas = nuevas_metricas()
+        contenido, lineas_generadas, lineas_saltadas = generar_contenido_hab(
+            df, fecha_alta, metricas, avance=trabajo.avance, tamano_bloque=TAMANO_BLOQUE
+        )
+        return contenido, lineas_generadas, lineas_saltadas, metricas
+    finally:
+        trabajo.fin = time.monotonic()
+
+
+def iniciar_generacion(hash_contenido, fecha_alta, df):
+    """
+    Encarga la generación del .HAB al pool y vuelve enseguida. Si el mismo
+    contenido (con la misma FECHA ALTA) ya se está generando o se generó,
+    devuelve ese trabajo; uno que falló se vuelve a encargar.
+    """
+    trabajos, candado = trabajos_compartidos()
+    clave = (hash_contenido, fecha_alta)
+    with candado:
+        trabajo = trabajos.get(clave)
+        if trabajo is not None and not trabajo.fallido():
+            return trabajo
+        
+        # Lugar para el nuevo: se descartan los terminados vencidos y los más viejos
+        ahora = time.monotonic()
+        terminados = sorted(
+            (trabajo.fin, clave_terminado) for clave_terminado, trabajo in trabajos.items()
+            if trabajo.terminado()
+        )
+        sobrantes = len(terminados) - (CACHE_MAX_ARCHIVOS - 1)
+        for posicion, (fin, clave_terminado) in enumerate(terminados):
+            if posicion < sobrantes or ahora - fin > CACHE_TTL_SEGUNDOS:
+                del trabajos[clave_terminado]
+        
+        trabajo = TrabajoHAB(len(df))
+        trabajo.futuro = ejecutor_trabajos().submit(_generar_en_segundo_plano, trabajo, df, fecha_alta)
+        trabajos[clave] = trabajo
+        return trabajo
+
+
+def _formatear_segundos(segundos):
+    if segundos is None:
+        return "-"
+    minutos, segundos = divmod(int(round(segundos)), 60)
+    return f"{minutos}:{segundos:02d} min" if minutos else f"{segundos} s"
+
+
+@st.fragment(run_every=INTERVALO_PROGRESO)
+def mostrar_progreso(trabajo):
+    """Barra de progreso que se refresca sola; cuando el trabajo termina vuelve a ejecutar el script."""
+    if trabajo.terminado():
+        st.rerun()
+    if trabajo.inicio is None:
+        st.progress(0.0, text="⏳ Esperando un lugar libre para generar (hay otros archivos en proceso)...")
+        return
+    st.progress(
+        trabajo.filas / trabajo.total if trabajo.total else 1.0,
+        text=(
+            f"⚙️ {trabajo.filas:,} de {trabajo.total:,} filas · "
+            f"{trabajo.filas_por_segundo():,.0f} filas/s · "
+            f"restan {_formatear_segundos(trabajo.eta())}"
+        ),
+    )
+
+
+# ==================== VARIOS ARCHIVOS ====================
+
+# Con varios archivos subidos (p. ej. todo un lote de PPP), cada uno pasa por
+# procesar_archivo_excel, el mismo procesamiento del script por lotes, en un
+# pool de procesos compartido por todas las sesiones (MAX_WORKERS procesos).
+# Un hilo por lote agrega cada .HAB al ZIP apenas termina, copiándolo del
+# disco por partes: los .HAB nunca están todos en memoria.
+# Las carpetas temporales tienen datos personales: al terminar el lote solo
+# queda el ZIP, que se borra al reemplazar el lote, a las CACHE_TTL_SEGUNDOS
+# o al terminar el proceso (ver lotes_compartidos).
+
+
+class TrabajoLote:
+    """
+    Procesamiento de varios archivos subidos. Cada archivo y sus salidas
+    quedan en una subcarpeta de directorio (que se borra al terminar); el
+    ZIP con los .HAB se arma en zip_path a medida que terminan.
+    """
+    
+    def __init__(self, nombres, directorio):
+        self.nombres = nombres
+        self.directorio = directorio
+        self.zip_path = os.path.join(directorio, 'archivos_hab.zip')
+        self.futuros = {}  # futuro → posición del archivo
+        self.resultados = [None] * len(nombres)
+        self.inicio = time.monotonic()
+        self.fin = None
+        self.error = None
+    
+    def terminado(self):
+        return self.fin is not None
+    
+    def terminados(self):
+        return sum(resultado is not None for resultado in self.resultados)
+    
+    def tabla(self):
+        """Una fila por archivo con su estado y el resultado de procesar_archivo_excel."""
+        estados = {posicion: futuro.running() for futuro, posicion in self.futuros.items()}
+        filas = []
+        for posicion, (nombre, resultado) in enumerate(zip(self.nombres, self.resultados)):
+            if resultado is None:
+                estado = "⚙️ Procesando" if estados.get(posicion) else "⏳ En espera"
+                resultado = {}
+            else:
+                estado = "❌ Error" if resultado['error'] else "✅ Listo"
+            filas.append({
+                "Archivo": nombre,
+                "Estado": estado,
+                "Filas": resultado.get('filas_leidas'),
+                "Líneas .HAB": resultado.get('lineas_generadas'),
+                "Saltadas": resultado.get('lineas_saltadas'),
+                "Problemas de validación": resultado.get('errores_validacion'),
+                "Segundos": round(resultado['tiempos'].get('total', 0), 1) if resultado else None,
+                "Error": resultado.get('error'),
+            })
+        return pd.DataFrame(filas)
+
+
+@st.cache_resource
+def ejecutor_lotes():
+    """
+    Pool de procesos compartido por todas las sesiones. Los procesos se
+    crean con spawn: un fork copiaría los hilos y locks del servidor de
+    Streamlit en un estado inconsistente.
+    """
+    return ProcessPoolExecutor(
+        max_workers=MAX_WORKERS or os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn')
+    )
+
+
+PREFIJO_LOTE = 'lote_hab_'
+
+
+@st.cache_resource
+def lotes_compartidos():
+    """
+    Lotes con carpeta temporal en disco, de todas las sesiones. Las que
+    quedan se borran al terminar el proceso.
+    
+    Returns:
+        Tupla (lista de lotes, lock que la protege)
+    """
+    lotes = []
+    atexit.register(_borrar_carpetas, lotes)
+    return lotes, threading.Lock()
+
+
+def _borrar_carpetas(lotes):
+    for lote in lotes:
+        shutil.rmtree(lote.directorio, ignore_errors=True)
+
+
+def borrar_lote(lote):
+    """Borra la carpeta temporal de un lote y lo quita de lotes_compartidos."""
+    lotes, candado = lotes_compartidos()
+    with candado:
+        if lote in lotes:
+            lotes.remove(lote)
+    shutil.rmtree(lote.directorio, ignore_errors=True)
+
+
+def _limpiar_lotes_vencidos():
+    """
+    Borra los lotes terminados hace más de CACHE_TTL_SEGUNDOS y las carpetas
+    lote_hab_* que dejó un proceso anterior (p. ej. si se cortó).
+    """
+    lotes, candado = lotes_compartidos()
+    ahora = time.monotonic()
+    with candado:
+        vencidos = [lote for lote in lotes if lote.terminado() and ahora - lote.fin > CACHE_TTL_SEGUNDOS]
+        propios = {lote.directorio for lote in lotes}
+    for lote in vencidos:
+        borrar_lote(lote)
+    for directorio in glob.glob(os.path.join(tempfile.gettempdir(), PREFIJO_LOTE + '*')):
+        try:
+            huerfano = directorio not in propios and time.time() - os.path.getmtime(directorio) > CACHE_TTL_SEGUNDOS
+        except OSError:
+            continue
+        if huerfano:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def iniciar_lote(archivos):
+    """
+    Guarda los archivos subidos en una carpeta temporal, los encarga al
+    pool y arranca el hilo que arma el ZIP. Vuelve enseguida.
+    """
+    _limpiar_lotes_vencidos()
+    lote = TrabajoLote([archivo.name for archivo in archivos], tempfile.mkdtemp(prefix=PREFIJO_LOTE))
+    lotes, candado = lotes_compartidos()
+    with candado:
+        lotes.append(lote)
+    pool = ejecutor_lotes()
+    for posicion, archivo in enumerate(archivos):
+        directorio = os.path.join(lote.directorio, str(posicion))
+        os.makedirs(directorio)
+        path = os.path.join(directorio, os.path.basename(archivo.name))
+        with open(path, 'wb') as f:
+            f.write(archivo.getbuffer())
+        futuro = pool.submit(
+            procesar_archivo_excel, path, directorio_salida=directorio,
+            control_enviados='no', auditoria='no', division='no',
+        )
+        lote.futuros[futuro] = posicion
+    threading.Thread(target=_armar_zip, args=(lote,), name='zip_lote_hab', daemon=True).start()
+    return lote
+
+
+def _armar_zip(lote):
+    """Agrega al ZIP cada .HAB apenas termina su archivo (en el orden en que terminan)."""
+    try:
+        with zipfile.ZipFile(lote.zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            nombres = set()
+            for futuro in as_completed(lote.futuros):
+                posicion = lote.futuros[futuro]
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    # El proceso del pool terminó de forma anormal (p. ej. falta de memoria)
+                    resultado = {'archivo': lote.nombres[posicion], 'tiempos': {}, 'error': str(e) or type(e).__name__}
+                if not resultado['error']:
+                    nombre = os.path.basename(resultado['hab_path'])
+                    if nombre in nombres:
+                        nombre = f"{posicion + 1}_{nombre}"
+                    nombres.add(nombre)
+                    zf.write(resultado['hab_path'], nombre)
+                lote.resultados[posicion] = resultado
+    except Exception as e:
+        lote.error = str(e)
+    finally:
+        # Las entradas y salidas de cada archivo ya no hacen falta: solo queda el ZIP
+        for posicion in range(len(lote.nombres)):
+            shutil.rmtree(os.path.join(lote.directorio, str(posicion)), ignore_errors=True)
+        lote.fin = time.monotonic()
+
+
+@st.fragment(run_every=INTERVALO_PROGRESO)
+def mostrar_progreso_lote(lote):
+    """Progreso por archivo que se refresca solo; cuando el lote termina vuelve a ejecutar el script."""
+    if lote.terminado():
+        st.rerun()
+    st.progress(
+        lote.terminados() / len(lote.nombres),
+        text=f"⚙️ {lote.terminados()} de {len(lote.nombres)} archivos · "
+             f"{_formatear_segundos(time.monotonic() - lote.inicio)}",
+    )
+    st.dataframe(lote.tabla(), hide_index=True, use_container_width=True)
+
+
+def mostrar_lote(archivos):
+    """Sección de la página para varios archivos subidos."""
+    st.success(f"✅ {len(archivos)} archivos cargados: " + ", ".join(f"**{archivo.name}**" for archivo in archivos))
+    clave = hashlib.sha256(b''.join(hashlib.sha256(archivo.getbuffer()).digest() for archivo in archivos)).hexdigest()
+    
+    if st.button(f"🚀 Generar {len(archivos)} archivos .HAB", type="primary", use_container_width=True):
+        anterior = st.session_state.get('lote_hab')
+        if anterior is not None and anterior['lote'].terminado():
+            borrar_lote(anterior['lote'])
+        st.session_state['lote_hab'] = {
+            'clave': clave,
+            'lote': iniciar_lote(archivos),
+            'archivo': f"archivos_hab_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+        }
+    
+    actual = st.session_state.get('lote_hab')
+    if actual is None or actual['clave'] != clave:
+        return
+    lote = actual['lote']
+    if not lote.terminado():
+        mostrar_progreso_lote(lote)
+        return
+    
+    tabla = lote.tabla()
+    correctos = int((tabla['Estado'] == "✅ Listo").sum())
+    if lote.error:
+        st.error(f"❌ Error al armar el ZIP: {lote.error}")
+    elif correctos == len(tabla):
+        st.success(f"✅ {correctos} archivos .HAB generados en {_formatear_segundos(lote.fin - lote.inicio)}")
+    else:
+        st.warning(f"⚠️ {correctos} de {len(tabla)} archivos generados; revisar los errores en la tabla")
+    st.dataframe(tabla, hide_index=True, use_container_width=True)
+    if correctos and not lote.error and not os.path.exists(lote.zip_path):
+        st.info("🕒 El ZIP ya no está disponible (venció); volver a generarlo")
+    elif correctos and not lote.error:
+        with open(lote.zip_path, 'rb') as f:
+            st.download_button(
+                label=f"⬇️ Descargar {correctos} archivos .HAB (.zip)",
+                data=f,
+                file_name=actual['archivo'],
+                mime="application/zip",
+                use_container_width=True
+            )
+
+
 # ==================== SIDEBAR CON INSTRUCCIONES ====================
 with st.sidebar:
     st.title("📋 Instrucciones")
@@ -75,9 +566,9 @@ with st.sidebar:
     ### ⚙️ Procesamiento automático
     
     - ✅ **Limpieza de columnas:** Elimina espacios en nombres de columnas
-    - ✅ **Sanitización:** Elimina acentos y caracteres especiales
+    - ✅ **Sanitización:** Elimina acentos y caracteres especiales en todos los campos de texto (la Ñ se conserva)
     - ✅ **Nombres/Apellidos:** Separa primer y segundo nombre/apellido
-    - ✅ **Celulares:** Extrae prefijo (11, 351, 358, 353, etc.) y número
+    - ✅ **Celulares:** Quita +54, 9, 0 y 15, y separa código de área (según `codigos_area.csv`) y número
     - ✅ **Emails largos:** Si supera 30 caracteres → email genérico
     - ✅ **Barrios vacíos:** Si es NULL → "OTRO"
     - ✅ **Apoderados:** Si TIENE_APODERADO='S' Y APO_DNI tiene valor → usa datos APO_*
@@ -87,7 +578,7 @@ with st.sidebar:
     
     ### 🎯 Pasos de uso
     
-    1. **Cargar** el archivo Excel (.xlsx)
+    1. **Cargar** uno o varios archivos Excel (.xlsx), CSV o Parquet
     2. **Verificar** la vista previa y columnas detectadas
     3. **Revisar** registros con/sin apoderado (si aplica)
     4. **Generar** y **descargar** el archivo .HAB
@@ -102,6 +593,24 @@ with st.sidebar:
     - **Ancho fijo:** Cada campo tiene longitud específica
     """)
     
+    with st.expander(f"📐 Diseño de registro ({ANCHO_REGISTRO_HAB} caracteres)"):
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {
+                        "Campo": campo.nombre,
+                        "Posición": campo.offset + 1,
+                        "Long.": campo.longitud,
+                        "Tipo": campo.tipo,
+                        "Valor": campo.fuente if campo.fuente else repr(campo.default),
+                    }
+                    for campo in LAYOUT_HAB
+                ]
+            ),
+            hide_index=True,
+            use_container_width=True
+        )
+    
     st.markdown("---")
     st.success("✨ **¡Listo para usar!** La app procesa automáticamente todos los formatos.")
 
@@ -112,19 +621,22 @@ st.markdown("### Convierte datos de Excel a formato HAB")
 
 # Sección de carga de archivo
 st.markdown("---")
-uploaded_file = st.file_uploader(
-    "📁 Selecciona un archivo Excel (.xlsx)",
-    type=['xlsx'],
-    help="Carga un archivo Excel con los campos requeridos (ver sidebar)"
+uploaded_files = st.file_uploader(
+    "📁 Selecciona uno o varios archivos Excel (.xlsx), CSV o Parquet",
+    type=['xlsx', 'csv', 'parquet'],
+    accept_multiple_files=True,
+    help="Carga archivos Excel con los campos requeridos (ver sidebar); con varios se genera un ZIP con todos los .HAB"
 )
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+
+if len(uploaded_files) > 1:
+    mostrar_lote(uploaded_files)
 
-if uploaded_file is not None:
+elif uploaded_file is not None:
     try:
-        # Leer el archivo Excel
-        df = pd.read_excel(uploaded_file, dtype=str)
-        
-        # Limpiar nombres de columnas (quitar espacios al inicio/final)
-        df.columns = df.columns.str.strip()
+        # Leer el archivo Excel (cacheado por contenido)
+        hash_contenido = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        df, metricas_lectura = leer_excel_subido(hash_contenido, uploaded_file)
         
         # Mostrar información del archivo
         st.success(f"✅ Archivo cargado exitosamente: **{uploaded_file.name}**")
@@ -133,7 +645,7 @@ if uploaded_file is not None:
         with col1:
             st.metric("Total de registros", len(df))
         with col2:
-            st.metric("Total de columnas", len(df.columns))
+            st.metric("Columnas leídas", len(df.columns))
         
         # Validar columnas
         tiene_columnas_apoderado = all(col in df.columns for col in ['IdApoderado', 'APO_SEXO'])
@@ -147,10 +659,7 @@ if uploaded_file is not None:
             # Contar registros con apoderado válido
             registros_con_apoderado = 0
             if 'IdApoderado' in df.columns:
-                # Verificar que IdApoderado no esté vacío
-                mask_apoderado = (df['IdApoderado'].notna()) & \
-                                 (df['IdApoderado'].astype(str).str.strip() != '')
-                registros_con_apoderado = mask_apoderado.sum()
+                registros_con_apoderado = int(mascara_apoderado(df).sum())
                 
                 col1, col2 = st.columns(2)
                 with col1:
@@ -162,85 +671,131 @@ if uploaded_file is not None:
             with st.expander("👁️ Ver vista previa de los datos (primeras 10 filas)"):
                 st.dataframe(df.head(10), use_container_width=True)
             
-            # Mostrar columnas disponibles
-            with st.expander("📋 Ver columnas disponibles"):
+            # Mostrar columnas leídas (solo las que usa el .HAB, ver COLUMNAS_ENTRADA)
+            with st.expander("📋 Ver columnas leídas"):
+                st.caption("Solo se leen las columnas que usa el .HAB; el resto del archivo no se carga.")
                 st.write(list(df.columns))
             
             # DEBUG: Mostrar primer registro completo
             with st.expander("🔍 DEBUG - Ver primer registro completo"):
                 if len(df) > 0:
                     primer_registro = df.iloc[0]
-                    st.markdown("**Todas las columnas y valores del primer registro:**")
+                    st.markdown("**Columnas leídas y valores del primer registro:**")
                     for col in df.columns:
                         valor = primer_registro[col]
                         st.text(f"{col}: '{valor}'")
                 else:
                     st.warning("No hay registros en el archivo")
             
+            # Revisión previa: valores que no se pueden escribir tal cual en latin-1
+            problemas = revisar_caracteres_subido(hash_contenido, df)
+            if not problemas.empty:
+                st.warning(
+                    f"⚠️ **{len(problemas)}** valores tienen caracteres fuera de latin-1 "
+                    f"(emojis, otros alfabetos, etc.). Se aproximan o se eliminan en el .HAB; "
+                    f"conviene corregirlos en el origen."
+                )
+                with st.expander("🔤 Ver valores con caracteres no soportados"):
+                    st.dataframe(problemas, hide_index=True, use_container_width=True)
+            
+            # Validación previa: CUIL, DNI, fechas, campos que no entran en el .HAB y emails largos
+            validacion = validar_subido(hash_contenido, df)
+            if not validacion.empty:
+                st.warning(
+                    f"⚠️ **{len(validacion)}** problemas de validación en "
+                    f"**{validacion['fila_excel'].nunique()}** filas. El .HAB se genera igual, "
+                    f"pero el banco puede rechazar esos registros."
+                )
+                with st.expander("🩺 Ver problemas de validación"):
+                    st.dataframe(
+                        validacion['error'].value_counts().rename_axis('error').reset_index(name='cantidad'),
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                    st.dataframe(validacion, hide_index=True, use_container_width=True)
+                    st.download_button(
+                        label="⬇️ Descargar reporte de validación (.csv)",
+                        data=validacion.to_csv(index=False).encode('utf-8-sig'),
+                        file_name=f"validacion_{uploaded_file.name.rsplit('.', 1)[0]}.csv",
+                        mime="text/csv",
+                    )
+            
             st.markdown("---")
             
-            # Botón para generar archivo HAB
+            # Botón para generar archivo HAB: la generación corre en segundo plano
+            # y el trabajo queda en la sesión (sobrevive a las interacciones)
             if st.button("🚀 Generar archivo .HAB", type="primary", use_container_width=True):
-                with st.spinner("Procesando archivo..."):
-                    try:
-                        # Generar archivo HAB en memoria
-                        output = io.StringIO(newline='')
-                        lineas_generadas = 0
-                        lineas_saltadas = 0
-                        
-                        for _, row in df.iterrows():
-                            # Validación: Si IdApoderado está vacío o es null, SALTAR registro
-                            IdApoderado = row.get('IdApoderado', '')
-                            if pd.isna(IdApoderado) or str(IdApoderado).strip() == '':
-                                lineas_saltadas += 1
-                                continue
-                            
-                            linea = generar_linea_hab(row)
-                            output.write(linea + '\r\n')  # CR-LF (Windows)
-                            lineas_generadas += 1
-                        
-                        # Obtener contenido del archivo
-                        hab_content = output.getvalue()
-                        output.close()
-                        
-                        # Convertir a bytes con encoding latin-1
-                        hab_bytes = hab_content.encode('latin-1')
-                        
-                        # Generar nombre de archivo con timestamp
-                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                        original_name = uploaded_file.name.rsplit('.', 1)[0]
-                        hab_filename = f"{original_name}_{timestamp}.HAB"
-                        
-                        st.success(f"✅ Archivo .HAB generado exitosamente!")
-                        
+                fecha_alta = datetime.now().strftime('%Y%m%d')
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                original_name = uploaded_file.name.rsplit('.', 1)[0]
+                st.session_state['generacion_hab'] = {
+                    'hash_contenido': hash_contenido,
+                    'trabajo': iniciar_generacion(hash_contenido, fecha_alta, df),
+                    'archivo': f"{original_name}_{timestamp}.HAB",
+                    'festejado': False,
+                }
+            
+            generacion = st.session_state.get('generacion_hab')
+            if generacion is not None and generacion['hash_contenido'] == hash_contenido:
+                trabajo = generacion['trabajo']
+                if not trabajo.terminado():
+                    mostrar_progreso(trabajo)
+                elif trabajo.fallido():
+                    error = trabajo.futuro.exception()
+                    st.error(f"❌ Error al generar el archivo .HAB: {str(error)}")
+                    with st.expander("Ver detalles del error"):
+                        st.code(''.join(traceback.format_exception(error)))
+                else:
+                    hab_bytes, lineas_generadas, lineas_saltadas, metricas_hab = trabajo.futuro.result()
+                    
+                    st.success(f"✅ Archivo .HAB generado exitosamente!")
+                    
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.info(f"📊 Líneas creadas: **{lineas_generadas}**")
+                    with col2:
+                        if lineas_saltadas > 0:
+                            st.warning(f"⚠️  Registros saltados (IdApoderado vacío): **{lineas_saltadas}**")
+                    
+                    # Métricas por etapa (las mismas del reporte JSON del procesamiento por lotes)
+                    with st.expander("⏱️ Métricas de rendimiento por etapa"):
+                        metricas = {
+                            'tiempos': {**metricas_lectura['tiempos'], **metricas_hab['tiempos']},
+                            'memoria_mb': {**metricas_lectura['memoria_mb'], **metricas_hab['memoria_mb']},
+                        }
                         col1, col2 = st.columns(2)
                         with col1:
-                            st.info(f"📊 Líneas creadas: **{lineas_generadas}**")
+                            st.metric("Tiempo de generación", f"{trabajo.segundos():.2f} s")
                         with col2:
-                            if lineas_saltadas > 0:
-                                st.warning(f"⚠️  Registros saltados (IdApoderado vacío): **{lineas_saltadas}**")
-                        
-                        # Botón de descarga
-                        st.download_button(
-                            label="⬇️ Descargar archivo .HAB",
-                            data=hab_bytes,
-                            file_name=hab_filename,
-                            mime="text/plain",
+                            pico = pico_memoria_mb()
+                            st.metric("Pico de memoria (RSS)", f"{pico:.0f} MB" if pico is not None else "-")
+                        st.dataframe(
+                            pd.DataFrame(metricas_etapas(metricas, len(df), lineas_generadas)),
+                            hide_index=True,
                             use_container_width=True
                         )
-                        
+                        st.caption(
+                            "Los tiempos corresponden a la primera lectura y generación de este "
+                            "archivo: si ya se había generado (en esta u otra sesión), se reutiliza. "
+                            "El pico de RSS es el del proceso del servidor."
+                        )
+                    
+                    # Botón de descarga
+                    st.download_button(
+                        label="⬇️ Descargar archivo .HAB",
+                        data=hab_bytes,
+                        file_name=generacion['archivo'],
+                        mime="text/plain",
+                        use_container_width=True
+                    )
+                    
+                    if not generacion['festejado']:
+                        generacion['festejado'] = True
                         st.balloons()
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error al generar el archivo .HAB: {str(e)}")
-                        with st.expander("Ver detalles del error"):
-                            import traceback
-                            st.code(traceback.format_exc())
     
     except Exception as e:
         st.error(f"❌ Error al leer el archivo Excel: {str(e)}")
         with st.expander("Ver detalles del error"):
-            import traceback
             st.code(traceback.format_exc())
 
 else:
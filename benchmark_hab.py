@@ -0,0 +1,465 @@
+"""
+Benchmarks del generador .HAB con datos sintéticos.
+
+Genera planillas con las columnas documentadas en el sidebar de app.py
+(beneficiario + apoderado), con mezcla de registros con y sin apoderado,
+acentos, apóstrofes, emails largos, barrios vacíos y celulares en varios
+formatos, y mide cada etapa del procesamiento (lectura, mapeo,
+codificación y escritura) en filas/segundo y pico de memoria.
+
+Los resultados se guardan en JSON para comparar entre commits:
+    python benchmark_hab.py --filas 1000 10000 100000 --salida base.json
+    python benchmark_hab.py --filas 1000 10000 100000 --comparar base.json
+
+La lectura se mide dos veces: como la hace el generador (solo las columnas
+que usa, con categorías) y con todas las columnas como texto, e informa la
+memoria del DataFrame de cada una. --columnas-sin-uso agrega columnas que el
+.HAB no usa, como las que trae una exportación real:
+    python benchmark_hab.py --filas 100000 --columnas-sin-uso 20
+
+Generar solo una planilla sintética:
+    python benchmark_hab.py generar --filas 1000000 datos.xlsx
+
+Medir el arranque (importar el módulo y `--help`, en procesos nuevos):
+    python benchmark_hab.py arranque --repeticiones 10
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+import procesar_excel_directo as hab
+
+# ==================== DATOS SINTÉTICOS ====================
+
+_NOMBRES = [
+    'Juan', 'María', 'José Luis', 'Ana Sofía', 'Lucía', 'Martín', 'Sebastián',
+    'Agustina', 'Iñaki', 'Valentín', 'Camila Belén', 'Joaquín', 'Mónica',
+    'Ramón Ángel', 'Zoé', 'Nicolás', 'Verónica', 'Héctor Raúl', 'Florencia',
+]
+_APELLIDOS = [
+    'González', 'Rodríguez', 'Pérez López', 'Fernández', "D'Angelo", 'Gómez',
+    'Martínez Núñez', 'Sánchez', 'Peña', 'Álvarez', "O'Connor", 'Díaz',
+    'Müller', 'Castro', 'Ibáñez Ruiz', 'Romero', 'Suárez', 'Ávila',
+]
+_CALLES = [
+    'Av. Colón', 'San Martín', 'Bv. San Juan', 'Obispo Trejo', 'Av. Vélez Sársfield',
+    'Duarte Quirós', 'Rivadavia', '27 de Abril', 'Av. Fuerza Aérea Argentina',
+    'Ituzaingó', 'Pje. Güemes',
+]
+_BARRIOS = [
+    'Centro', 'Nueva Córdoba', 'Alberdi', 'General Paz', 'Güemes', 'Alta Córdoba',
+    'Villa Belgrano', 'Barrio Jardín', 'Los Plátanos',
+]
+_LOCALIDADES = [
+    ('Córdoba', '5000', '351'), ('Río Cuarto', '5800', '358'), ('Villa María', '5900', '353'),
+    ('Villa Carlos Paz', '5152', '3541'), ('San Francisco', '2400', '3564'),
+    ('Jesús María', '5220', '3525'), ('Alta Gracia', '5186', '3547'),
+    ('Río Tercero', '5850', '3571'), ('Bell Ville', '2550', '3537'), ('Buenos Aires', '1000', '11'),
+]
+_DOMINIOS = ['gmail.com', 'hotmail.com', 'yahoo.com.ar', 'cordoba.gov.ar', 'outlook.com']
+
+# Columnas documentadas en el sidebar de app.py
+COLUMNAS_BENEFICIARIO = [
+    'SEXO', 'NUMERO_DOCUMENTO', 'APELLIDO', 'NOMBRE', 'CUIL', 'FER_NAC', 'TEL_CELULAR',
+    'MAIL', 'CALLE', 'NUMERO', 'BARRIO', 'N_LOCALIDAD', 'CODIGO_POSTAL', 'BEN_COD_SUC',
+]
+COLUMNAS_APODERADO = [
+    'IdApoderado', 'APO_DNI', 'APO_SEXO', 'APO_APELLIDO', 'APO_NOMBRE', 'APO_CUIL',
+    'APO_FEC_NAC', 'APO_CELULAR', 'APO_EMAIL', 'APO_CALLE', 'APO_NRO', 'APO_BARRIO',
+    'APO_LOCALIDAD', 'APO_CP', 'APO_COD_SUC',
+]
+# Columnas de una exportación que el .HAB no usa (se repiten con sufijo numérico)
+COLUMNAS_SIN_USO = ['ID_INSCRIPCION', 'PROGRAMA', 'ESTADO', 'FEC_INSCRIPCION', 'OBSERVACIONES']
+
+
+def _cuil(dni, sexo):
+    """CUIL con dígito verificador válido para cada DNI (prefijo 20/27 según sexo)."""
+    prefijo = np.where(sexo == 'MUJER', '27', '20')
+    base = pd.Series(prefijo) + pd.Series(dni).str.zfill(8)
+    digitos = np.array(base.tolist(), dtype='U10').view(np.uint32).reshape(len(base), 10).astype(np.int64) - ord('0')
+    resto = (digitos * np.array([5, 4, 3, 2, 7, 6, 5, 4, 3, 2])).sum(axis=1) % 11
+    verificador = np.where(resto == 0, 0, 11 - resto)
+    # Los casos con verificador 10 se informan con prefijo 23 en la realidad;
+    # para el benchmark alcanza con un dígito
+    verificador = np.where(verificador == 10, 9, verificador)
+    return (base + pd.Series(verificador.astype(str))).to_numpy()
+
+
+def _celulares(prefijos, rng):
+    """Celulares en formatos variados: 0351 15..., +54 9 351..., sin 0, con guiones."""
+    n = len(prefijos)
+    largo_local = 10 - np.char.str_len(prefijos.astype(str))
+    locales = rng.integers(10 ** (largo_local - 1), 10 ** largo_local).astype(str)
+    formato = rng.integers(0, 6, size=n)
+    resultado = np.empty(n, dtype=object)
+    for i in range(n):
+        p, l, f = prefijos[i], locales[i], formato[i]
+        if f == 0:
+            resultado[i] = f"0{p}{l}"
+        elif f == 1:
+            resultado[i] = f"{p}{l}"
+        elif f == 2:
+            resultado[i] = f"0{p} 15{l}"
+        elif f == 3:
+            resultado[i] = f"+54 9 {p} {l}"
+        elif f == 4:
+            resultado[i] = f"({p}) {l[:3]}-{l[3:]}"
+        else:
+            resultado[i] = None
+    return resultado
+
+
+def _persona(n, rng, prefijo_columnas):
+    """Columnas de una persona (beneficiario o apoderado) con n filas."""
+    sexo = rng.choice(['MUJER', 'VARON'], size=n)
+    dni = rng.integers(10_000_000, 49_999_999, size=n).astype(str)
+    nacimiento = pd.to_datetime('1950-01-01') + pd.to_timedelta(rng.integers(0, 365 * 55, size=n), unit='D')
+    localidad = rng.integers(0, len(_LOCALIDADES), size=n)
+    nombres_localidad = np.array([l[0] for l in _LOCALIDADES])[localidad]
+    codigos_postales = np.array([l[1] for l in _LOCALIDADES])[localidad]
+    prefijos = np.array([l[2] for l in _LOCALIDADES])[localidad]
+
+    usuario = (pd.Series(rng.choice(_NOMBRES, size=n)).str.lower().str.replace(' ', '.')
+               + pd.Series(rng.integers(1, 9999, size=n).astype(str)))
+    # Un 15% de emails largos (>30 caracteres)
+    largo = rng.random(n) < 0.15
+    usuario = usuario.where(~largo, usuario + '.apellido.muy.largo.de.prueba')
+    mails = (usuario + '@' + pd.Series(rng.choice(_DOMINIOS, size=n))).to_numpy(dtype=object)
+
+    barrios = rng.choice(_BARRIOS, size=n).astype(object)
+    barrios[rng.random(n) < 0.2] = None
+
+    valores = {
+        'SEXO': sexo,
+        'DNI': dni,
+        'APELLIDO': rng.choice(_APELLIDOS, size=n),
+        'NOMBRE': rng.choice(_NOMBRES, size=n),
+        'CUIL': _cuil(dni, sexo),
+        'FEC_NAC': nacimiento.strftime('%Y%m%d').to_numpy(),
+        'CELULAR': _celulares(prefijos, rng),
+        'EMAIL': mails,
+        'CALLE': rng.choice(_CALLES, size=n),
+        'NRO': rng.integers(1, 9999, size=n).astype(str),
+        'BARRIO': barrios,
+        'LOCALIDAD': nombres_localidad,
+        'CP': codigos_postales,
+        'COD_SUC': rng.integers(100, 400, size=n).astype(str),
+    }
+    return {prefijo_columnas(clave): valor for clave, valor in valores.items()}
+
+
+def generar_datos_sinteticos(filas, proporcion_apoderados=0.7, semilla=0, columnas_sin_uso=0):
+    """
+    Genera un DataFrame sintético con las columnas de beneficiario y
+    apoderado que espera el generador .HAB (todas como texto, igual que
+    pd.read_excel(dtype=str)).
+
+    Args:
+        filas: Cantidad de filas
+        proporcion_apoderados: Proporción de filas con IdApoderado
+        semilla: Semilla del generador aleatorio (resultados reproducibles)
+        columnas_sin_uso: Cantidad de columnas extra que el .HAB no usa
+    """
+    rng = np.random.default_rng(semilla)
+
+    nombres_beneficiario = {
+        'DNI': 'NUMERO_DOCUMENTO', 'FEC_NAC': 'FER_NAC', 'CELULAR': 'TEL_CELULAR', 'EMAIL': 'MAIL',
+        'NRO': 'NUMERO', 'LOCALIDAD': 'N_LOCALIDAD', 'CP': 'CODIGO_POSTAL', 'COD_SUC': 'BEN_COD_SUC',
+    }
+    beneficiario = _persona(filas, rng, lambda clave: nombres_beneficiario.get(clave, clave))
+    apoderado = _persona(filas, rng, lambda clave: f'APO_{clave}')
+
+    df = pd.DataFrame({**beneficiario, **apoderado})
+    con_apoderado = rng.random(filas) < proporcion_apoderados
+    df['IdApoderado'] = np.where(con_apoderado, np.arange(1, filas + 1).astype(str), None)
+    df.loc[~con_apoderado, COLUMNAS_APODERADO[1:]] = None
+
+    extra = {}
+    for i in range(columnas_sin_uso):
+        nombre = COLUMNAS_SIN_USO[i % len(COLUMNAS_SIN_USO)]
+        if i >= len(COLUMNAS_SIN_USO):
+            nombre = f'{nombre}_{i // len(COLUMNAS_SIN_USO)}'
+        valores = pd.Series(rng.integers(0, 1_000_000, size=filas).astype(str)) + f' {nombre.lower()}'
+        extra[nombre] = valores.to_numpy(dtype=object)
+
+    return pd.concat(
+        [df[COLUMNAS_BENEFICIARIO + COLUMNAS_APODERADO], pd.DataFrame(extra, index=df.index)], axis=1
+    ).astype(object)
+
+
+def escribir_excel_sintetico(path, df):
+    """Escribe el DataFrame como .xlsx en modo write_only (memoria constante)."""
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(list(df.columns))
+    for fila in df.itertuples(index=False, name=None):
+        hoja.append(list(fila))
+    libro.save(path)
+
+
+# ==================== MEDICIÓN ====================
+
+def medir(funcion, repeticiones=3, medir_memoria=True):
+    """
+    Ejecuta `funcion` y devuelve (mejor tiempo en segundos, pico de memoria
+    en bytes, último resultado). El pico se mide con tracemalloc en una
+    ejecución aparte, para no distorsionar los tiempos (None si
+    medir_memoria es False).
+    """
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+
+    if not medir_memoria:
+        return mejor, None, resultado
+
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return mejor, pico, resultado
+
+
+def _etapa(nombre, filas, funcion, repeticiones, medir_memoria=True):
+    segundos, pico, resultado = medir(funcion, repeticiones, medir_memoria)
+    medicion = {
+        'etapa': nombre,
+        'filas': filas,
+        'segundos': segundos,
+        'filas_por_segundo': filas / segundos if segundos > 0 else None,
+        'pico_memoria_mb': pico / 1024 / 1024 if pico is not None else None,
+    }
+    memoria = f"{medicion['pico_memoria_mb']:>9.1f} MB" if pico is not None else f"{'-':>9}   "
+    print(f"   {nombre:<22} {segundos:>9.3f}s {medicion['filas_por_segundo'] or 0:>14,.0f} filas/s {memoria}")
+    return medicion, resultado
+
+
+def _memoria_datos_mb(df):
+    """Memoria del DataFrame (incluidos los textos) en MB."""
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+def benchmark_tamano(filas, directorio, repeticiones=3, incluir_excel=True, memoria_lectura=False,
+                     muestra_por_fila=2000, columnas_sin_uso=0):
+    """Ejecuta todas las mediciones para una cantidad de filas."""
+    print(f"\n📏 {filas:,} filas")
+    df = generar_datos_sinteticos(filas, columnas_sin_uso=columnas_sin_uso)
+    mediciones = []
+
+    if incluir_excel:
+        excel_path = os.path.join(directorio, f'sintetico_{filas}.xlsx')
+        escribir_excel_sintetico(excel_path, df)
+
+        def leer_completo():
+            # Referencia: todas las columnas, cada valor repetido guardado por fila
+            leido = pd.read_excel(excel_path, dtype=str)
+            leido.columns = leido.columns.str.strip()
+            return leido
+
+        # tracemalloc hace muy lenta la lectura con openpyxl: su memoria se mide solo si se pide
+        medicion, completo = _etapa('lectura_completa', filas, leer_completo, 1, medir_memoria=memoria_lectura)
+        medicion['memoria_datos_mb'] = _memoria_datos_mb(completo)
+        mediciones.append(medicion)
+        del completo
+
+        medicion, df = _etapa('lectura', filas, lambda: hab.leer_archivo_entrada(excel_path), 1,
+                              medir_memoria=memoria_lectura)
+        medicion['memoria_datos_mb'] = _memoria_datos_mb(df)
+        mediciones.append(medicion)
+
+        referencia = mediciones[-2]
+        print(f"   {'datos en memoria':<22} {medicion['memoria_datos_mb']:>8.1f} MB "
+              f"(todas las columnas: {referencia['memoria_datos_mb']:.1f} MB, "
+              f"{medicion['memoria_datos_mb'] / referencia['memoria_datos_mb'] - 1:+.0%}); "
+              f"lectura {medicion['segundos'] / referencia['segundos'] - 1:+.0%}")
+
+    df_apoderado = df[hab.mascara_apoderado(df)]
+    registros = len(df_apoderado)
+    fecha_alta = time.strftime('%Y%m%d')
+
+    medicion, valores = _etapa('mapeo', registros, lambda: hab.calcular_campos_hab(df_apoderado, fecha_alta), repeticiones)
+    mediciones.append(medicion)
+
+    medicion, buffer = _etapa('codificacion', registros, lambda: hab.codificar_campos_hab(valores, registros), repeticiones)
+    mediciones.append(medicion)
+
+    hab_path = os.path.join(directorio, f'sintetico_{filas}.HAB')
+
+    def escribir():
+        with open(hab_path, 'wb') as f:
+            f.write(buffer.data)
+
+    medicion, _ = _etapa('escritura', registros, escribir, repeticiones)
+    mediciones.append(medicion)
+
+    medicion, _ = _etapa('generar_archivo_hab', filas, lambda: hab.generar_archivo_hab(df, hab_path), repeticiones)
+    mediciones.append(medicion)
+
+    # Funciones fila por fila, sobre una muestra
+    muestra = df_apoderado.head(muestra_por_fila)
+    filas_muestra = list(muestra.iterrows())
+    apellidos = muestra['APO_APELLIDO'].tolist()
+    celulares = muestra['APO_CELULAR'].tolist()
+    por_fila = [
+        ('generar_linea_hab', lambda: [hab.generar_linea_hab(row) for _, row in filas_muestra]),
+        ('sanitizar_texto', lambda: [hab.sanitizar_texto(valor) for valor in apellidos]),
+        ('procesar_celular_post', lambda: [hab.procesar_celular_post(valor) for valor in celulares]),
+    ]
+    for nombre, funcion in por_fila:
+        medicion, _ = _etapa(nombre, len(muestra), funcion, repeticiones)
+        mediciones.append(medicion)
+
+    return mediciones
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def medir_arranque(repeticiones=5):
+    """
+    Mide el arranque en frío de procesar_excel_directo: cada comando se
+    ejecuta en un intérprete nuevo y se informa la mediana (segundos) y si
+    pandas quedó cargado. 'python' (intérprete vacío) sirve de referencia.
+    """
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(directorio, 'procesar_excel_directo.py')
+    comprobar_pandas = "import sys; print('pandas' in sys.modules)"
+    comandos = [
+        ('python', ['-c', comprobar_pandas]),
+        ('import', ['-c', f"import procesar_excel_directo; {comprobar_pandas}"]),
+        ('--help', [script, '--help']),
+    ]
+
+    mediciones = []
+    print(f"   {'comando':<10} {'mediana':>10} {'pandas':>8}")
+    for nombre, argumentos in comandos:
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            salida = subprocess.run([sys.executable, *argumentos], capture_output=True, text=True,
+                                    cwd=directorio, check=True).stdout
+            tiempos.append(time.perf_counter() - inicio)
+        tiempos.sort()
+        pandas_cargado = salida.strip().splitlines()[-1] == 'True' if nombre != '--help' else None
+        medicion = {
+            'comando': nombre,
+            'segundos': tiempos[len(tiempos) // 2],
+            'pandas_cargado': pandas_cargado,
+        }
+        marca = '-' if pandas_cargado is None else ('sí' if pandas_cargado else 'no')
+        print(f"   {nombre:<10} {medicion['segundos']:>9.3f}s {marca:>8}")
+        mediciones.append(medicion)
+    return mediciones
+
+
+def comparar_resultados(anterior, actual):
+    """Imprime la variación de filas/s y memoria respecto de una ejecución anterior."""
+    previas = {(m['etapa'], m['filas']): m for m in anterior['mediciones']}
+    print(f"\n📊 Comparación con {anterior.get('commit') or 'ejecución anterior'}:")
+    for m in actual['mediciones']:
+        previa = previas.get((m['etapa'], m['filas']))
+        if not previa or not previa['filas_por_segundo'] or not m['filas_por_segundo']:
+            continue
+        velocidad = m['filas_por_segundo'] / previa['filas_por_segundo'] - 1
+        icono = '⚠️ ' if velocidad < -0.10 else '  '
+        linea = f" {icono} {m['etapa']:<22} {m['filas']:>9,} filas  velocidad {velocidad:+7.1%}"
+        if m['pico_memoria_mb'] is not None and previa['pico_memoria_mb'] is not None:
+            linea += f"  memoria {m['pico_memoria_mb'] - previa['pico_memoria_mb']:+8.1f} MB"
+        if m.get('memoria_datos_mb') is not None and previa.get('memoria_datos_mb') is not None:
+            linea += f"  datos {m['memoria_datos_mb'] - previa['memoria_datos_mb']:+8.1f} MB"
+        print(linea)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del generador .HAB con datos sintéticos")
+    subparsers = parser.add_subparsers(dest='comando')
+
+    generar = subparsers.add_parser('generar', help="Solo generar una planilla sintética")
+    generar.add_argument('salida', help="Ruta .xlsx o .csv")
+    generar.add_argument('--filas', type=int, default=1000)
+    generar.add_argument('--apoderados', type=float, default=0.7, help="Proporción con apoderado")
+    generar.add_argument('--semilla', type=int, default=0)
+    generar.add_argument('--columnas-sin-uso', type=int, default=0, help="Columnas extra que el .HAB no usa")
+
+    arranque = subparsers.add_parser('arranque', help="Solo medir el arranque del módulo y la CLI")
+    arranque.add_argument('--repeticiones', type=int, default=5)
+
+    parser.add_argument('--filas', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--sin-excel', action='store_true', help="No medir la lectura de .xlsx")
+    parser.add_argument('--memoria-lectura', action='store_true',
+                        help="Medir también el pico de memoria de la lectura (mucho más lento)")
+    parser.add_argument('--columnas-sin-uso', type=int, default=0,
+                        help="Columnas extra que el .HAB no usa (como en una exportación real)")
+    parser.add_argument('--salida', help="Guardar resultados en este JSON")
+    parser.add_argument('--comparar', help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args(argv)
+
+    if args.comando == 'generar':
+        df = generar_datos_sinteticos(args.filas, args.apoderados, args.semilla, args.columnas_sin_uso)
+        if args.salida.lower().endswith('.csv'):
+            df.to_csv(args.salida, index=False)
+        else:
+            escribir_excel_sintetico(args.salida, df)
+        print(f"✅ {args.filas:,} filas sintéticas guardadas en {args.salida}")
+        return 0
+
+    if args.comando == 'arranque':
+        print(f"🚀 Arranque de procesar_excel_directo (commit {_commit_actual()}, mediana de {args.repeticiones})")
+        medir_arranque(args.repeticiones)
+        return 0
+
+    resultados = {
+        'commit': _commit_actual(),
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'pandas': pd.__version__,
+        'plataforma': platform.platform(),
+        'mediciones': [],
+    }
+    print(f"🚀 Benchmark .HAB (commit {resultados['commit']})")
+    print(f"   {'etapa':<22} {'tiempo':>10} {'velocidad':>21} {'pico mem.':>12}")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        for filas in args.filas:
+            resultados['mediciones'].extend(
+                benchmark_tamano(filas, directorio, args.repeticiones, incluir_excel=not args.sin_excel,
+                                 memoria_lectura=args.memoria_lectura, columnas_sin_uso=args.columnas_sin_uso)
+            )
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            comparar_resultados(json.load(f), resultados)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
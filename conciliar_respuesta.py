@@ -0,0 +1,284 @@
+"""
+Conciliación del archivo de respuesta del banco con los registros enviados.
+
+El banco devuelve los registros del .HAB con el mismo diseño, completando
+NRO CUENTA en las altas y hasta siete MOTIVO DEL ERROR (códigos de 5
+caracteres) en los rechazos. La respuesta se abre con np.memmap como una
+matriz registros × bytes y cada campo se extrae como una columna, sin
+recorrer los registros uno por uno. Las claves (CUIL y DNI, normalizadas
+como en el registro de enviados) se indexan en un pandas.Index, que es una
+tabla hash: cada fila de origen se busca por CUIL y, si no está, por DNI.
+
+El origen puede ser el archivo de auditoría del .HAB (auditoria_*.csv,
+.parquet o .xlsx, que ya trae la fila de Excel de cada registro) o la
+exportación original (.xlsx, .csv o .parquet), que se vuelve a mapear
+como al generar el .HAB.
+
+El resultado tiene una fila por registro de origen con su estado: 'alta'
+(cuenta abierta, con NRO CUENTA), 'rechazo' (con los motivos), 'pendiente'
+(en la respuesta pero sin cuenta ni motivos), 'sin_respuesta' o
+'sin_clave' (sin CUIL ni DNI válidos, no se puede buscar); al final, los
+registros de la respuesta que no corresponden a ninguna fila de origen
+('no_enviado').
+
+Uso desde línea de comandos:
+    python conciliar_respuesta.py respuesta.HAB auditoria_archivo_20250101_120000.csv
+    python conciliar_respuesta.py respuesta.HAB exportacion.xlsx --salida conciliacion.csv
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from procesar_excel_directo import (
+    LAYOUT_HAB,
+    ANCHO_REGISTRO_HAB,
+    calcular_campos_hab,
+    compilar_plan_origen,
+    formatear_columna,
+    leer_archivo_entrada,
+    mascara_apoderado,
+)
+
+LARGO_REGISTRO = ANCHO_REGISTRO_HAB + 2
+CAMPOS_HAB = {campo.nombre: campo for campo in LAYOUT_HAB}
+CAMPOS_MOTIVO = [campo.nombre for campo in LAYOUT_HAB if campo.nombre.startswith('MOTIVO DEL ERROR')]
+
+# Campos de la respuesta que se leen (además de los motivos)
+CAMPOS_RESPUESTA = {
+    'cuil': 'NRO CLAVE FISCAL',
+    'nro_documento': 'NRO DOCUMENTO',
+    'nro_cuenta': 'NRO CUENTA',
+    'sucursal': 'SUCURSAL',
+}
+
+# Columnas del archivo de auditoría que pasan al resultado
+COLUMNAS_ORIGEN = [
+    'fila_excel', 'IdApoderado', 'origen', 'CUIL', 'NRO_DOCUMENTO', 'PRIMER_APELLIDO', 'PRIMER_NOMBRE',
+]
+
+ESTADOS = ('alta', 'rechazo', 'pendiente', 'sin_respuesta', 'sin_clave', 'no_enviado')
+
+
+def _normalizar_claves(valores):
+    """
+    Versión columnar de registro_enviados.normalizar_clave: dígitos sin
+    ceros a la izquierda, NA si no hay dígitos.
+    """
+    claves = pd.Series(valores, dtype='string').str.replace(r'\D', '', regex=True).str.lstrip('0')
+    return claves.mask(claves.fillna('') == '')
+
+
+def _claves_enviadas(valores, nombre):
+    """
+    Claves normalizadas de los valores de origen tal como quedaron en el
+    campo `nombre` del .HAB (mismo formato y truncado que al generarlo).
+    """
+    campo = CAMPOS_HAB[nombre]
+    return _normalizar_claves(formatear_columna(pd.Series(valores), campo.longitud, campo.tipo, campo.default))
+
+
+def _columna_campo(registros, nombre):
+    """Valores sin relleno del campo `nombre` de cada registro (Serie de texto)."""
+    campo = CAMPOS_HAB[nombre]
+    # En latin-1 cada byte es su propio código Unicode: basta con ensanchar a UCS-4
+    columna = registros[:, campo.offset:campo.offset + campo.longitud].astype(np.uint32)
+    return pd.Series(columna.view(f'U{campo.longitud}').ravel(), dtype=object).str.strip()
+
+
+def leer_respuesta(path):
+    """
+    Lee el archivo de respuesta del banco.
+
+    Returns:
+        DataFrame con linea_respuesta (desde 1), CAMPOS_RESPUESTA, motivos
+        (códigos separados por espacio) y estado ('alta', 'rechazo' o
+        'pendiente')
+
+    Raises:
+        ValueError: Si el tamaño no es múltiplo del largo de registro
+    """
+    tamano = os.path.getsize(path)
+    if tamano % LARGO_REGISTRO:
+        raise ValueError(f"{path}: el tamaño no es múltiplo del largo de registro ({LARGO_REGISTRO} bytes)")
+    if tamano:
+        registros = np.memmap(path, dtype=np.uint8, mode='r').reshape(-1, LARGO_REGISTRO)
+    else:
+        registros = np.empty((0, LARGO_REGISTRO), dtype=np.uint8)
+
+    respuesta = pd.DataFrame({
+        columna: _columna_campo(registros, nombre) for columna, nombre in CAMPOS_RESPUESTA.items()
+    })
+    respuesta.insert(0, 'linea_respuesta', np.arange(1, len(registros) + 1))
+
+    # La mayoría de los registros no tiene motivos: solo se leen los que tienen alguno
+    primero, ultimo = CAMPOS_HAB[CAMPOS_MOTIVO[0]], CAMPOS_HAB[CAMPOS_MOTIVO[-1]]
+    con_motivo = np.flatnonzero(
+        (registros[:, primero.offset:ultimo.offset + ultimo.longitud] != ord(' ')).any(axis=1)
+    )
+    motivos = [_columna_campo(registros[con_motivo], nombre) for nombre in CAMPOS_MOTIVO]
+    respuesta['motivos'] = ''
+    if len(con_motivo):
+        respuesta.loc[con_motivo, 'motivos'] = (
+            motivos[0].str.cat(motivos[1:], sep=' ').str.replace(r'\s+', ' ', regex=True).str.strip().to_numpy()
+        )
+    del registros
+
+    con_cuenta = _normalizar_claves(respuesta['nro_cuenta']).notna()
+    respuesta['estado'] = np.select(
+        [respuesta['motivos'] != '', con_cuenta], ['rechazo', 'alta'], default='pendiente'
+    )
+    return respuesta
+
+
+def leer_origen(path):
+    """
+    Registros enviados: del archivo de auditoría (auditoria_*) o, si no, de
+    la exportación original, mapeada como al generar el .HAB (solo las
+    filas con IdApoderado).
+
+    Returns:
+        DataFrame con COLUMNAS_ORIGEN
+    """
+    if os.path.basename(path).startswith('auditoria_'):
+        origen = leer_archivo_entrada(path, columnas=COLUMNAS_ORIGEN)
+        for columna in COLUMNAS_ORIGEN:
+            if columna not in origen.columns:
+                origen[columna] = None
+        return origen[COLUMNAS_ORIGEN]
+
+    df = leer_archivo_entrada(path)
+    mascara = mascara_apoderado(df).to_numpy(dtype=bool)
+    registros = df[mascara]
+    valores = calcular_campos_hab(registros, None, np.ones(len(registros), dtype=bool),
+                                  compilar_plan_origen(df.columns))
+    origen = pd.DataFrame({
+        # +2: encabezado en la fila 1 y filas de Excel numeradas desde 1
+        'fila_excel': np.flatnonzero(mascara) + 2,
+        'IdApoderado': registros['IdApoderado'].to_numpy(dtype=object),
+        'origen': 'apoderado',
+    })
+    for columna in COLUMNAS_ORIGEN[3:]:
+        origen[columna] = pd.Series(valores[columna]).to_numpy(dtype=object)
+    return origen
+
+
+def _con_ocurrencia(claves):
+    """
+    Claves no vacías con su número de aparición ('clave:0', 'clave:1', ...)
+    y sus posiciones, para emparejar claves repetidas por orden.
+    """
+    claves = claves.reset_index(drop=True)
+    validas = claves[claves.notna()]
+    ocurrencia = validas.groupby(validas).cumcount()
+    return (validas + ':' + ocurrencia.astype(str)).to_numpy(), validas.index.to_numpy()
+
+
+def _buscar(claves_origen, claves_respuesta):
+    """
+    Posición en la respuesta de cada clave de origen (-1 si no está). Si
+    una clave se repite, la n-ésima fila de origen con esa clave se empareja
+    con el n-ésimo registro de la respuesta que la tiene.
+    """
+    posicion = np.full(len(claves_origen), -1, dtype=np.int64)
+    claves_respuesta, posiciones_respuesta = _con_ocurrencia(claves_respuesta)
+    claves_origen, posiciones_origen = _con_ocurrencia(claves_origen)
+    encontrados = pd.Index(claves_respuesta).get_indexer(claves_origen)
+    posicion[posiciones_origen] = np.where(encontrados >= 0, posiciones_respuesta[encontrados], -1)
+    return posicion
+
+
+def conciliar(respuesta_path, origen_path):
+    """
+    Cruza el archivo de respuesta del banco con los registros enviados,
+    por CUIL y, si no coincide, por DNI.
+
+    Returns:
+        DataFrame con COLUMNAS_ORIGEN, linea_respuesta, nro_cuenta, motivos
+        y estado (ver ESTADOS): una fila por registro de origen y, al final,
+        los registros de la respuesta sin fila de origen
+    """
+    respuesta = leer_respuesta(respuesta_path)
+    origen = leer_origen(origen_path).reset_index(drop=True)
+
+    cuils = _claves_enviadas(origen['CUIL'], 'NRO CLAVE FISCAL')
+    documentos_origen = _claves_enviadas(origen['NRO_DOCUMENTO'], 'NRO DOCUMENTO')
+    posicion = _buscar(cuils, _normalizar_claves(respuesta['cuil']))
+    
+    # Sin coincidencia por CUIL: por DNI, entre los registros de la respuesta todavía libres
+    sin_cuil = np.flatnonzero(posicion < 0)
+    libres = np.ones(len(respuesta), dtype=bool)
+    libres[posicion[posicion >= 0]] = False
+    if len(sin_cuil) and libres.any():
+        documentos = _normalizar_claves(respuesta['nro_documento']).where(libres)
+        posicion[sin_cuil] = _buscar(documentos_origen.iloc[sin_cuil], documentos)
+
+    encontrados = posicion >= 0
+    resultado = origen.copy()
+    for columna in ('linea_respuesta', 'nro_cuenta', 'motivos', 'estado'):
+        valores = np.full(len(origen), None, dtype=object)
+        valores[encontrados] = respuesta[columna].to_numpy(dtype=object)[posicion[encontrados]]
+        resultado[columna] = valores
+    sin_clave = (cuils.isna() & documentos_origen.isna()).to_numpy()
+    resultado['estado'] = np.where(
+        encontrados, resultado['estado'], np.where(sin_clave, 'sin_clave', 'sin_respuesta')
+    )
+
+    no_enviados = np.ones(len(respuesta), dtype=bool)
+    no_enviados[posicion[encontrados]] = False
+    sobrantes = respuesta[no_enviados]
+    sobrantes = pd.DataFrame({
+        'CUIL': sobrantes['cuil'],
+        'NRO_DOCUMENTO': sobrantes['nro_documento'],
+        'linea_respuesta': sobrantes['linea_respuesta'],
+        'nro_cuenta': sobrantes['nro_cuenta'],
+        'motivos': sobrantes['motivos'],
+        'estado': 'no_enviado',
+    })
+    if sobrantes.empty:
+        return resultado
+    return pd.concat([resultado, sobrantes], ignore_index=True)[resultado.columns]
+
+
+def resumen_motivos(conciliacion):
+    """Cantidad de rechazos por código de motivo, de mayor a menor."""
+    motivos = conciliacion.loc[conciliacion['estado'] == 'rechazo', 'motivos'].str.split().explode()
+    return motivos.value_counts()
+
+
+# ==================== LÍNEA DE COMANDOS ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concilia la respuesta del banco con los registros enviados")
+    parser.add_argument('respuesta', help="Archivo de respuesta del banco (diseño .HAB)")
+    parser.add_argument('origen', help="Archivo de auditoría (auditoria_*) o exportación original")
+    parser.add_argument('--salida', help="CSV de resultado (por defecto conciliacion_<respuesta>.csv)")
+    args = parser.parse_args(argv)
+
+    try:
+        conciliacion = conciliar(args.respuesta, args.origen)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    salida = args.salida or os.path.join(
+        os.path.dirname(args.respuesta), f"conciliacion_{os.path.splitext(os.path.basename(args.respuesta))[0]}.csv"
+    )
+    conciliacion.to_csv(salida, index=False, encoding='utf-8-sig')
+
+    cantidades = conciliacion['estado'].value_counts()
+    print(f"🏦 {os.path.basename(args.respuesta)} ↔ {os.path.basename(args.origen)}")
+    for estado in ESTADOS:
+        print(f"   {cantidades.get(estado, 0):>8}  {estado}")
+    motivos = resumen_motivos(conciliacion)
+    if not motivos.empty:
+        print("   Motivos de rechazo:")
+        for codigo, cantidad in motivos.head(10).items():
+            print(f"   {cantidad:>8}  {codigo}")
+    print(f"📄 Detalle guardado en: {salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
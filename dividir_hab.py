@@ -0,0 +1,268 @@
+"""
+División de archivos .HAB en partes, por sucursal, por cantidad de
+registros o por tamaño en bytes.
+
+El canal de subida del banco limita el tamaño de los archivos y
+operaciones trabaja con un archivo por sucursal. Como los registros son de
+ancho fijo, el .HAB se abre con np.memmap como una matriz registros × bytes
+y cada parte es una selección de filas: no se decodifica ni se vuelve a
+codificar nada. Las partes se escriben en paralelo (hilos: la escritura y
+el SHA-256 liberan el GIL), como máximo `workers` a la vez y cada una por
+trozos de FILAS_POR_ESCRITURA registros, así la memoria no depende del
+tamaño del archivo. Se listan en particiones_<archivo>.json con la
+cantidad de registros, los bytes y el SHA-256 de cada una.
+
+Cada parte se escribe igual que el .HAB completo: <parte>.HAB.parcial,
+confirmada en disco, renombrada y con su archivo de control .HAB.ok (ver
+finalizar_archivo_hab). El .HAB completo se borra recién cuando todas las
+partes y el manifiesto están terminados.
+
+Uso desde línea de comandos:
+    python dividir_hab.py archivo.HAB sucursal
+    python dividir_hab.py archivo.HAB registros:50000
+    python dividir_hab.py archivo.HAB bytes:10000000
+    python dividir_hab.py archivo.HAB sucursal:50000    # por sucursal y hasta 50000 registros
+"""
+import argparse
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from procesar_excel_directo import (
+    LAYOUT_HAB, ANCHO_REGISTRO_HAB, SUFIJO_CONTROL_HAB, SUFIJO_PARCIAL, finalizar_archivo_hab,
+    _borrar_si_existe, _confirmar_archivo, _guardar_json_atomico, _texto_campo,
+)
+
+LARGO_REGISTRO = ANCHO_REGISTRO_HAB + 2
+# Registros que se copian a memoria por escritura (unos 14 MB)
+FILAS_POR_ESCRITURA = 10_000
+CAMPO_SUCURSAL = next(campo for campo in LAYOUT_HAB if campo.nombre == 'SUCURSAL')
+
+# Criterios de división; 'registros' y 'bytes' requieren un máximo por parte
+MODOS_DIVISION = ('sucursal', 'registros', 'bytes')
+
+
+def parsear_division(division):
+    """
+    Interpreta una división 'modo' o 'modo:maximo' (ver MODOS_DIVISION).
+
+    Returns:
+        Tupla (modo, maximo) - maximo es None si no se indicó
+
+    Raises:
+        ValueError: Si el modo no existe o el máximo no es un entero positivo
+    """
+    modo, _, maximo = division.partition(':')
+    if modo not in MODOS_DIVISION:
+        raise ValueError(f"División no válida: '{division}' (opciones: {', '.join(MODOS_DIVISION)})")
+    if not maximo:
+        if modo != 'sucursal':
+            raise ValueError(f"La división por {modo} requiere un máximo, p. ej. '{modo}:50000'")
+        return modo, None
+    if not maximo.isdigit() or int(maximo) <= 0:
+        raise ValueError(f"Máximo por parte no válido: '{maximo}'")
+    return modo, int(maximo)
+
+
+def _registros_por_parte(modo, maximo):
+    """Registros por parte (None: sin límite) según el criterio de división."""
+    if modo != 'bytes':
+        return maximo
+    if maximo < LARGO_REGISTRO:
+        raise ValueError(f"El máximo por parte ({maximo} bytes) es menor que un registro ({LARGO_REGISTRO} bytes)")
+    return maximo // LARGO_REGISTRO
+
+
+def _partes(registros, modo, maximo):
+    """
+    Genera (sufijo, sucursal, índices) de cada parte, en el orden del
+    archivo original. Por sucursal, los registros de cada una conservan su
+    orden relativo.
+    """
+    por_parte = _registros_por_parte(modo, maximo)
+
+    if modo == 'sucursal':
+        offset = CAMPO_SUCURSAL.offset
+        codigos = np.ascontiguousarray(registros[:, offset:offset + CAMPO_SUCURSAL.longitud])
+        codigos = codigos.view(f'S{CAMPO_SUCURSAL.longitud}').ravel()
+        sucursales, grupo = np.unique(codigos, return_inverse=True)
+        orden = np.argsort(grupo, kind='stable')
+        limites = np.cumsum(np.bincount(grupo, minlength=len(sucursales)))[:-1]
+        grupos = [
+            (f"suc{sucursal.decode('latin-1').strip()}", sucursal.decode('latin-1').strip(), indices)
+            for sucursal, indices in zip(sucursales, np.split(orden, limites))
+        ]
+    else:
+        grupos = [('', None, np.arange(len(registros)))]
+
+    for sufijo, sucursal, indices in grupos:
+        # Una sucursal que entra en una sola parte no lleva número
+        if por_parte is None or (sufijo and len(indices) <= por_parte):
+            yield sufijo, sucursal, indices
+            continue
+        for numero, inicio in enumerate(range(0, len(indices), por_parte), start=1):
+            yield '_'.join(filter(None, (sufijo, f"{numero:03d}"))), sucursal, indices[inicio:inicio + por_parte]
+
+
+def _escribir_parte(path, registros, indices):
+    """
+    Escribe los registros `indices` en path (con su .HAB.ok, ver
+    finalizar_archivo_hab) por trozos de FILAS_POR_ESCRITURA y devuelve
+    (bytes, sha256).
+    """
+    sha256 = hashlib.sha256()
+    parcial = path + SUFIJO_PARCIAL
+    try:
+        with open(parcial, 'wb') as f:
+            for inicio in range(0, len(indices), FILAS_POR_ESCRITURA):
+                trozo = indices[inicio:inicio + FILAS_POR_ESCRITURA]
+                # Registros consecutivos: se escriben directo del memmap, sin copiarlos
+                if trozo[-1] - trozo[0] == len(trozo) - 1:
+                    datos = registros[trozo[0]:trozo[-1] + 1]
+                else:
+                    datos = registros[trozo]
+                f.write(datos.data)
+                sha256.update(datos.data)
+            _confirmar_archivo(f)
+        finalizar_archivo_hab(parcial, path, len(indices), sha256.hexdigest())
+    except BaseException:
+        _borrar_si_existe(parcial)
+        raise
+    return len(indices) * LARGO_REGISTRO, sha256.hexdigest()
+
+
+def _borrar_parte(path):
+    """Borra una parte (y su archivo de control) de una división que no se completó."""
+    for sufijo in ('', SUFIJO_CONTROL_HAB, SUFIJO_PARCIAL):
+        _borrar_si_existe(path + sufijo)
+
+
+def dividir_archivo_hab(hab_path, division, workers=None, registro=None, conservar=False):
+    """
+    Divide un .HAB en partes <archivo>_<sufijo>.HAB en la misma carpeta y
+    guarda el manifiesto particiones_<archivo>.json.
+
+    Args:
+        hab_path: Ruta del .HAB completo
+        division: Criterio 'sucursal', 'registros:N', 'bytes:N' o
+            'sucursal:N' (por sucursal y como máximo N registros por parte)
+        workers: Partes que se escriben a la vez (por defecto, una por CPU)
+        registro: RegistroEnviados donde las personas del .HAB completo pasan
+            a figurar con el nombre de la parte en la que quedaron (opcional)
+        conservar: Si es False (por defecto), se borra el .HAB completo (y su
+            archivo de control .HAB.ok) una vez terminadas las partes y el
+            manifiesto; si algo falla, se conserva y se borran las partes
+
+    Returns:
+        Dict del manifiesto: archivo_origen, division, registros, fecha,
+        manifiesto_path y partes (archivo, sucursal, registros, bytes, sha256)
+    """
+    modo, maximo = parsear_division(division)
+    directorio = os.path.dirname(hab_path)
+    base = os.path.splitext(os.path.basename(hab_path))[0]
+
+    tamano = os.path.getsize(hab_path)
+    if tamano % LARGO_REGISTRO:
+        raise ValueError(f"{hab_path}: el tamaño no es múltiplo del largo de registro ({LARGO_REGISTRO} bytes)")
+    if tamano:
+        registros = np.memmap(hab_path, dtype=np.uint8, mode='r').reshape(-1, LARGO_REGISTRO)
+    else:
+        registros = np.empty((0, LARGO_REGISTRO), dtype=np.uint8)
+
+    partes = [
+        {
+            'archivo': f"{base}_{sufijo}.HAB",
+            'sucursal': sucursal,
+            'indices': indices,
+        }
+        for sufijo, sucursal, indices in _partes(registros, modo, maximo)
+    ]
+    if not partes:
+        # Sin registros: una sola parte vacía, así siempre hay algo que enviar
+        # con el nombre que figura en el manifiesto
+        partes = [{'archivo': f"{base}_001.HAB", 'sucursal': None, 'indices': np.arange(0)}]
+
+    manifiesto = {
+        'archivo_origen': os.path.basename(hab_path),
+        'division': division,
+        'registros': len(registros),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+    }
+    manifiesto_path = os.path.join(directorio, f"particiones_{base}.json")
+    try:
+        # El pool limita las partes en curso: las que esperan solo tienen sus índices
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            futuros = [
+                pool.submit(_escribir_parte, os.path.join(directorio, parte['archivo']), registros, parte['indices'])
+                for parte in partes
+            ]
+            for parte, futuro in zip(partes, futuros):
+                parte['bytes'], parte['sha256'] = futuro.result()
+        manifiesto['partes'] = [
+            {
+                'archivo': parte['archivo'],
+                'sucursal': parte['sucursal'],
+                'registros': len(parte['indices']),
+                'bytes': parte['bytes'],
+                'sha256': parte['sha256'],
+            }
+            for parte in partes
+        ]
+        _guardar_json_atomico(manifiesto_path, manifiesto)
+    except BaseException:
+        for parte in partes:
+            _borrar_parte(os.path.join(directorio, parte['archivo']))
+        raise
+    manifiesto['manifiesto_path'] = manifiesto_path
+
+    if registro is not None:
+        _registrar_partes(registro, registros, partes, os.path.basename(hab_path))
+
+    del registros
+    if not conservar:
+        # Las partes tienen su SHA-256 en el manifiesto y en su .HAB.ok
+        os.remove(hab_path)
+        _borrar_si_existe(hab_path + SUFIJO_CONTROL_HAB)
+    return manifiesto
+
+
+def _registrar_partes(registro, registros, partes, archivo_origen):
+    """Pasa las personas del .HAB completo a las partes donde quedaron, en una transacción."""
+    # Solo las columnas de CUIL y DNI se copian, una vez para todo el archivo
+    cuils = _texto_campo(registros, 'NRO CLAVE FISCAL')
+    documentos = _texto_campo(registros, 'NRO DOCUMENTO')
+    with registro.transaccion():
+        registro.olvidar(archivo_origen)
+        for parte in partes:
+            registro.registrar(cuils[parte['indices']], documentos[parte['indices']], parte['archivo'])
+
+
+# ==================== LÍNEA DE COMANDOS ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Divide un archivo .HAB por sucursal, registros o bytes")
+    parser.add_argument('archivo')
+    parser.add_argument('division', help="sucursal, registros:N, bytes:N o sucursal:N")
+    parser.add_argument('--workers', type=int, default=None, help="Partes que se escriben a la vez (por defecto, una por CPU)")
+    parser.add_argument('--conservar', action='store_true', help="No borrar el .HAB completo")
+    args = parser.parse_args(argv)
+
+    try:
+        manifiesto = dividir_archivo_hab(args.archivo, args.division, workers=args.workers, conservar=args.conservar)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    print(f"✂️  {manifiesto['archivo_origen']}: {manifiesto['registros']} registros "
+          f"en {len(manifiesto['partes'])} archivos")
+    for parte in manifiesto['partes']:
+        print(f"   {parte['registros']:>8}  {parte['bytes']:>12}  {parte['sha256'][:12]}  {parte['archivo']}")
+    print(f"📄 Manifiesto: {manifiesto['manifiesto_path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,373 @@
+"""
+Lectura, validación y comparación de archivos .HAB.
+
+El archivo se abre con mmap y los campos se decodifican recién cuando se
+piden, por offset, usando el mismo diseño de registro que el generador
+(LAYOUT_HAB). Así se pueden revisar archivos de cientos de MB sin cargarlos
+en memoria como strings.
+
+Junto a cada .HAB el generador deja <archivo>.HAB.ok con la cantidad de
+registros, los bytes y el SHA-256; validar lo compara con el archivo para
+detectar un .HAB incompleto o modificado después de generarlo.
+
+Uso desde línea de comandos:
+    python lector_hab.py validar archivo.HAB
+    python lector_hab.py mostrar archivo.HAB 1
+    python lector_hab.py comparar anterior.HAB nuevo.HAB --clave CUIL
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+
+import numpy as np
+
+from procesar_excel_directo import LAYOUT_HAB, ANCHO_REGISTRO_HAB, SUFIJO_CONTROL_HAB
+
+FIN_LINEA = b'\r\n'
+LARGO_REGISTRO = ANCHO_REGISTRO_HAB + len(FIN_LINEA)
+CAMPOS_HAB = {campo.nombre: campo for campo in LAYOUT_HAB}
+
+# Claves posibles para comparar archivos
+CLAVES_COMPARACION = {
+    'DNI': 'NRO DOCUMENTO',
+    'CUIL': 'NRO CLAVE FISCAL',
+}
+
+# Registros por bloque al validar con numpy (acota la memoria temporal)
+_REGISTROS_POR_BLOQUE = 20000
+
+
+class ArchivoHAB:
+    """
+    Archivo .HAB abierto con mmap, de solo lectura.
+
+    Se usa como context manager:
+        with ArchivoHAB('archivo.HAB') as hab:
+            print(len(hab), hab.campo(0, 'NRO DOCUMENTO'))
+
+    Los índices de registro empiezan en 0 y suponen registros de ancho
+    correcto; usar validar() para detectar registros mal formados.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._archivo = open(path, 'rb')
+        self.tamano = os.fstat(self._archivo.fileno()).st_size
+        # mmap no admite archivos vacíos
+        self._datos = mmap.mmap(self._archivo.fileno(), 0, access=mmap.ACCESS_READ) if self.tamano else b''
+
+    def close(self):
+        if isinstance(self._datos, mmap.mmap):
+            self._datos.close()
+        self._archivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.tamano // LARGO_REGISTRO
+
+    def registro_bytes(self, indice):
+        """Bytes del registro `indice` (sin CR-LF)."""
+        inicio = indice * LARGO_REGISTRO
+        return self._datos[inicio:inicio + ANCHO_REGISTRO_HAB]
+
+    def campo(self, indice, nombre):
+        """Valor crudo (con relleno) del campo `nombre` del registro `indice`."""
+        campo = CAMPOS_HAB[nombre]
+        inicio = indice * LARGO_REGISTRO + campo.offset
+        return self._datos[inicio:inicio + campo.longitud].decode('latin-1')
+
+    def registro(self, indice):
+        """Dict nombre de campo → valor crudo del registro `indice`."""
+        datos = self.registro_bytes(indice)
+        return {
+            campo.nombre: datos[campo.offset:campo.offset + campo.longitud].decode('latin-1')
+            for campo in LAYOUT_HAB
+        }
+
+    def claves(self, nombre_campo):
+        """Genera (valor del campo clave sin relleno, índice) para cada registro."""
+        for indice in range(len(self)):
+            yield self.campo(indice, nombre_campo).strip(), indice
+
+    def validar(self, max_errores=100):
+        """
+        Valida la estructura del archivo.
+
+        - Cada registro debe tener exactamente ANCHO_REGISTRO_HAB caracteres
+          y terminar en CR-LF
+        - TIPO DE REGISTRO debe ser 'A'
+        - Los campos numéricos (N) deben contener solo dígitos
+
+        Returns:
+            Lista de tuplas (nro_linea, mensaje), con nro_linea desde 1.
+            Como máximo max_errores.
+        """
+        errores = self._validar_anchos(max_errores)
+        if errores:
+            # Con registros de ancho incorrecto los offsets no son confiables
+            return errores
+        return self._validar_campos(max_errores)
+
+    def _validar_anchos(self, max_errores):
+        errores = []
+        datos = self._datos
+
+        if not self.tamano:
+            return errores
+
+        # Camino rápido: todos los CR-LF están donde corresponde y no hay otros
+        if self.tamano % LARGO_REGISTRO == 0:
+            registros = np.frombuffer(datos, dtype=np.uint8).reshape(-1, LARGO_REGISTRO)
+            alineado = (
+                (registros[:, -2] == 13).all()
+                and (registros[:, -1] == 10).all()
+                and self._sin_saltos_internos(registros)
+            )
+            del registros
+            if alineado:
+                return errores
+
+        # Recorrer línea por línea (sin decodificar) para ubicar los errores
+        inicio = 0
+        nro_linea = 0
+        while inicio < self.tamano and len(errores) < max_errores:
+            nro_linea += 1
+            fin = datos.find(FIN_LINEA, inicio)
+            if fin == -1:
+                errores.append((nro_linea, f"Registro incompleto sin CR-LF final ({self.tamano - inicio} caracteres)"))
+                break
+            if fin - inicio != ANCHO_REGISTRO_HAB:
+                errores.append((nro_linea, f"Ancho {fin - inicio}, se esperaba {ANCHO_REGISTRO_HAB}"))
+            inicio = fin + len(FIN_LINEA)
+        return errores
+
+    @staticmethod
+    def _sin_saltos_internos(registros):
+        for desde in range(0, len(registros), _REGISTROS_POR_BLOQUE):
+            bloque = registros[desde:desde + _REGISTROS_POR_BLOQUE, :ANCHO_REGISTRO_HAB]
+            if ((bloque == 13) | (bloque == 10)).any():
+                return False
+        return True
+
+    def _validar_campos(self, max_errores):
+        errores = []
+        if not self.tamano:
+            return errores
+
+        registros = np.frombuffer(self._datos, dtype=np.uint8).reshape(-1, LARGO_REGISTRO)
+        tipo_registro = CAMPOS_HAB['TIPO DE REGISTRO']
+        numericos = [campo for campo in LAYOUT_HAB if campo.tipo == 'N']
+
+        for desde in range(0, len(registros), _REGISTROS_POR_BLOQUE):
+            bloque = registros[desde:desde + _REGISTROS_POR_BLOQUE]
+
+            for fila in np.flatnonzero(bloque[:, tipo_registro.offset] != ord('A')):
+                errores.append((desde + fila + 1, "TIPO DE REGISTRO distinto de 'A'"))
+
+            for campo in numericos:
+                valores = bloque[:, campo.offset:campo.offset + campo.longitud]
+                for fila in np.flatnonzero(((valores < ord('0')) | (valores > ord('9'))).any(axis=1)):
+                    errores.append((desde + fila + 1, f"{campo.nombre}: valor no numérico"))
+
+            if len(errores) >= max_errores:
+                break
+
+        del registros, bloque
+        errores.sort()
+        return errores[:max_errores]
+
+
+def verificar_control(path):
+    """
+    Compara el .HAB con su archivo de control <archivo>.HAB.ok: cantidad de
+    registros, bytes y SHA-256.
+
+    Returns:
+        None si el .HAB no tiene archivo de control (p. ej. generado por
+        una versión anterior); si no, lista de diferencias (vacía si coincide)
+    """
+    try:
+        with open(path + SUFIJO_CONTROL_HAB, 'r', encoding='utf-8') as f:
+            control = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        return [f"Archivo de control ilegible: {e}"]
+
+    diferencias = []
+    with ArchivoHAB(path) as hab:
+        if hab.tamano != control.get('bytes'):
+            diferencias.append(f"Tamaño {hab.tamano} bytes, el control indica {control.get('bytes')}")
+        if len(hab) != control.get('registros'):
+            diferencias.append(f"{len(hab)} registros, el control indica {control.get('registros')}")
+        if hashlib.sha256(hab._datos).hexdigest() != control.get('sha256'):
+            diferencias.append("El SHA-256 no coincide con el del control (archivo incompleto o modificado)")
+    return diferencias
+
+
+def comparar_hab(path_anterior, path_nuevo, clave='DNI', ignorar=('FECHA ALTA',)):
+    """
+    Compara dos archivos .HAB registro a registro, emparejando por NRO
+    DOCUMENTO (clave='DNI') o NRO CLAVE FISCAL (clave='CUIL').
+
+    Args:
+        ignorar: Campos que no se consideran diferencias (por defecto FECHA
+            ALTA, que cambia en cada generación)
+
+    Returns:
+        Dict con:
+        - solo_anterior / solo_nuevo: claves presentes en un solo archivo
+        - distintos: {clave: {campo: (valor_anterior, valor_nuevo)}}
+        - duplicados_anterior / duplicados_nuevo: claves repetidas en cada archivo
+        - iguales: cantidad de registros sin diferencias
+    """
+    nombre_clave = CLAVES_COMPARACION[clave]
+    comparables = [campo for campo in LAYOUT_HAB if campo.nombre not in ignorar]
+
+    with ArchivoHAB(path_anterior) as anterior, ArchivoHAB(path_nuevo) as nuevo:
+        indice_anterior, duplicados_anterior = _indexar(anterior, nombre_clave)
+        indice_nuevo, duplicados_nuevo = _indexar(nuevo, nombre_clave)
+
+        distintos = {}
+        iguales = 0
+        for valor_clave, i_anterior in indice_anterior.items():
+            i_nuevo = indice_nuevo.get(valor_clave)
+            if i_nuevo is None:
+                continue
+
+            registro_anterior = anterior.registro_bytes(i_anterior)
+            registro_nuevo = nuevo.registro_bytes(i_nuevo)
+            if registro_anterior == registro_nuevo:
+                iguales += 1
+                continue
+
+            diferencias = {}
+            for campo in comparables:
+                fin = campo.offset + campo.longitud
+                if registro_anterior[campo.offset:fin] != registro_nuevo[campo.offset:fin]:
+                    diferencias[campo.nombre] = (
+                        registro_anterior[campo.offset:fin].decode('latin-1'),
+                        registro_nuevo[campo.offset:fin].decode('latin-1'),
+                    )
+            if diferencias:
+                distintos[valor_clave] = diferencias
+            else:
+                iguales += 1
+
+    return {
+        'solo_anterior': sorted(set(indice_anterior) - set(indice_nuevo)),
+        'solo_nuevo': sorted(set(indice_nuevo) - set(indice_anterior)),
+        'distintos': distintos,
+        'duplicados_anterior': duplicados_anterior,
+        'duplicados_nuevo': duplicados_nuevo,
+        'iguales': iguales,
+    }
+
+
+def _indexar(hab, nombre_clave):
+    """Índice clave → primer registro, y lista de claves repetidas."""
+    indice = {}
+    duplicados = set()
+    for valor, posicion in hab.claves(nombre_clave):
+        if valor in indice:
+            duplicados.add(valor)
+        else:
+            indice[valor] = posicion
+    return indice, sorted(duplicados)
+
+
+# ==================== LÍNEA DE COMANDOS ====================
+
+def _cmd_validar(args):
+    with ArchivoHAB(args.archivo) as hab:
+        print(f"📄 {args.archivo}: {hab.tamano} bytes, {len(hab)} registros de {ANCHO_REGISTRO_HAB} caracteres")
+        errores = hab.validar(max_errores=args.max_errores)
+
+    diferencias = verificar_control(args.archivo)
+    if diferencias is None:
+        print(f"⚠️  Sin archivo de control ({os.path.basename(args.archivo)}{SUFIJO_CONTROL_HAB}): "
+              f"no se puede confirmar que esté completo")
+    elif diferencias:
+        for diferencia in diferencias:
+            print(f"   ❌ {diferencia}")
+    else:
+        print("✅ Coincide con el archivo de control")
+
+    if not errores and not diferencias:
+        print("✅ Archivo válido")
+        return 0
+    for nro_linea, mensaje in errores:
+        print(f"   ❌ Línea {nro_linea}: {mensaje}")
+    print(f"⚠️  Se encontraron errores (se muestran hasta {args.max_errores})")
+    return 1
+
+
+def _cmd_mostrar(args):
+    with ArchivoHAB(args.archivo) as hab:
+        if not 1 <= args.linea <= len(hab):
+            print(f"❌ El archivo tiene {len(hab)} registros")
+            return 1
+        for nombre, valor in hab.registro(args.linea - 1).items():
+            campo = CAMPOS_HAB[nombre]
+            print(f"{campo.offset + 1:>5} {campo.longitud:>4} {campo.tipo}  {nombre:<30} '{valor.rstrip() if campo.tipo == 'A' else valor}'")
+    return 0
+
+
+def _cmd_comparar(args):
+    resultado = comparar_hab(args.anterior, args.nuevo, clave=args.clave)
+
+    print(f"📊 Registros iguales: {resultado['iguales']}")
+    print(f"📊 Registros con diferencias: {len(resultado['distintos'])}")
+    print(f"📊 Solo en {os.path.basename(args.anterior)}: {len(resultado['solo_anterior'])}")
+    print(f"📊 Solo en {os.path.basename(args.nuevo)}: {len(resultado['solo_nuevo'])}")
+
+    for valor_clave in resultado['solo_anterior'][:args.max_detalle]:
+        print(f"   ➖ {valor_clave}")
+    for valor_clave in resultado['solo_nuevo'][:args.max_detalle]:
+        print(f"   ➕ {valor_clave}")
+    for valor_clave, diferencias in list(resultado['distintos'].items())[:args.max_detalle]:
+        print(f"   ✏️  {valor_clave}")
+        for nombre, (antes, despues) in diferencias.items():
+            print(f"      {nombre}: '{antes.rstrip()}' → '{despues.rstrip()}'")
+
+    for nombre_archivo, duplicados in ((args.anterior, resultado['duplicados_anterior']),
+                                       (args.nuevo, resultado['duplicados_nuevo'])):
+        if duplicados:
+            print(f"⚠️  Claves repetidas en {os.path.basename(nombre_archivo)}: {len(duplicados)}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lectura, validación y comparación de archivos .HAB")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    validar = subparsers.add_parser('validar', help="Validar ancho de registros y campos numéricos")
+    validar.add_argument('archivo')
+    validar.add_argument('--max-errores', type=int, default=100)
+    validar.set_defaults(funcion=_cmd_validar)
+
+    mostrar = subparsers.add_parser('mostrar', help="Mostrar los campos de un registro")
+    mostrar.add_argument('archivo')
+    mostrar.add_argument('linea', type=int, help="Número de línea (desde 1)")
+    mostrar.set_defaults(funcion=_cmd_mostrar)
+
+    comparar = subparsers.add_parser('comparar', help="Comparar dos archivos por DNI o CUIL")
+    comparar.add_argument('anterior')
+    comparar.add_argument('nuevo')
+    comparar.add_argument('--clave', choices=sorted(CLAVES_COMPARACION), default='DNI')
+    comparar.add_argument('--max-detalle', type=int, default=20)
+    comparar.set_defaults(funcion=_cmd_comparar)
+
+    args = parser.parse_args(argv)
+    return args.funcion(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,14 +1,69 @@
+import argparse
+import codecs
+import cProfile
+import csv
 import os
+import re
+import sys
+import numpy as np
 import pandas as pd
 import glob
+import hashlib
+import itertools
+import json
+import time
+import unicodedata
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 
+from registro_enviados import REGISTRO_ENVIADOS, RegistroEnviados
+
 # ==================== CONFIGURACIÓN ====================
 
-BASE_DIR = r"D:\TEMP"
-#BASE_DIR = r"D:\DESARROLLO\ECONOMIA_SOCIAL\Empleo_Apertura_Cuenta_Bancaria"
+# Carpeta base de la entrada (<BASE_DIR>/PPP) y de la salida
+# (<BASE_DIR>/PPP/procesados_directo). Se puede cambiar con la variable de
+# entorno HAB_BASE_DIR o, en cada ejecución, con --entrada y --salida.
+BASE_DIR = os.environ.get('HAB_BASE_DIR') or r"D:\TEMP"
 FERIAS_NOC_DIR = os.path.join(BASE_DIR, "PPP")
-PROCESADOS_DIR = os.path.join(FERIAS_NOC_DIR, "procesados_directo")
+SUBDIR_PROCESADOS = "procesados_directo"
+PROCESADOS_DIR = os.path.join(FERIAS_NOC_DIR, SUBDIR_PROCESADOS)
+
+# Modo streaming: leer y escribir por bloques de filas (memoria acotada)
+MODO_STREAMING = False
+TAMANO_BLOQUE = 50000
+
+# Bloques que la lectura y la escritura pueden adelantarse o atrasarse
+# respecto de la codificación (en streaming, cada etapa corre en su hilo)
+MAX_BLOQUES_EN_COLA = 2
+
+# Modo streaming: cada cuántas filas leídas se guarda un punto de control para
+# retomar el .HAB si el proceso se corta (None lo desactiva; ver PuntoDeControl)
+INTERVALO_PUNTO_CONTROL = 200000
+
+# Procesos en paralelo para procesar varios archivos (None = uno por CPU)
+MAX_WORKERS = None
+
+# Formatos de entrada aceptados (además del Excel, exportaciones CSV y Parquet)
+EXTENSIONES_ENTRADA = ('.xlsx', '.csv', '.parquet')
+
+# Personas ya enviadas en otros .HAB (registro SQLite en la carpeta de salida):
+# 'marcar' las informa, 'omitir' además las saca del .HAB, 'no' desactiva el control
+CONTROL_ENVIADOS = 'marcar'
+
+# División del .HAB en partes (ver dividir_hab.py): None (un solo archivo),
+# 'sucursal', 'registros:N', 'bytes:N' o 'sucursal:N' (por sucursal, hasta N registros)
+DIVISION_HAB = None
+
+# Archivo de auditoría con los campos derivados que entraron en cada .HAB:
+# 'parquet', 'csv', 'xlsx' (escritura por filas, memoria constante) o 'no'
+FORMATO_AUDITORIA = 'csv'
+FORMATOS_AUDITORIA = ('parquet', 'csv', 'xlsx', 'no')
+
+# Tabla de códigos de área (característica sin el 0), incluida junto al script
+CODIGOS_AREA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "codigos_area.csv")
 
 # ==================== FUNCIONES DE FORMATO ====================
 
@@ -25,12 +80,16 @@ def formatear_campo(valor, longitud, tipo, default=''):
     Returns:
         String formateado con la longitud correcta
     """
-    # Si es una Serie de pandas, tomar el primer valor
-    if isinstance(valor, pd.Series):
-        valor = valor.iloc[0] if len(valor) > 0 else default
+    # Si es una Serie de pandas, tomar el primer valor (los textos no pasan
+    # por pandas)
+    if not isinstance(valor, str):
+        if isinstance(valor, pd.Series):
+            valor = valor.iloc[0] if len(valor) > 0 else default
+        if pd.isna(valor) or valor is None:
+            valor = default
     
-    # Usar default si el valor está vacío o es None
-    if pd.isna(valor) or valor == '' or valor is None:
+    # Usar default si el valor está vacío
+    if valor == '':
         valor = default
     
     # Convertir a string
@@ -38,8 +97,8 @@ def formatear_campo(valor, longitud, tipo, default=''):
     
     if tipo == 'N':
         # Numérico: rellenar con ceros a la izquierda
-        # Eliminar caracteres no numéricos
-        valor_str = ''.join(c for c in valor_str if c.isdigit())
+        # Eliminar caracteres no numéricos (y dígitos fuera de latin-1, como ①)
+        valor_str = ''.join(c for c in valor_str if c.isdigit() and c <= '\xff')
         if valor_str == '':
             valor_str = '0'
         return valor_str.zfill(longitud)[:longitud]
@@ -72,26 +131,83 @@ def procesar_nombre(nombre):
     return primer_nombre, segundo_nombre
 
 
+# Códigos de área de respaldo si falta codigos_area.csv
+CODIGOS_AREA_BASICOS = ('11', '351', '353', '358')
+
+# Largo de un número nacional sin el 0: código de área + número local
+LARGO_NUMERO_NACIONAL = 10
+
+
+def cargar_codigos_area(path=CODIGOS_AREA_PATH):
+    """
+    Carga la tabla de códigos de área (columna 'codigo') y la compila como
+    índice {largo: conjunto de códigos}, recorrido del largo mayor al menor
+    para quedarse con el prefijo más largo: en Argentina hay códigos que son
+    prefijo de otros (353 Villa María y 3532 Oliva, 358 Río Cuarto y 3584
+    La Carlota).
+    """
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            codigos = [fila['codigo'].strip() for fila in csv.DictReader(f)]
+    except FileNotFoundError:
+        print(f"⚠️  No se encontró {path}: se usan solo los códigos de área {', '.join(CODIGOS_AREA_BASICOS)}")
+        codigos = CODIGOS_AREA_BASICOS
+    
+    indice = {}
+    for codigo in codigos:
+        if codigo:
+            indice.setdefault(len(codigo), set()).add(codigo)
+    return {largo: frozenset(indice[largo]) for largo in sorted(indice, reverse=True)}
+
+
+INDICE_CODIGOS_AREA = cargar_codigos_area()
+
+
+def buscar_codigo_area(digitos):
+    """Código de área más largo de INDICE_CODIGOS_AREA con el que empieza digitos ('' si ninguno)."""
+    for largo, codigos in INDICE_CODIGOS_AREA.items():
+        if digitos[:largo] in codigos:
+            return digitos[:largo]
+    return ''
+
+
+def _normalizar_digitos_celular(digitos):
+    """
+    Quita de un teléfono (solo dígitos) el 54 de país, el 9 de celular
+    marcado desde el exterior y el 0 de larga distancia.
+    """
+    if len(digitos) > LARGO_NUMERO_NACIONAL + 1 and digitos.startswith('54'):
+        digitos = digitos[2:]
+    if len(digitos) == LARGO_NUMERO_NACIONAL + 1 and digitos.startswith('9'):
+        digitos = digitos[1:]
+    if digitos.startswith('0'):
+        digitos = digitos[1:]
+    return digitos
+
+
 def procesar_celular_post(celular_post):
-    """Procesa CELULAR_POST para extraer prefijo y número."""
+    """
+    Procesa CELULAR_POST para extraer prefijo y número.
+    
+    Se normaliza el número (+54, 9, 0 y el 15 de celular) y el prefijo es el
+    código de área más largo de la tabla con el que empieza; si ninguno
+    coincide se toman los primeros 4 dígitos como prefijo.
+    """
     if pd.isna(celular_post) or celular_post == '':
         return '', ''
     
-    celular_str = str(celular_post).strip()
+    digitos = _normalizar_digitos_celular(re.sub('[^0-9]', '', str(celular_post)))
     
-    # Quitar el primer caracter si es "0"
-    if celular_str.startswith('0'):
-        celular_str = celular_str[1:]
-    
-    # Verificar si los primeros 2 caracteres son "11" (Buenos Aires)
-    if celular_str[:2] == '11':
-        return celular_str[:2], celular_str[2:]
-    # Verificar si los primeros 3 caracteres están en la lista
-    elif celular_str[:3] in ['351', '358', '353']:
-        return celular_str[:3], celular_str[3:]
-    else:
+    prefijo = buscar_codigo_area(digitos)
+    if not prefijo:
         # Tomar los primeros 4 caracteres como prefijo
-        return celular_str[:4], celular_str[4:]
+        return digitos[:4], digitos[4:]
+    
+    numero = digitos[len(prefijo):]
+    # 0351 15 1234567: el 15 de celular va entre el código de área y el número
+    if numero.startswith('15') and len(prefijo) + len(numero) == LARGO_NUMERO_NACIONAL + 2:
+        numero = numero[2:]
+    return prefijo, numero
 
 
 def mapear_sexo(sexo):
@@ -132,6 +248,49 @@ def mapear_sexo_hab(id_sexo):
         return ''
 
 
+# Reemplazos de letras con acentos (la Ñ se conserva: es latin-1 y la acepta el banco)
+REEMPLAZOS_ACENTOS = {
+    'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
+    'Á': 'A', 'É': 'E', 'Í': 'I', 'Ó': 'O', 'Ú': 'U',
+    'ä': 'a', 'ë': 'e', 'ï': 'i', 'ö': 'o', 'ü': 'u',
+    'Ä': 'A', 'Ë': 'E', 'Ï': 'I', 'Ö': 'O', 'Ü': 'U',
+    'à': 'a', 'è': 'e', 'ì': 'i', 'ò': 'o', 'ù': 'u',
+    'À': 'A', 'È': 'E', 'Ì': 'I', 'Ò': 'O', 'Ù': 'U',
+    'â': 'a', 'ê': 'e', 'î': 'i', 'ô': 'o', 'û': 'u',
+    'Â': 'A', 'Ê': 'E', 'Î': 'I', 'Ô': 'O', 'Û': 'U',
+    'ã': 'a', 'õ': 'o', 'Ã': 'A', 'Õ': 'O',
+    'å': 'a', 'Å': 'A', 'ø': 'o', 'Ø': 'O',
+    'ý': 'y', 'ÿ': 'y', 'Ý': 'Y',
+    'ç': 'c', 'Ç': 'C',
+    # Fuera de latin-1 y sin descomposición Unicode
+    'ł': 'l', 'Ł': 'L', 'đ': 'd', 'Đ': 'D', 'œ': 'oe', 'Œ': 'OE',
+}
+
+# Comillas, guiones y espacios tipográficos (los que agrega Word/Excel al
+# copiar y pegar) y caracteres de control: un salto de línea dentro de un
+# campo rompería el registro de ancho fijo
+REEMPLAZOS_TIPOGRAFICOS = {
+    '‘': "'", '’': "'", '‚': "'", '‛': "'", '′': "'", '´': "'", '`': "'",
+    '“': '"', '”': '"', '„': '"', '″': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '―': '-',
+    '…': '...',
+    '\xa0': ' ', '\u2007': ' ', '\u202f': ' ',
+    '\xad': '', '\u200b': '', '\u200c': '', '\u200d': '', '\ufeff': '',
+    **{chr(codigo): ' ' for codigo in range(32)},
+}
+
+_TABLA_NORMALIZACION = str.maketrans({**REEMPLAZOS_ACENTOS, **REEMPLAZOS_TIPOGRAFICOS})
+
+# En apellidos y nombres además se eliminan los apóstrofes (D'ANGELO → DANGELO)
+_TABLA_SANITIZAR = str.maketrans({
+    **REEMPLAZOS_ACENTOS, **REEMPLAZOS_TIPOGRAFICOS,
+    **{apostrofe: None for apostrofe in "'‘’‚‛′´`"},
+})
+
+# Cualquier caracter fuera de latin-1 (U+0000 a U+00FF)
+_FUERA_DE_LATIN1 = '[^\x00-\xff]'
+
+
 def sanitizar_texto(texto):
     """
     Sanitiza un texto eliminando acentos y caracteres especiales.
@@ -139,25 +298,54 @@ def sanitizar_texto(texto):
     if pd.isna(texto) or texto == '':
         return texto
     
-    texto_str = str(texto)
-    
-    # Reemplazar vocales con acentos
-    reemplazos = {
-        'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
-        'Á': 'A', 'É': 'E', 'Í': 'I', 'Ó': 'O', 'Ú': 'U',
-        'ä': 'a', 'ë': 'e', 'ï': 'i', 'ö': 'o', 'ü': 'u',
-        'Ä': 'A', 'Ë': 'E', 'Ï': 'I', 'Ö': 'O', 'Ü': 'U',
-        'à': 'a', 'è': 'e', 'ì': 'i', 'ò': 'o', 'ù': 'u',
-        'À': 'A', 'È': 'E', 'Ì': 'I', 'Ò': 'O', 'Ù': 'U'
-    }
-    
-    for acento, sin_acento in reemplazos.items():
-        texto_str = texto_str.replace(acento, sin_acento)
+    return str(texto).translate(_TABLA_SANITIZAR)
+
+
+@lru_cache(maxsize=None)
+def _caracter_a_latin1(caracter):
+    """
+    Equivalente latin-1 de un caracter que no está en _TABLA_NORMALIZACION:
+    descomposición Unicode (NFKD) sin marcas diacríticas (ő, ş, ① → o, s, 1),
+    o '' si no tiene equivalente (emojis, otros alfabetos).
+    """
+    if ord(caracter) <= 0xFF:
+        return caracter
+    base = ''.join(c for c in unicodedata.normalize('NFKD', caracter) if not unicodedata.combining(c))
+    base = base.translate(_TABLA_NORMALIZACION)
+    return base if all(ord(c) <= 0xFF for c in base) else ''
+
+
+def _a_latin1(texto):
+    return ''.join(map(_caracter_a_latin1, texto))
+
+
+def normalizar_texto_hab(texto):
+    """
+    Normaliza un valor de campo alfanumérico del .HAB: quita acentos, reemplaza
+    caracteres tipográficos y de control, y garantiza que el resultado se
+    pueda codificar en latin-1. Los valores null o vacíos se devuelven igual.
+    """
+    if pd.isna(texto) or texto == '':
+        return texto
     
-    # Eliminar apóstrofes
-    texto_str = texto_str.replace("'", "")
+    texto = str(texto).translate(_TABLA_NORMALIZACION)
+    if texto.isascii():
+        return texto
+    return _a_latin1(texto)
+
+
+def normalizar_columna_hab(serie):
+    """Versión columnar de normalizar_texto_hab."""
+    serie = serie.astype(object)
+    vacio = _es_vacio(serie)
+    texto = serie.where(~vacio, '').astype(str).str.translate(_TABLA_NORMALIZACION)
     
-    return texto_str
+    # La descomposición Unicode solo se aplica a los pocos valores que la necesitan
+    fuera = texto.str.contains(_FUERA_DE_LATIN1)
+    if fuera.any():
+        texto = texto.astype(object)
+        texto[fuera] = texto[fuera].map(_a_latin1)
+    return texto.where(~vacio, serie)
 
 
 # ==================== MAPEO DE CAMPOS ====================
@@ -168,60 +356,340 @@ def aplicar_logica_apoderado(row):
     - Si IdApoderado no es null/vacío: usar campos del apoderado
     - Si no: usar SEXO, NUMERO_DOCUMENTO, APELLIDO, etc.
     
+    Las columnas de cada campo salen de MAPEO_APODERADO.
+    
     Returns:
         Dict con los campos procesados (SEXO, NRO_DOCUMENTO, APELLIDO, NOMBRE, etc.)
     """
-    datos_procesados = {}
-    
     # Verificar si tiene apoderado: validar que IdApoderado no sea null/vacío
-    tiene_apoderado = False
-    if 'IdApoderado' in row.index:
-        IdApoderado = row.get('IdApoderado', '')
-        if not pd.isna(IdApoderado) and str(IdApoderado).strip() != '':
-            tiene_apoderado = True
-    
-    if tiene_apoderado:
-        # Usar campos de apoderado
-        datos_procesados['SEXO'] = row.get('APO_SEXO', '')
-        datos_procesados['NRO_DOCUMENTO'] = row.get('APO_DNI', '')
-        datos_procesados['APELLIDO'] = sanitizar_texto(row.get('APO_APELLIDO', ''))
-        datos_procesados['NOMBRE'] = sanitizar_texto(row.get('APO_NOMBRE', ''))
-        datos_procesados['CUIL'] = row.get('APO_CUIL', '')
-        datos_procesados['FEC_NACIMIENTO'] = row.get('APO_FEC_NAC', '')
-        datos_procesados['CELULAR_POST'] = row.get('APO_CELULAR', '')
-        datos_procesados['MAIL_POST'] = row.get('APO_EMAIL', '')
-        datos_procesados['N_CALLE'] = row.get('APO_CALLE', '')
-        datos_procesados['ALTURA_ORACLE'] = row.get('APO_NRO', '')
-        datos_procesados['N_BARRIO'] = row.get('APO_BARRIO', '')
-        datos_procesados['N_LOCALIDAD'] = row.get('APO_LOCALIDAD', '')
-        datos_procesados['CPA'] = row.get('APO_CP', '')
-        datos_procesados['COD_BCO_CBA'] = row.get('APO_COD_SUC', '')
-    else:
-        # Usar campos normales del beneficiario
-        datos_procesados['SEXO'] = row.get('SEXO', '')
-        datos_procesados['NRO_DOCUMENTO'] = row.get('NUMERO_DOCUMENTO', '')
-        datos_procesados['APELLIDO'] = sanitizar_texto(row.get('APELLIDO', ''))
-        datos_procesados['NOMBRE'] = sanitizar_texto(row.get('NOMBRE', ''))
-        datos_procesados['CUIL'] = row.get('CUIL', '')
-        datos_procesados['FEC_NACIMIENTO'] = row.get('FER_NAC', '')
-        datos_procesados['CELULAR_POST'] = row.get('TEL_CELULAR', '')
-        datos_procesados['MAIL_POST'] = row.get('MAIL', '')
-        datos_procesados['N_CALLE'] = row.get('CALLE', '')
-        datos_procesados['ALTURA_ORACLE'] = row.get('NUMERO', '')
-        datos_procesados['N_BARRIO'] = row.get('BARRIO', '')
-        datos_procesados['N_LOCALIDAD'] = row.get('N_LOCALIDAD', '')
-        datos_procesados['CPA'] = row.get('CODIGO_POSTAL', '')
-        datos_procesados['COD_BCO_CBA'] = row.get('BEN_COD_SUC', '')
+    id_apoderado = row.get('IdApoderado', '')
+    origen = 0 if not pd.isna(id_apoderado) and str(id_apoderado).strip() != '' else 1
     
+    datos_procesados = {campo: row.get(columnas[origen], '') for campo, columnas in MAPEO_APODERADO.items()}
+    for campo in ('APELLIDO', 'NOMBRE'):
+        datos_procesados[campo] = sanitizar_texto(datos_procesados[campo])
     return datos_procesados
 
 
-# ==================== GENERACIÓN DE ARCHIVO .HAB ====================
+# Campo procesado → (columna del apoderado, columna del beneficiario)
+MAPEO_APODERADO = {
+    'SEXO': ('APO_SEXO', 'SEXO'),
+    'NRO_DOCUMENTO': ('APO_DNI', 'NUMERO_DOCUMENTO'),
+    'APELLIDO': ('APO_APELLIDO', 'APELLIDO'),
+    'NOMBRE': ('APO_NOMBRE', 'NOMBRE'),
+    'CUIL': ('APO_CUIL', 'CUIL'),
+    'FEC_NACIMIENTO': ('APO_FEC_NAC', 'FER_NAC'),
+    'CELULAR_POST': ('APO_CELULAR', 'TEL_CELULAR'),
+    'MAIL_POST': ('APO_EMAIL', 'MAIL'),
+    'N_CALLE': ('APO_CALLE', 'CALLE'),
+    'ALTURA_ORACLE': ('APO_NRO', 'NUMERO'),
+    'N_BARRIO': ('APO_BARRIO', 'BARRIO'),
+    'N_LOCALIDAD': ('APO_LOCALIDAD', 'N_LOCALIDAD'),
+    'CPA': ('APO_CP', 'CODIGO_POSTAL'),
+    'COD_BCO_CBA': ('APO_COD_SUC', 'BEN_COD_SUC'),
+}
 
-def generar_linea_hab(row):
-    """Genera una línea del archivo .HAB según el formato especificado."""
-    linea = ''
+
+# Columnas del archivo de entrada que usa aplicar_logica_apoderado (las
+# únicas que se leen de un CSV o Parquet)
+COLUMNAS_ENTRADA = ['IdApoderado'] + [columna for par in MAPEO_APODERADO.values() for columna in par]
+
+# Campos con pocos valores distintos en todo el archivo (sexo, sucursal,
+# localidad, barrio y código postal): sus columnas de entrada se guardan
+# como categorías (cada texto una sola vez) y se codifican una vez por
+# valor distinto, no una vez por fila
+CAMPOS_REPETIDOS = ('SEXO', 'COD_BCO_CBA', 'N_LOCALIDAD', 'N_BARRIO', 'CPA')
+COLUMNAS_CATEGORICAS = frozenset(columna for campo in CAMPOS_REPETIDOS for columna in MAPEO_APODERADO[campo])
+
+
+# Origen de los campos de MAPEO_APODERADO para las columnas de un archivo:
+# campos es campo → (columna del apoderado, columna del beneficiario), con
+# None en lugar de las que no existen; faltantes, las COLUMNAS_ENTRADA ausentes
+PlanOrigen = namedtuple('PlanOrigen', ['campos', 'faltantes'])
+
+
+def compilar_plan_origen(columnas):
+    """
+    Resuelve una sola vez por archivo (no por fila ni por bloque) qué
+    columnas de MAPEO_APODERADO existen. Las ausentes se toman como vacías.
+    """
+    columnas = set(columnas)
+    campos = {
+        campo: tuple(columna if columna in columnas else None for columna in par)
+        for campo, par in MAPEO_APODERADO.items()
+    }
+    faltantes = [columna for columna in COLUMNAS_ENTRADA if columna not in columnas]
+    return PlanOrigen(campos, faltantes)
+
+
+def _columna(df, nombre):
+    """
+    Devuelve la columna `nombre` del DataFrame, o una columna de '' si no
+    existe. Las categóricas (COLUMNAS_CATEGORICAS) se devuelven como tales
+    (ver _por_categoria); el resto, como object.
+    """
+    if nombre not in df.columns:
+        return pd.Series('', index=df.index, dtype=object)
+    
+    columna = df[nombre]
+    # Columnas duplicadas: usar la primera, igual que formatear_campo
+    if isinstance(columna, pd.DataFrame):
+        columna = columna.iloc[:, 0]
+    if isinstance(columna.dtype, pd.CategoricalDtype):
+        return columna
+    return columna.astype(object)
+
+
+def _por_categoria(serie, funcion):
+    """
+    Aplica funcion (Serie → Serie) a una columna. Si es categórica, la
+    aplica solo a sus categorías (y al null) y devuelve otra categórica con
+    los códigos de cada fila, sin convertir la columna completa.
+    """
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return funcion(serie)
+    # El null va en el último lugar: el código -1 de las filas sin valor lo toma
+    distintos = funcion(pd.Series([*serie.cat.categories, None], dtype=object))
+    codigos, categorias = pd.factorize(distintos.to_numpy(dtype=object))
+    return pd.Series(
+        pd.Categorical.from_codes(codigos[serie.cat.codes.to_numpy()], categorias), index=serie.index, name=serie.name
+    )
+
+
+def _es_vacio(serie):
+    """Máscara de valores null o '' (misma regla que formatear_campo)."""
+    return serie.isna() | (serie == '')
+
+
+def mascara_apoderado(df):
+    """Máscara booleana de las filas con IdApoderado no null/vacío."""
+    if 'IdApoderado' not in df.columns:
+        return pd.Series(False, index=df.index)
+    
+    id_apoderado = _columna(df, 'IdApoderado')
+    return id_apoderado.notna() & (id_apoderado.fillna('').astype(str).str.strip() != '')
+
+
+def _campo_origen(df, columnas, tiene_apoderado, vacia):
+    """
+    Valores de un campo: columna del apoderado donde tiene_apoderado y del
+    beneficiario en el resto. Si todas las filas tienen el mismo origen (en
+    el .HAB siempre, porque solo lleva apoderados) se toma esa columna sin
+    leer la otra.
+    """
+    if tiene_apoderado.all():
+        columnas = columnas[:1]
+    elif not tiene_apoderado.any():
+        columnas = columnas[1:]
+    apoderado, *beneficiario = [vacia if columna is None else _columna(df, columna) for columna in columnas]
+    if not beneficiario:
+        return apoderado
+    beneficiario = beneficiario[0]
+    if not any(isinstance(serie.dtype, pd.CategoricalDtype) for serie in (apoderado, beneficiario)):
+        return apoderado.where(tiene_apoderado, beneficiario)
+    
+    # Categóricas: se eligen los códigos sobre la unión de las categorías de las dos columnas
+    apoderado, beneficiario = (serie.astype('category') for serie in (apoderado, beneficiario))
+    categorias = apoderado.cat.categories.union(beneficiario.cat.categories)
+    codigos = np.where(
+        tiene_apoderado,
+        apoderado.cat.set_categories(categorias).cat.codes.to_numpy(),
+        beneficiario.cat.set_categories(categorias).cat.codes.to_numpy(),
+    )
+    return pd.Series(pd.Categorical.from_codes(codigos, categorias), index=df.index)
+
+
+def aplicar_logica_apoderado_columnas(df, tiene_apoderado=None, plan=None):
+    """
+    Versión columnar de aplicar_logica_apoderado: resuelve todas las filas
+    del DataFrame a la vez, con una máscara en lugar de una decisión por fila.
+    
+    Args:
+        df: DataFrame con los datos del Excel
+        tiene_apoderado: Máscara de apoderado de df ya calculada (por
+            defecto, mascara_apoderado)
+        plan: PlanOrigen de las columnas de df (por defecto se compila)
+    
+    Returns:
+        DataFrame con los mismos campos que devuelve aplicar_logica_apoderado
+    """
+    plan = plan or compilar_plan_origen(df.columns)
+    if tiene_apoderado is None:
+        tiene_apoderado = mascara_apoderado(df)
+    tiene_apoderado = np.asarray(tiene_apoderado, dtype=bool)
+    vacia = pd.Series('', index=df.index, dtype=object)
+    
+    datos = pd.DataFrame(
+        {campo: _campo_origen(df, columnas, tiene_apoderado, vacia) for campo, columnas in plan.campos.items()},
+        index=df.index,
+    )
+    for campo in ('APELLIDO', 'NOMBRE'):
+        texto = datos[campo]
+        vacio = _es_vacio(texto)
+        datos[campo] = texto.where(vacio, texto.where(~vacio, '').astype(str).str.translate(_TABLA_SANITIZAR))
+    return datos
+
+
+# Campos de aplicar_logica_apoderado que terminan en campos alfanuméricos del .HAB
+CAMPOS_TEXTO_HAB = ('APELLIDO', 'NOMBRE', 'N_CALLE', 'N_BARRIO', 'N_LOCALIDAD', 'CELULAR_POST', 'MAIL_POST')
+
+
+def revisar_caracteres_hab(df, primera_fila=0):
+    """
+    Revisión previa a la escritura: busca en las columnas que alimentan campos
+    alfanuméricos del .HAB (beneficiario y apoderado) los valores con
+    caracteres sin equivalente directo en latin-1. Esos valores no detienen
+    el proceso: se aproximan con normalizar_texto_hab, y este reporte
+    permite corregirlos en el origen.
     
+    Args:
+        df: DataFrame con los datos del Excel
+        primera_fila: Filas anteriores a df (para el modo por bloques)
+    
+    Returns:
+        DataFrame con fila_excel, columna, valor, caracteres y valor_hab
+        (vacío si no hay problemas)
+    """
+    columnas = [
+        columna
+        for campo in CAMPOS_TEXTO_HAB
+        for columna in MAPEO_APODERADO[campo]
+        if columna in df.columns
+    ]
+    problemas = []
+    for columna in dict.fromkeys(columnas):
+        serie = _columna(df, columna)
+        texto = _por_categoria(
+            serie, lambda valores: valores.where(~_es_vacio(valores), '').astype(str).str.translate(_TABLA_NORMALIZACION)
+        )
+        fuera = texto.str.contains(_FUERA_DE_LATIN1)
+        posiciones = np.flatnonzero(fuera.to_numpy(dtype=bool))
+        for posicion in posiciones:
+            valor = str(serie.iloc[posicion])
+            problemas.append({
+                # +2: encabezado en la fila 1 y filas de Excel numeradas desde 1
+                'fila_excel': primera_fila + int(posicion) + 2,
+                'columna': columna,
+                'valor': valor,
+                'caracteres': ' '.join(sorted({c for c in texto.iloc[posicion] if ord(c) > 0xFF})),
+                'valor_hab': normalizar_texto_hab(valor),
+            })
+    
+    problemas = pd.DataFrame(problemas, columns=['fila_excel', 'columna', 'valor', 'caracteres', 'valor_hab'])
+    return problemas.sort_values(['fila_excel', 'columna'], ignore_index=True)
+
+
+# ==================== DISEÑO DE REGISTRO .HAB ====================
+
+CampoHAB = namedtuple('CampoHAB', ['nombre', 'offset', 'longitud', 'tipo', 'default', 'fuente'])
+
+# Diseño del registro: (nombre, longitud, tipo, default, fuente)
+# - tipo: 'A' alfanumérico, 'N' numérico (ver formatear_campo)
+# - fuente: campo calculado por calcular_campos_hab, o None si el campo es
+#   constante y siempre vale `default`
+_DISENO_HAB = [
+    ('TIPO DE REGISTRO', 1, 'A', 'A', None),
+    ('SUCURSAL', 5, 'N', '', 'COD_BCO_CBA'),
+    ('MONEDA', 2, 'N', '1', None),
+    ('TIPO DOCUMENTO', 3, 'N', '1', None),
+    ('NRO DOCUMENTO', 11, 'N', '', 'NRO_DOCUMENTO'),
+    ('CLAVE FISCAL', 3, 'N', '7', None),
+    ('NRO CLAVE FISCAL', 11, 'N', '', 'CUIL'),
+    ('TIPO CUENTA', 2, 'N', '0', None),
+    ('NRO CUENTA', 9, 'N', '0', None),
+    ('FECHA ALTA', 8, 'N', '', 'FECHA_ALTA'),
+    ('PRIMER APELLIDO', 15, 'A', '', 'PRIMER_APELLIDO'),
+    ('SEGUNDO APELLIDO', 15, 'A', '', 'SEGUNDO_APELLIDO'),
+    ('PRIMER NOMBRE', 15, 'A', '', 'PRIMER_NOMBRE'),
+    ('SEGUNDO NOMBRE', 15, 'A', '', 'SEGUNDO_NOMBRE'),
+    ('CONDICION IVA', 2, 'N', '4', None),
+    ('DOMICILIO PARTICULAR', 30, 'A', '', 'N_CALLE'),
+    ('NRO DOMICILIO', 5, 'N', '', 'ALTURA_ORACLE'),
+    ('PISO', 2, 'N', '', None),
+    ('DEPARTAMENTO', 3, 'N', '', None),
+    ('BARRIO', 30, 'A', '', 'N_BARRIO'),
+    ('LOCALIDAD', 30, 'A', '', 'N_LOCALIDAD'),
+    ('CODIGO PROVINCIA', 3, 'N', '4', None),
+    ('CODIGO POSTAL', 5, 'N', '', 'CPA'),
+    ('CODIGO POSTAL EXTENDIDO', 8, 'N', '0', None),
+    ('PREF. TEL PARTICULAR', 5, 'A', '', 'PREF_TEL'),
+    ('TEL PARTICULAR', 11, 'N', '', 'TEL_PARTICULAR'),
+    ('PREF. TEL CEL', 5, 'A', '', 'PREF_TEL'),
+    ('TEL MOVIL', 11, 'N', '', 'TEL_PARTICULAR'),
+    ('DOMICILIO COMERCIAL', 30, 'A', '', 'N_CALLE'),
+    ('NRO DOMICILIO COMERCIAL', 5, 'N', '', 'ALTURA_ORACLE'),
+    ('PISO COMERCIAL', 2, 'N', '', None),
+    ('DEPARTAMENTO COMERCIAL', 3, 'N', '', None),
+    ('BARRIO COMERCIAL', 30, 'A', '', 'N_BARRIO'),
+    ('LOCALIDAD COMERCIAL', 30, 'A', '', 'N_LOCALIDAD'),
+    ('COD. PROV. COMERC', 3, 'N', '4', None),
+    ('COD POSTAL COMERCIAL', 5, 'N', '', 'CPA'),
+    ('COD POSTAL EXTENDIDO COMERC', 8, 'N', '0', None),
+    ('PREF. TEL COMERCIAL', 5, 'A', '', 'PREF_TEL'),
+    ('TELEFONO COMERC', 11, 'N', '', 'TEL_PARTICULAR'),
+    ('FECHA NACIMIENTO', 8, 'N', '', 'FEC_NACIMIENTO'),
+    ('ESTADO CIVIL', 4, 'N', '1', None),
+    ('RESIDENTE', 1, 'A', 'S', None),
+    ('SEXO', 1, 'A', '', 'SEXO'),
+    ('NACIONALIDAD', 3, 'N', '1', None),
+    ('EMAIL', 30, 'A', '', 'MAIL_POST'),
+    ('TIPO PERSONA', 1, 'A', 'F', None),
+    ('COD. ACT. BCRA', 5, 'N', '2', None),
+    ('COD. NAT. JURIDICA', 3, 'N', '27', None),
+    ('PRIMER APELLIDO CONYUGE', 15, 'A', '', None),
+    ('SEGUNDO APELLIDO CONYUGE', 15, 'A', '', None),
+    ('PRIMER NOMBRE CONYUGE', 15, 'A', '', None),
+    ('SEGUNDO NOMBRE CONYUGE', 15, 'A', '', None),
+    ('SEXO CONYUGE', 1, 'A', '', None),
+    ('TIPO DOC CONYUGE', 3, 'N', '', None),
+    ('NRO DOC CONYUGE', 11, 'N', '', None),
+    ('CUIT CONYUGE', 11, 'N', '', None),
+    ('FECHA NACIMIENTO CONYUGE', 8, 'N', '', None),
+    ('NACIONALIDAD CONYUGE', 3, 'N', '', None),
+    ('NRO EMPRESA', 5, 'N', '1137', None),
+    ('TIPO CONVENIO', 3, 'N', '0', None),
+    ('VALIDA NOMBRE', 1, 'A', '1', None),
+    ('NOMBRE CLIENTE SEGUN PATRON', 30, 'A', '', None),
+    ('FILLER', 409, 'A', '', None),
+    ('TIPO SOLICITUD', 2, 'N', '', None),
+    ('CRU', 22, 'A', '', None),
+    ('FILLER 2', 330, 'A', '', None),
+    ('DATOS PARA EMPRESA', 21, 'A', '', None),
+] + [(f'MOTIVO DEL ERROR {i}', 5, 'A', '', None) for i in range(1, 8)]
+
+
+def _compilar_layout(diseno):
+    """Calcula el offset de cada campo del diseño y devuelve la lista de CampoHAB."""
+    layout = []
+    offset = 0
+    for nombre, longitud, tipo, default, fuente in diseno:
+        layout.append(CampoHAB(nombre, offset, longitud, tipo, default, fuente))
+        offset += longitud
+    return layout
+
+
+LAYOUT_HAB = _compilar_layout(_DISENO_HAB)
+ANCHO_REGISTRO_HAB = sum(campo.longitud for campo in LAYOUT_HAB)
+
+# Registro pre-armado con todos los campos en su valor por defecto: cada
+# registro solo sobrescribe los campos que tienen fuente
+PLANTILLA_HAB = ''.join(
+    formatear_campo(campo.default, campo.longitud, campo.tipo, campo.default) for campo in LAYOUT_HAB
+)
+CAMPOS_VARIABLES_HAB = [campo for campo in LAYOUT_HAB if campo.fuente is not None]
+_CAMPOS_POR_NOMBRE = {campo.nombre: campo for campo in LAYOUT_HAB}
+
+assert ANCHO_REGISTRO_HAB == 1408, f"Ancho de registro .HAB inesperado: {ANCHO_REGISTRO_HAB}"
+assert len(PLANTILLA_HAB) == ANCHO_REGISTRO_HAB
+
+
+# ==================== GENERACIÓN DE ARCHIVO .HAB ====================
+
+def calcular_campos_fila(row):
+    """
+    Calcula los valores de todos los campos variables del registro .HAB
+    (las fuentes de LAYOUT_HAB) para una fila.
+    """
     # Aplicar lógica de apoderado
     datos = aplicar_logica_apoderado(row)
     
@@ -242,221 +710,2448 @@ def generar_linea_hab(row):
     if not pd.isna(mail_post) and mail_post != '' and len(str(mail_post)) > 30:
         mail_post = 'mailgenerica@bancor.com.ar'
     
-    # Obtener fecha actual en formato YYYYMMDD
-    fecha_hoy = datetime.now().strftime('%Y%m%d')
-    
-    # Construir cada campo según especificación
-    linea += formatear_campo('A', 1, 'A')  # TIPO DE REGISTRO
-    linea += formatear_campo(datos.get('COD_BCO_CBA', ''), 5, 'N')  # SUCURSAL
-    linea += formatear_campo('1', 2, 'N', '1')  # MONEDA
-    linea += formatear_campo('1', 3, 'N', '1')  # TIPO DOCUMENTO
-    linea += formatear_campo(datos.get('NRO_DOCUMENTO', ''), 11, 'N')  # NRO DOCUMENTO
-    linea += formatear_campo('7', 3, 'N')  # CLAVE FISCAL
-    linea += formatear_campo(datos.get('CUIL', ''), 11, 'N')  # NRO CLAVE FISCAL
-    linea += formatear_campo('0', 2, 'N', '0')  # TIPO CUENTA
-    linea += formatear_campo('0', 9, 'N', '0')  # NRO CUENTA
-    linea += formatear_campo(fecha_hoy, 8, 'N')  # FECHA ALTA (SYSDATE)
-    linea += formatear_campo(primer_apellido, 15, 'A')  # PRIMER APELLIDO
-    linea += formatear_campo(segundo_apellido, 15, 'A')  # SEGUNDO APELLIDO
-    linea += formatear_campo(primer_nombre, 15, 'A')  # PRIMER NOMBRE
-    linea += formatear_campo(segundo_nombre, 15, 'A')  # SEGUNDO NOMBRE
-    linea += formatear_campo('4', 2, 'N', '4')  # CONDICION IVA
-    linea += formatear_campo(datos.get('N_CALLE', ''), 30, 'A')  # DOMICILIO PARTICULAR
-    linea += formatear_campo(datos.get('ALTURA_ORACLE', ''), 5, 'N')  # NRO DOMICILIO
-    linea += formatear_campo('', 2, 'N')  # PISO
-    linea += formatear_campo('', 3, 'N')  # DEPARTAMENTO
-    linea += formatear_campo(n_barrio, 30, 'A')  # BARRIO
-    linea += formatear_campo(datos.get('N_LOCALIDAD', ''), 30, 'A')  # LOCALIDAD
-    linea += formatear_campo('4', 3, 'N', '4')  # CODIGO PROVINCIA
-    linea += formatear_campo(datos.get('CPA', ''), 5, 'N')  # CODIGO POSTAL
-    linea += formatear_campo('0', 8, 'N', '0')  # CODIGO POSTAL EXTENDIDO
-    linea += formatear_campo(pref_tel, 5, 'A')  # PREF. TEL PARTICULAR
-    linea += formatear_campo(tel_particular, 11, 'N')  # TEL PARTICULAR
-    linea += formatear_campo(pref_tel, 5, 'A')  # PREF. TEL CEL
-    linea += formatear_campo(tel_particular, 11, 'N')  # TEL MOVIL
-    linea += formatear_campo(datos.get('N_CALLE', ''), 30, 'A')  # DOMICILIO COMERCIAL
-    linea += formatear_campo(datos.get('ALTURA_ORACLE', ''), 5, 'N')  # NRO DOMICILIO COMERCIAL
-    linea += formatear_campo('', 2, 'N')  # PISO COMERCIAL
-    linea += formatear_campo('', 3, 'N')  # DEPARTAMENTO COMERCIAL
-    linea += formatear_campo(n_barrio, 30, 'A')  # BARRIO COMERCIAL
-    linea += formatear_campo(datos.get('N_LOCALIDAD', ''), 30, 'A')  # LOCALIDAD COMERCIAL
-    linea += formatear_campo('4', 3, 'N', '4')  # COD. PROV. COMERC
-    linea += formatear_campo(datos.get('CPA', ''), 5, 'N')  # COD POSTAL COMERCIAL
-    linea += formatear_campo('0', 8, 'N', '0')  # COD POSTAL EXTENDIDO COMERC
-    linea += formatear_campo(pref_tel, 5, 'A')  # PREF. TEL COMERCIAL
-    linea += formatear_campo(tel_particular, 11, 'N')  # TELEFONO COMERC
-    linea += formatear_campo(datos.get('FEC_NACIMIENTO', ''), 8, 'N')  # FECHA NACIMIENTO
-    linea += formatear_campo('1', 4, 'N','1')  # ESTADO CIVIL
-    linea += formatear_campo('S', 1, 'A', 'S')  # RESIDENTE
-    linea += formatear_campo(mapear_sexo(datos.get('SEXO', '')), 1, 'A')  # SEXO
-    linea += formatear_campo('1', 3, 'N', '1')  # NACIONALIDAD
-    linea += formatear_campo(mail_post, 30, 'A')  # EMAIL
-    linea += formatear_campo('F', 1, 'A', 'F')  # TIPO PERSONA
-    linea += formatear_campo('2', 5, 'N', '2')  # COD. ACT. BCRA
-    linea += formatear_campo('27', 3, 'N', '27')  # COD. NAT. JURIDICA
-    linea += formatear_campo('', 15, 'A')  # PRIMER APELLIDO CONYUGE
-    linea += formatear_campo('', 15, 'A')  # SEGUNDO APELLIDO CONYUGE
-    linea += formatear_campo('', 15, 'A')  # PRIMER NOMBRE CONYUGE
-    linea += formatear_campo('', 15, 'A')  # SEGUNDO NOMBRE CONYUGE
-    linea += formatear_campo('', 1, 'A')  # SEXO CONYUGE
-    linea += formatear_campo('', 3, 'N')  # TIPO DOC CONYUGE
-    linea += formatear_campo('', 11, 'N')  # NRO DOC CONYUGE
-    linea += formatear_campo('', 11, 'N')  # CUIT CONYUGE
-    linea += formatear_campo('', 8, 'N')  # FECHA NACIMIENTO CONYUGE
-    linea += formatear_campo('', 3, 'N')  # NACIONALIDAD CONYUGE
-    linea += formatear_campo('1137', 5, 'N', '1137')  # NRO EMPRESA
-    linea += formatear_campo('0', 3, 'N', '0')  # TIPO CONVENIO
-    linea += formatear_campo('1', 1, 'A', '1')  # VALIDA NOMBRE
-    linea += formatear_campo('', 30, 'A')  # NOMBRE CLIENTE SEGUN PATRON
-    linea += formatear_campo('', 409, 'A')  # FILLER
-    linea += formatear_campo('', 2, 'N')  # TIPO SOLICITUD
-    linea += formatear_campo('', 22, 'A')  # CRU
-    linea += formatear_campo('', 330, 'A')  # FILLER 2
-    linea += formatear_campo('', 21, 'A')  # DATOS PARA EMPRESA
-    # MOTIVO DEL ERROR 1-7 (7 campos de 5 caracteres cada uno)
-    for _ in range(7):
-        linea += formatear_campo('', 5, 'A')
-    
-    return linea
-
-
-def generar_archivo_hab(df: pd.DataFrame, output_path: str) -> tuple:
+    return {
+        'COD_BCO_CBA': datos.get('COD_BCO_CBA', ''),
+        'NRO_DOCUMENTO': datos.get('NRO_DOCUMENTO', ''),
+        'CUIL': datos.get('CUIL', ''),
+        'FECHA_ALTA': datetime.now().strftime('%Y%m%d'),
+        'PRIMER_APELLIDO': primer_apellido,
+        'SEGUNDO_APELLIDO': segundo_apellido,
+        'PRIMER_NOMBRE': primer_nombre,
+        'SEGUNDO_NOMBRE': segundo_nombre,
+        'N_CALLE': datos.get('N_CALLE', ''),
+        'ALTURA_ORACLE': datos.get('ALTURA_ORACLE', ''),
+        'N_BARRIO': n_barrio,
+        'N_LOCALIDAD': datos.get('N_LOCALIDAD', ''),
+        'CPA': datos.get('CPA', ''),
+        'PREF_TEL': pref_tel,
+        'TEL_PARTICULAR': tel_particular,
+        'FEC_NACIMIENTO': datos.get('FEC_NACIMIENTO', ''),
+        'SEXO': mapear_sexo(datos.get('SEXO', '')),
+        'MAIL_POST': mail_post,
+    }
+
+
+def generar_linea_hab(row):
+    """Genera una línea del archivo .HAB según el formato especificado (LAYOUT_HAB)."""
+    valores = calcular_campos_fila(row)
+    
+    partes = []
+    fin_anterior = 0
+    for campo in CAMPOS_VARIABLES_HAB:
+        partes.append(PLANTILLA_HAB[fin_anterior:campo.offset])
+        valor = valores[campo.fuente]
+        if campo.tipo == 'A':
+            valor = normalizar_texto_hab(valor)
+        partes.append(formatear_campo(valor, campo.longitud, campo.tipo, campo.default))
+        fin_anterior = campo.offset + campo.longitud
+    partes.append(PLANTILLA_HAB[fin_anterior:])
+    
+    return ''.join(partes)
+
+
+# ==================== CODIFICACIÓN COLUMNAR ====================
+
+# Caracteres que str.isdigit() acepta dentro de latin-1: dígitos ASCII y superíndices
+_NO_DIGITOS = '[^0-9²³¹]'
+
+
+def formatear_columna(serie, longitud, tipo, default=''):
     """
-    Genera un archivo .HAB a partir de un DataFrame.
+    Versión columnar de formatear_campo: formatea una Serie completa con las
+    mismas reglas (default para null/'', strip, ceros a la izquierda o
+    espacios a la derecha y truncado a la longitud).
+    """
+    serie = serie.astype(object)
+    valores = serie.where(~_es_vacio(serie), default).astype(str).str.strip()
     
-    Validación: Solo genera línea HAB si IdApoderado NO es null/vacío.
+    if tipo == 'N':
+        valores = valores.str.replace(_NO_DIGITOS, '', regex=True)
+        valores = valores.where(valores != '', '0')
+        return valores.str.zfill(longitud).str[:longitud]
+    else:
+        return valores.str.ljust(longitud).str[:longitud]
+
+
+def _dividir_dos_palabras(serie):
+    """Versión columnar de procesar_apellido/procesar_nombre."""
+    palabras = serie.where(~_es_vacio(serie), '').astype(str).str.split()
+    return palabras.str[0].fillna(''), palabras.str[1].fillna('')
+
+
+def _procesar_celular_columna(serie):
+    """
+    Versión columnar de procesar_celular_post: la búsqueda del código de
+    área se hace por largo (del mayor al menor) sobre toda la columna.
+    """
+    digitos = serie.where(~_es_vacio(serie), '').astype(str).str.replace('[^0-9]', '', regex=True)
+    
+    # 54 de país, 9 de celular desde el exterior y 0 de larga distancia
+    largo = digitos.str.len()
+    con_pais = (largo > LARGO_NUMERO_NACIONAL + 1) & digitos.str.startswith('54')
+    digitos = digitos.where(~con_pais, digitos.str[2:])
+    con_nueve = (digitos.str.len() == LARGO_NUMERO_NACIONAL + 1) & digitos.str.startswith('9')
+    digitos = digitos.where(~con_nueve, digitos.str[1:])
+    digitos = digitos.where(~digitos.str.startswith('0'), digitos.str[1:])
+    
+    largo_prefijo = pd.Series(0, index=digitos.index)
+    for largo, codigos in INDICE_CODIGOS_AREA.items():
+        encontrado = (largo_prefijo == 0) & digitos.str[:largo].isin(codigos)
+        largo_prefijo = largo_prefijo.mask(encontrado, largo)
+    
+    # Sin código conocido: los primeros 4 dígitos
+    conocido = largo_prefijo > 0
+    largo_prefijo = largo_prefijo.mask(~conocido, 4)
+    
+    prefijo = pd.Series('', index=digitos.index, dtype=object)
+    numero = pd.Series('', index=digitos.index, dtype=object)
+    for largo in map(int, largo_prefijo.unique()):
+        filas = largo_prefijo == largo
+        prefijo = prefijo.mask(filas, digitos.str[:largo])
+        numero = numero.mask(filas, digitos.str[largo:])
+    
+    # 0351 15 1234567: el 15 de celular va entre el código de área y el número
+    con_quince = conocido & numero.str.startswith('15') & (digitos.str.len() == LARGO_NUMERO_NACIONAL + 2)
+    numero = numero.mask(con_quince, numero.str[2:])
+    return prefijo, numero
+
+
+def _mapear_sexo_columna(serie):
+    """Versión columnar de mapear_sexo."""
+    sexo = serie.where(serie.notna(), '').astype(str).str.strip().str.upper()
+    resultado = pd.Series('', index=serie.index, dtype=object)
+    resultado = resultado.where(~sexo.isin(['VARON', 'M', '1', '01']), '1')
+    return resultado.where(~sexo.isin(['MUJER', 'F', '2', '02']), '2')
+
+
+def calcular_campos_hab(df, fecha_alta=None, tiene_apoderado=None, plan=None):
+    """
+    Versión columnar de calcular_campos_fila: calcula todas las fuentes de
+    LAYOUT_HAB para todas las filas del DataFrame a la vez.
     
     Args:
-        df: DataFrame con los datos procesados
-        output_path: Ruta donde guardar el archivo .HAB
+        df: DataFrame con los datos del Excel
+        fecha_alta: FECHA ALTA (YYYYMMDD) a usar; por defecto la fecha actual
+        tiene_apoderado, plan: Como en aplicar_logica_apoderado_columnas
     
     Returns:
-        Tupla (lineas_generadas, lineas_saltadas) - número de líneas generadas y saltadas
+        Dict fuente → Serie (FECHA_ALTA es un único string para todo el archivo)
     """
-    lineas_generadas = 0
-    lineas_saltadas = 0
+    datos = aplicar_logica_apoderado_columnas(df, tiene_apoderado, plan)
     
-    # newline='' para controlar manualmente los saltos de línea (CR-LF para Windows)
-    with open(output_path, 'w', encoding='latin-1', newline='') as f:
-        for _, row in df.iterrows():
-            # Validación: Si IdApoderado está vacío o es null, SALTAR registro
-            IdApoderado = row.get('IdApoderado', '')
-            if pd.isna(IdApoderado) or str(IdApoderado).strip() == '':
-                lineas_saltadas += 1
-                continue
-            
-            linea = generar_linea_hab(row)
-            f.write(linea + '\r\n')  # CR-LF (Windows)
-            lineas_generadas += 1
+    primer_apellido, segundo_apellido = _dividir_dos_palabras(datos['APELLIDO'])
+    primer_nombre, segundo_nombre = _dividir_dos_palabras(datos['NOMBRE'])
+    pref_tel, tel_particular = _procesar_celular_columna(datos['CELULAR_POST'])
     
-    return lineas_generadas, lineas_saltadas
+    # N_BARRIO: si es NULL usar "OTRO"
+    n_barrio = _por_categoria(datos['N_BARRIO'], lambda barrio: barrio.where(~_es_vacio(barrio), 'OTRO'))
+    
+    # EMAIL: si supera 30 caracteres usar email genérico
+    mail_post = datos['MAIL_POST']
+    mail_largo = ~_es_vacio(mail_post) & (mail_post.fillna('').astype(str).str.len() > 30)
+    mail_post = mail_post.where(~mail_largo, 'mailgenerica@bancor.com.ar')
+    
+    if fecha_alta is None:
+        fecha_alta = datetime.now().strftime('%Y%m%d')
+    
+    return {
+        'COD_BCO_CBA': datos['COD_BCO_CBA'],
+        'NRO_DOCUMENTO': datos['NRO_DOCUMENTO'],
+        'CUIL': datos['CUIL'],
+        'FECHA_ALTA': fecha_alta,
+        'PRIMER_APELLIDO': primer_apellido,
+        'SEGUNDO_APELLIDO': segundo_apellido,
+        'PRIMER_NOMBRE': primer_nombre,
+        'SEGUNDO_NOMBRE': segundo_nombre,
+        'N_CALLE': datos['N_CALLE'],
+        'ALTURA_ORACLE': datos['ALTURA_ORACLE'],
+        'N_BARRIO': n_barrio,
+        'N_LOCALIDAD': datos['N_LOCALIDAD'],
+        'CPA': datos['CPA'],
+        'PREF_TEL': pref_tel,
+        'TEL_PARTICULAR': tel_particular,
+        'FEC_NACIMIENTO': datos['FEC_NACIMIENTO'],
+        'SEXO': _por_categoria(datos['SEXO'], _mapear_sexo_columna),
+        'MAIL_POST': mail_post,
+    }
 
 
-# ==================== PROCESAMIENTO PRINCIPAL ====================
+def codificar_campos_hab(valores, cantidad):
+    """
+    Codifica campos ya calculados (ver calcular_campos_hab) como registros .HAB.
+    
+    Se parte de un buffer preasignado donde cada fila es una copia de
+    PLANTILLA_HAB + CR-LF, y solo se sobrescriben los campos variables,
+    columna por columna. Los campos alfanuméricos pasan por
+    normalizar_columna_hab, así que la codificación latin-1 nunca falla.
+    
+    Args:
+        valores: Dict fuente → Serie (o valor único para todas las filas)
+        cantidad: Cantidad de registros
+    
+    Returns:
+        Array numpy uint8 de forma (cantidad, ANCHO_REGISTRO_HAB + 2), en latin-1
+    """
+    registro = np.frombuffer((PLANTILLA_HAB + '\r\n').encode('latin-1'), dtype=np.uint8)
+    buffer = np.empty((cantidad, len(registro)), dtype=np.uint8)
+    buffer[:] = registro
+    if cantidad == 0:
+        return buffer
+    
+    # Varios campos del diseño comparten fuente (domicilio particular y
+    # comercial, teléfonos): se formatean una sola vez
+    formateados = {}
+    for campo in CAMPOS_VARIABLES_HAB:
+        clave = (campo.fuente, campo.longitud, campo.tipo, campo.default)
+        if clave not in formateados:
+            valor = valores[campo.fuente]
+            if isinstance(valor, pd.Series) and isinstance(valor.dtype, pd.CategoricalDtype):
+                # Se normaliza y formatea cada categoría (y el null, en el
+                # último lugar para el código -1) y se replica por fila
+                distintos = pd.Series([*valor.cat.categories, None], dtype=object)
+                columna = _codificar_columna(distintos, campo)[valor.cat.codes.to_numpy()]
+            elif isinstance(valor, pd.Series) and campo.fuente in CAMPOS_REPETIDOS:
+                codigos, distintos = pd.factorize(valor, use_na_sentinel=False)
+                columna = _codificar_columna(pd.Series(distintos, dtype=object), campo)[codigos]
+            elif isinstance(valor, pd.Series):
+                columna = _codificar_columna(valor, campo)
+            else:
+                texto = formatear_campo(valor, campo.longitud, campo.tipo, campo.default)
+                columna = np.frombuffer(texto.encode('latin-1'), dtype=np.uint8)
+            formateados[clave] = columna
+        buffer[:, campo.offset:campo.offset + campo.longitud] = formateados[clave]
+    
+    return buffer
 
-def procesar_archivo_excel(excel_path):
-    """Procesa un archivo Excel individual y genera el archivo .HAB"""
-    filename = os.path.basename(excel_path)
-    print(f"\n🔄 Procesando archivo: {filename}")
+
+def _codificar_columna(serie, campo):
+    """Formatea una Serie para `campo` y la devuelve como matriz uint8 (filas × longitud)."""
+    if campo.tipo == 'A':
+        serie = normalizar_columna_hab(serie)
+    texto = ''.join(formatear_columna(serie, campo.longitud, campo.tipo, campo.default).tolist())
+    return np.frombuffer(texto.encode('latin-1'), dtype=np.uint8).reshape(len(serie), campo.longitud)
+
+
+def _codificar_con_apoderado(df, fecha_alta=None, metricas=None, perfil=None, validacion=None, primera_fila=0,
+                             plan=None):
+    """
+    Codifica solo las filas con IdApoderado no null/vacío. La máscara se
+    calcula una vez y los campos salen directamente de las columnas del
+    apoderado (según plan, ver compilar_plan_origen).
     
-    try:
-        # Leer archivo Excel
-        df = pd.read_excel(excel_path, dtype=str)
-        
-        # Limpiar nombres de columnas (quitar espacios al inicio/final)
-        df.columns = df.columns.str.strip()
-        
-        print(f"   ✅ Archivo cargado con {len(df)} filas y {len(df.columns)} columnas.")
-        print(f"   📋 Columnas disponibles: {list(df.columns)}")
-        
-        # Validar columnas mínimas requeridas
-        # Si tiene apoderado, verificar campos de apoderado
-        # Si no, verificar campos de beneficiario
-        tiene_columnas_apoderado = all(col in df.columns for col in ['IdApoderado', 'APO_SEXO'])
-        tiene_columnas_beneficiario = all(col in df.columns for col in ['NUMERO_DOCUMENTO', 'SEXO'])
-        
-        if not tiene_columnas_apoderado and not tiene_columnas_beneficiario:
-            print(f"   ❌ Error: El archivo debe contener campos de beneficiario o apoderado")
-            print(f"   💡 Campos mínimos beneficiario: SEXO, NUMERO_DOCUMENTO, APELLIDO, NOMBRE, CUIL")
-            print(f"   💡 Campos mínimos apoderado: APO_SEXO, IdApoderado, APO_APELLIDO, APO_NOMBRE, APO_CUIL")
-            return
-        
-        # Contar registros con apoderado válido (IdApoderado no vacío)
-        registros_con_apoderado = 0
-        if 'IdApoderado' in df.columns:
-            # Verificar que IdApoderado no esté vacío
-            mask_apoderado = (df['IdApoderado'].notna()) & \
-                             (df['IdApoderado'].astype(str).str.strip() != '')
-            registros_con_apoderado = mask_apoderado.sum()
-            print(f"   📊 Registros con apoderado válido (IdApoderado): {registros_con_apoderado}")
-            print(f"   📊 Registros sin apoderado válido: {len(df) - registros_con_apoderado}")
-        
-        # Generar archivo .HAB
-        print(f"   📝 Generando archivo .HAB...")
-        
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        hab_filename = f"{os.path.splitext(filename)[0]}_{timestamp}.HAB"
-        hab_path = os.path.join(PROCESADOS_DIR, hab_filename)
-        
-        lineas_hab, lineas_saltadas = generar_archivo_hab(df, hab_path)
-        print(f"   ✅ Archivo .HAB generado: {hab_path}")
-        print(f"   📊 Total de líneas creadas en archivo .HAB: {lineas_hab}")
-        if lineas_saltadas > 0:
-            print(f"   ⚠️  Registros saltados (IdApoderado vacío): {lineas_saltadas}")
-        
-        # Guardar también Excel procesado con los datos normalizados
-        excel_output_filename = f"procesado_{os.path.splitext(filename)[0]}_{timestamp}.xlsx"
-        excel_output_path = os.path.join(PROCESADOS_DIR, excel_output_filename)
-        df.to_excel(excel_output_path, index=False)
-        print(f"   💾 Excel procesado guardado: {excel_output_path}")
-        
-    except Exception as e:
-        print(f"   ❌ Error procesando archivo {filename}: {e}")
-        import traceback
-        traceback.print_exc()
+    Si se pasan, acumula en metricas las etapas 'mapeo', 'validacion' y
+    'codificacion' (ver medir_etapa) y activa el cProfile.Profile perfil
+    solo durante ellas. Si se pasa la lista validacion, le agrega los
+    problemas de la validación previa (ver validar_campos_hab) de las filas
+    codificadas; primera_fila es la cantidad de filas anteriores a df.
+    
+    Returns:
+        Tupla (buffer, filas, valores) - registros codificados, posiciones
+        en df de las filas codificadas y campos calculados (ver calcular_campos_hab)
+    """
+    with _perfilando(perfil):
+        with medir_etapa(metricas, 'mapeo'):
+            plan = plan or compilar_plan_origen(df.columns)
+            mascara = mascara_apoderado(df).to_numpy(dtype=bool)
+            registros = df[mascara]
+            todos = np.ones(len(registros), dtype=bool)
+            valores = calcular_campos_hab(registros, fecha_alta, todos, plan)
+        filas = np.flatnonzero(mascara)
+        if validacion is not None:
+            with medir_etapa(metricas, 'validacion'):
+                validacion.append(validar_campos_hab(registros, valores, filas, primera_fila, todos, plan))
+        with medir_etapa(metricas, 'codificacion'):
+            buffer = codificar_campos_hab(valores, len(registros))
+    return buffer, filas, valores
 
 
-def main():
-    """Función principal que procesa todos los archivos .xlsx"""
-    print("🚀 Iniciando procesamiento directo de archivos Excel...")
-    print(f"📁 Directorio de entrada: {FERIAS_NOC_DIR}")
-    print(f"📁 Directorio de salida: {PROCESADOS_DIR}")
+def generar_contenido_hab(df: pd.DataFrame, fecha_alta=None, metricas=None, avance=None,
+                          tamano_bloque=None) -> tuple:
+    """
+    Genera el contenido completo de un archivo .HAB en memoria.
     
-    # Crear directorio de salida si no existe
-    os.makedirs(PROCESADOS_DIR, exist_ok=True)
+    Validación: Solo genera línea HAB si IdApoderado NO es null/vacío.
     
-    # Buscar archivos .xlsx en el directorio
-    pattern = os.path.join(FERIAS_NOC_DIR, "*.xlsx")
-    all_excel_files = glob.glob(pattern)
+    Args:
+        df: DataFrame con los datos procesados
+        fecha_alta: FECHA ALTA (YYYYMMDD) a usar; por defecto la fecha actual
+        metricas: Dict de nuevas_metricas() donde acumular tiempos por etapa (opcional)
+        avance: Función avance(filas_procesadas, total) para informar el
+            progreso (opcional). Si se pasa, df se codifica por bloques de
+            tamano_bloque filas y se llama con 0 al empezar y después de
+            cada bloque. Sin avance, df se codifica de una vez.
+        tamano_bloque: Filas por bloque cuando se pasa avance (por defecto
+            TAMANO_BLOQUE). El contenido es el mismo para cualquier tamaño.
+
+    Returns:
+        Tupla (contenido, lineas_generadas, lineas_saltadas) - contenido en
+        bytes latin-1 con saltos de línea CR-LF
+    """
+    if avance is None:
+        buffer, _, _ = _codificar_con_apoderado(df, fecha_alta, metricas)
+        with medir_etapa(metricas, 'escritura_hab'):
+            contenido = buffer.tobytes()
+        return contenido, len(buffer), len(df) - len(buffer)
     
-    # Filtrar archivos temporales de Excel
-    excel_files = [f for f in all_excel_files if not os.path.basename(f).startswith('~$')]
+    # Misma FECHA ALTA para todos los bloques
+    fecha_alta = fecha_alta or datetime.now().strftime('%Y%m%d')
+    tamano_bloque = tamano_bloque or TAMANO_BLOQUE
+    plan = compilar_plan_origen(df.columns)
+    buffers = []
+    avance(0, len(df))
+    for inicio in range(0, len(df), tamano_bloque):
+        bloque = df.iloc[inicio:inicio + tamano_bloque]
+        buffer, _, _ = _codificar_con_apoderado(bloque, fecha_alta, metricas, primera_fila=inicio, plan=plan)
+        buffers.append(buffer)
+        avance(inicio + len(bloque), len(df))
+    with medir_etapa(metricas, 'escritura_hab'):
+        contenido = b''.join(buffers)
+    lineas_generadas = sum(len(buffer) for buffer in buffers)
+    return contenido, lineas_generadas, len(df) - lineas_generadas
+
+
+# Motivos de repetidos_<archivo>.csv
+MOTIVO_ENVIADO = 'enviada en otro .HAB'
+MOTIVO_REPETIDO = 'repetida en este archivo'
+
+
+def _texto_campo(buffer, nombre):
+    """Valores (con relleno) del campo `nombre` de cada registro codificado."""
+    campo = _CAMPOS_POR_NOMBRE[nombre]
+    columna = np.ascontiguousarray(buffer[:, campo.offset:campo.offset + campo.longitud])
+    return np.char.decode(columna.view(f'S{campo.longitud}').ravel(), 'latin-1')
+
+
+def _controlar_enviados(buffer, registro, output_path, metricas=None):
+    """
+    Controla en el registro las personas de los registros codificados: las
+    ya enviadas en otro .HAB, las reservadas por otro .HAB en curso y las
+    repetidas dentro del archivo que se está generando (en este buffer o en
+    bloques anteriores) se agregan a registro.repetidos y, si
+    registro.omitir, se marcan para no escribirlas. Todas quedan reservadas
+    a nombre de output_path en la misma transacción (ver
+    RegistroEnviados.controlar); las escritas se registran cuando el .HAB
+    esté completo (ver _confirmar_enviados).
     
-    if not excel_files:
-        print(f"❌ No se encontraron archivos .xlsx en {FERIAS_NOC_DIR}")
-        print(f"\n💡 Uso alternativo: Puedes llamar a la función directamente:")
-        print(f"   from procesar_excel_directo import procesar_archivo_excel")
-        print(f"   procesar_archivo_excel('ruta/al/archivo.xlsx')")
-        return
+    Returns:
+        Máscara booleana de los registros del buffer que se deben escribir
+    """
+    mantener = np.ones(len(buffer), dtype=bool)
+    if registro is None:
+        return mantener
     
-    print(f"📋 Se encontraron {len(excel_files)} archivo(s) .xlsx para procesar\n")
+    with medir_etapa(metricas, 'registro'):
+        cuils = _texto_campo(buffer, 'NRO CLAVE FISCAL')
+        documentos = _texto_campo(buffer, 'NRO DOCUMENTO')
+        encontrados = registro.controlar(cuils, documentos, os.path.basename(output_path))
+        if encontrados:
+            posiciones = np.fromiter(sorted(encontrados), dtype=np.int64, count=len(encontrados))
+            apellidos = _texto_campo(buffer[posiciones], 'PRIMER APELLIDO')
+            nombres = _texto_campo(buffer[posiciones], 'PRIMER NOMBRE')
+            for posicion, apellido, nombre in zip(posiciones, apellidos, nombres):
+                archivo_hab, fecha = encontrados[posicion]
+                registro.repetidos.append({
+                    'cuil': cuils[posicion],
+                    'nro_documento': documentos[posicion],
+                    'apellido': apellido.rstrip(),
+                    'nombre': nombre.rstrip(),
+                    'motivo': MOTIVO_ENVIADO if archivo_hab else MOTIVO_REPETIDO,
+                    'archivo_hab_anterior': archivo_hab or '',
+                    'fecha_anterior': fecha or '',
+                })
+            if registro.omitir:
+                mantener[posiciones] = False
+    return mantener
+
+
+def _confirmar_enviados(registro, output_path, metricas=None):
+    """Registra las personas reservadas una vez que el .HAB quedó completo con su nombre final."""
+    if registro is not None:
+        with medir_etapa(metricas, 'registro'):
+            registro.confirmar_reservas(os.path.basename(output_path))
+
+
+def _escribir_bloque(f, datos, sha256, metricas=None):
+    with medir_etapa(metricas, 'escritura_hab'):
+        f.write(datos.data)
+        sha256.update(datos.data)
+
+
+def _agregar_auditoria(auditoria, tabla, metricas=None):
+    with medir_etapa(metricas, 'auditoria'):
+        auditoria.agregar(tabla)
+
+
+def generar_archivo_hab(df: pd.DataFrame, output_path: str, metricas=None, perfil=None, registro=None,
+                        auditoria=None, validacion=None) -> tuple:
+    """
+    Genera un archivo .HAB a partir de un DataFrame.
     
-    archivos_procesados = 0
-    archivos_con_error = 0
+    Validación: Solo genera línea HAB si IdApoderado NO es null/vacío.
     
-    for excel_file in excel_files:
-        try:
-            procesar_archivo_excel(excel_file)
-            archivos_procesados += 1
-        except Exception as e:
-            print(f"❌ Error general procesando {os.path.basename(excel_file)}: {e}")
-            archivos_con_error += 1
+    El archivo se escribe como <archivo>.HAB.parcial y se renombra recién
+    cuando está completo en disco (ver finalizar_archivo_hab): si el
+    proceso se corta, no queda un .HAB truncado con nombre válido. Las
+    personas quedan reservadas al controlarlas y se registran como enviadas
+    después del renombrado; el registro no queda bloqueado mientras se
+    escribe el archivo.
     
-    print("\n🎉 Procesamiento completado!")
+    Args:
+        df: DataFrame con los datos procesados
+        output_path: Ruta donde guardar el archivo .HAB
+        metricas: Dict de nuevas_metricas() donde acumular tiempos por etapa (opcional)
+        perfil: cProfile.Profile a activar durante el mapeo y la codificación (opcional)
+        registro: RegistroEnviados para controlar y registrar las personas
+            enviadas (opcional; ver _controlar_enviados)
+        auditoria: EscritorAuditoria donde agregar los campos de los
+            registros escritos (opcional; ver tabla_auditoria)
+        validacion: Lista donde agregar el DataFrame de problemas de la
+            validación previa (opcional; ver validar_campos_hab)
+    
+    Returns:
+        Tupla (lineas_generadas, lineas_saltadas) - número de líneas generadas y saltadas
+        (las personas omitidas por el registro no cuentan como generadas ni saltadas)
+    """
+    buffer, filas, valores = _codificar_con_apoderado(df, None, metricas, perfil, validacion)
+    
+    # Registros en latin-1 con CR-LF (Windows) ya incluido
+    parcial = output_path + SUFIJO_PARCIAL
+    try:
+        escritos = _controlar_enviados(buffer, registro, output_path, metricas)
+        datos = buffer if escritos.all() else buffer[escritos]
+        with medir_etapa(metricas, 'escritura_hab'):
+            with open(parcial, 'wb') as f:
+                f.write(datos.data)
+                _confirmar_archivo(f)
+            finalizar_archivo_hab(parcial, output_path, len(datos), hashlib.sha256(datos.data).hexdigest())
+        _confirmar_enviados(registro, output_path, metricas)
+    except BaseException:
+        _borrar_si_existe(parcial)
+        if registro is not None:
+            registro.liberar_reservas(os.path.basename(output_path))
+        raise
+    
+    if auditoria is not None:
+        with medir_etapa(metricas, 'auditoria'):
+            auditoria.agregar(tabla_auditoria(df, filas, valores, escritos, tiene_apoderado=True))
+    
+    return int(escritos.sum()), len(df) - len(buffer)
+
+
+def generar_archivo_hab_por_bloques(bloques, output_path: str, metricas=None, perfil=None, registro=None,
+                                    auditoria=None, validacion=None, punto_control=None) -> tuple:
+    """
+    Genera un archivo .HAB a partir de DataFrames parciales (ver
+    leer_excel_por_bloques), codificando y escribiendo cada bloque apenas
+    se recibe. La memoria usada depende del tamaño del bloque, no del
+    total de filas.
+    
+    La escritura del .HAB y de la auditoría corre en un hilo aparte (ver
+    EtapaEnSegundoPlano), así el disco trabaja mientras se codifica el
+    bloque siguiente. Cada bloque se controla y se reserva en el registro
+    con una transacción corta (ver _controlar_enviados), así otro archivo
+    que se genera a la vez no puede llevar a las mismas personas; se
+    registran como enviadas una sola vez, cuando el .HAB ya tiene su nombre
+    final.
+    
+    Como en generar_archivo_hab, se escribe <archivo>.HAB.parcial y se
+    renombra al terminar. Con un PuntoDeControl, el progreso se confirma
+    cada INTERVALO_PUNTO_CONTROL filas y, si el punto ya tiene progreso, se
+    retoma el parcial desde ahí: las filas anteriores se leen pero no se
+    vuelven a codificar ni validar.
+    
+    Validación: Solo genera línea HAB si IdApoderado NO es null/vacío.
+    
+    metricas, perfil, registro, auditoria y validacion como en
+    generar_archivo_hab; los tiempos se suman bloque a bloque.
+    
+    Returns:
+        Tupla (lineas_generadas, lineas_saltadas) - número de líneas generadas y saltadas
+    """
+    lineas_generadas = 0
+    lineas_saltadas = 0
+    primera_fila = 0
+    bytes_escritos = 0
+    # Misma FECHA ALTA para todo el archivo aunque el proceso cruce la medianoche
+    fecha_alta = datetime.now().strftime('%Y%m%d')
+    parcial = output_path + SUFIJO_PARCIAL
+    sha256 = hashlib.sha256()
+    
+    retomar = 0
+    if punto_control is not None:
+        fecha_alta = punto_control.fecha_alta
+        if punto_control.filas:
+            retomar = punto_control.filas
+            lineas_generadas = punto_control.lineas_generadas
+            lineas_saltadas = punto_control.lineas_saltadas
+            bytes_escritos = punto_control.bytes
+            os.truncate(parcial, bytes_escritos)
+            sha256 = _hash_prefijo(parcial, bytes_escritos)
+    ultimo_punto = retomar
+    
+    # Todos los bloques tienen las mismas columnas: el plan se compila con el primero
+    plan = None
+    # Reservas que quedaron de un intento anterior con el mismo nombre: al
+    # retomar se vuelven a hacer con las filas ya escritas
+    if registro is not None:
+        registro.liberar_reservas(os.path.basename(output_path))
+    
+    try:
+        with open(parcial, 'r+b' if retomar else 'wb') as f, EtapaEnSegundoPlano() as escritura:
+            f.seek(bytes_escritos)
+            for bloque in bloques:
+                # Al retomar, las filas ya confirmadas en el parcial no se
+                # escriben de nuevo, pero se vuelven a controlar para reponer
+                # las reservas y los repetidos del registro
+                if registro is not None and primera_fila < retomar:
+                    plan = plan or compilar_plan_origen(bloque.columns)
+                    buffer, _, _ = _codificar_con_apoderado(
+                        bloque.iloc[:retomar - primera_fila], fecha_alta, metricas, perfil, None, primera_fila, plan
+                    )
+                    _controlar_enviados(buffer, registro, output_path, metricas)
+                if primera_fila + len(bloque) <= retomar:
+                    primera_fila += len(bloque)
+                    continue
+                if primera_fila < retomar:
+                    bloque = bloque.iloc[retomar - primera_fila:]
+                    primera_fila = retomar
+                
+                plan = plan or compilar_plan_origen(bloque.columns)
+                buffer, filas, valores = _codificar_con_apoderado(
+                    bloque, fecha_alta, metricas, perfil, validacion, primera_fila, plan
+                )
+                escritos = _controlar_enviados(buffer, registro, output_path, metricas)
+                datos = buffer if escritos.all() else buffer[escritos]
+                escritura.encargar(_escribir_bloque, f, datos, sha256, metricas)
+                if auditoria is not None:
+                    with medir_etapa(metricas, 'auditoria'):
+                        tabla = tabla_auditoria(bloque, filas, valores, escritos, primera_fila, True)
+                    escritura.encargar(_agregar_auditoria, auditoria, tabla, metricas)
+                lineas_generadas += len(datos)
+                lineas_saltadas += len(bloque) - len(buffer)
+                primera_fila += len(bloque)
+                bytes_escritos += datos.nbytes
+                
+                if punto_control is not None and primera_fila - ultimo_punto >= INTERVALO_PUNTO_CONTROL:
+                    # Se guarda en el hilo de escritura, después de escribir este bloque
+                    escritura.encargar(
+                        _guardar_punto_control, punto_control, f, auditoria,
+                        primera_fila, bytes_escritos, lineas_generadas, lineas_saltadas,
+                    )
+                    ultimo_punto = primera_fila
+            escritura.esperar()
+            with medir_etapa(metricas, 'escritura_hab'):
+                _confirmar_archivo(f)
+        with medir_etapa(metricas, 'escritura_hab'):
+            finalizar_archivo_hab(parcial, output_path, lineas_generadas, sha256.hexdigest())
+        _confirmar_enviados(registro, output_path, metricas)
+    except BaseException:
+        # El parcial se conserva para retomarlo solo si ya hay un punto de control guardado
+        if punto_control is None or not punto_control.guardado:
+            _borrar_si_existe(parcial)
+            if punto_control is not None:
+                punto_control.borrar()
+        if registro is not None:
+            registro.liberar_reservas(os.path.basename(output_path))
+        raise
+    
+    if punto_control is not None:
+        punto_control.borrar()
+    return lineas_generadas, lineas_saltadas
+
+
+def _guardar_punto_control(punto_control, f, auditoria, filas, bytes_escritos, lineas_generadas, lineas_saltadas):
+    """Confirma en disco el .HAB parcial y la auditoría y guarda el punto de control."""
+    _confirmar_archivo(f)
+    punto_control.bytes_auditoria = auditoria.confirmar() if auditoria is not None else None
+    punto_control.filas = filas
+    punto_control.bytes = bytes_escritos
+    punto_control.lineas_generadas = lineas_generadas
+    punto_control.lineas_saltadas = lineas_saltadas
+    punto_control.guardar()
+
+
+# ==================== VALIDACIÓN PREVIA ====================
+
+# Pesos del dígito verificador de CUIL/CUIT (módulo 11)
+PESOS_CUIL = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+
+# Largo máximo del email: los más largos se reemplazan por el genérico
+LARGO_MAXIMO_EMAIL = 30
+EMAIL_GENERICO = 'mailgenerica@bancor.com.ar'
+
+# Campos con validación propia, excluidos del control de desborde
+_CAMPOS_VALIDACION_PROPIA = ('FEC_NACIMIENTO', 'MAIL_POST')
+
+
+def _texto_sin_espacios(serie):
+    """Valores como texto sin espacios al inicio/final ('' para null/vacío)."""
+    serie = serie.astype(object)
+    return serie.where(~_es_vacio(serie), '').astype(str).str.strip()
+
+
+def _solo_digitos(texto):
+    """Dígitos ASCII de cada valor de una Serie de texto (ver _texto_sin_espacios)."""
+    return texto.str.replace('[^0-9]', '', regex=True)
+
+
+def cuil_valido(digitos):
+    """
+    Máscara de CUIL con 11 dígitos y dígito verificador correcto.
+    
+    Args:
+        digitos: Serie de CUIL ya reducidos a dígitos (ver _solo_digitos)
+    """
+    validos = pd.Series(False, index=digitos.index)
+    largo_ok = (digitos.str.len() == 11).to_numpy(dtype=bool)
+    if not largo_ok.any():
+        return validos
+    
+    matriz = np.frombuffer(''.join(digitos[largo_ok].tolist()).encode('ascii'), dtype=np.uint8)
+    matriz = matriz.reshape(-1, 11).astype(np.int64) - ord('0')
+    verificador = 11 - (matriz[:, :10] @ PESOS_CUIL) % 11
+    verificador[verificador == 11] = 0
+    # Un resto de 10 no tiene dígito válido (se asigna otro prefijo)
+    validos[largo_ok] = (verificador != 10) & (verificador == matriz[:, 10])
+    return validos
+
+
+def _fecha_valida(digitos):
+    """Máscara de fechas AAAAMMDD existentes entre 1900 y hoy (admite la hora 000000 de Excel)."""
+    fecha = digitos.where(~((digitos.str.len() == 14) & digitos.str.endswith('000000')), digitos.str[:8])
+    fechas = pd.to_datetime(fecha.where(fecha.str.len() == 8), format='%Y%m%d', errors='coerce')
+    return fechas.notna() & (fechas >= pd.Timestamp(1900, 1, 1)) & (fechas <= pd.Timestamp.now())
+
+
+def validar_campos_hab(registros, valores, filas, primera_fila=0, tiene_apoderado=None, plan=None):
+    """
+    Validación previa a la codificación, columna por columna sobre los
+    campos calculados (ver calcular_campos_hab). Los registros con
+    problemas igual se generan: formatear_campo los recorta o completa, y
+    este reporte permite corregirlos en el origen antes de que el banco
+    los rechace.
+    
+    - CUIL de 11 dígitos con dígito verificador correcto
+    - DNI no vacío, de hasta 8 dígitos y coincidente con el del CUIL
+    - FEC_NACIMIENTO como fecha AAAAMMDD válida
+    - COD_BCO_CBA (sucursal) no vacío
+    - Valores más largos que su campo del .HAB (se truncarían)
+    - Emails de más de LARGO_MAXIMO_EMAIL caracteres (se reemplazan por EMAIL_GENERICO)
+    
+    Args:
+        registros: Filas del DataFrame que se codifican
+        valores: Campos calculados de esas filas
+        filas: Posiciones de esas filas en el DataFrame original
+        primera_fila: Filas anteriores al DataFrame (para el modo por bloques)
+        tiene_apoderado, plan: Como en aplicar_logica_apoderado_columnas
+    
+    Returns:
+        DataFrame con fila_excel, campo, valor y error (vacío si no hay problemas)
+    """
+    problemas = []
+    textos = {}
+    
+    def texto(fuente):
+        # Cada fuente se convierte a texto una sola vez
+        if fuente not in textos:
+            textos[fuente] = _texto_sin_espacios(valores[fuente])
+        return textos[fuente]
+    
+    def agregar(mascara, campo, error, serie=None):
+        posiciones = np.flatnonzero(np.asarray(mascara, dtype=bool))
+        if len(posiciones) == 0:
+            return
+        serie = valores[campo] if serie is None else serie
+        problemas.append(pd.DataFrame({
+            # +2: encabezado en la fila 1 y filas de Excel numeradas desde 1
+            'fila_excel': primera_fila + filas[posiciones] + 2,
+            'campo': campo,
+            'valor': serie.iloc[posiciones].astype(object).to_numpy(),
+            'error': error if isinstance(error, str) else np.asarray(error)[posiciones],
+        }))
+    
+    cuil = _solo_digitos(texto('CUIL'))
+    dni = _solo_digitos(texto('NRO_DOCUMENTO')).str.lstrip('0')
+    agregar(cuil == '', 'CUIL', 'CUIL vacío o sin dígitos')
+    agregar((cuil != '') & ~cuil_valido(cuil), 'CUIL', 'CUIL inválido (largo o dígito verificador)')
+    agregar(dni == '', 'NRO_DOCUMENTO', 'DNI vacío o sin dígitos')
+    agregar(dni.str.len() > 8, 'NRO_DOCUMENTO', 'DNI de más de 8 dígitos')
+    comparables = (dni != '') & (cuil.str.len() == 11)
+    agregar(comparables & (cuil.str[2:10].str.lstrip('0') != dni), 'NRO_DOCUMENTO', 'DNI no coincide con el CUIL')
+    
+    nacimiento = texto('FEC_NACIMIENTO')
+    agregar(nacimiento == '', 'FEC_NACIMIENTO', 'Fecha de nacimiento vacía')
+    agregar((nacimiento != '') & ~_fecha_valida(_solo_digitos(nacimiento)), 'FEC_NACIMIENTO',
+            'Fecha de nacimiento inválida (se espera AAAAMMDD)')
+    
+    agregar(_solo_digitos(texto('COD_BCO_CBA')) == '', 'COD_BCO_CBA', 'Sucursal (COD_BCO_CBA) vacía')
+    
+    plan = plan or compilar_plan_origen(registros.columns)
+    if tiene_apoderado is None:
+        tiene_apoderado = mascara_apoderado(registros)
+    mail = _campo_origen(
+        registros, plan.campos['MAIL_POST'], np.asarray(tiene_apoderado, dtype=bool),
+        pd.Series('', index=registros.index, dtype=object),
+    )
+    agregar(mail.fillna('').astype(str).str.len() > LARGO_MAXIMO_EMAIL, 'MAIL_POST',
+            f'Email de más de {LARGO_MAXIMO_EMAIL} caracteres: se reemplaza por {EMAIL_GENERICO}', mail)
+    
+    # Desborde: el valor no entra en el campo del .HAB y formatear_campo lo trunca
+    revisados = set()
+    for campo in CAMPOS_VARIABLES_HAB:
+        serie = valores[campo.fuente]
+        if (
+            campo.fuente in _CAMPOS_VALIDACION_PROPIA
+            or (campo.fuente, campo.longitud) in revisados
+            or not isinstance(serie, pd.Series)
+        ):
+            continue
+        revisados.add((campo.fuente, campo.longitud))
+        valor = texto(campo.fuente)
+        largo = valor.str.len()
+        # Solo los candidatos se limpian: quitar no dígitos o normalizar puede acortar el valor
+        candidatos = largo > campo.longitud
+        if not candidatos.any():
+            continue
+        if campo.tipo == 'N':
+            largo[candidatos] = valor[candidatos].str.replace(_NO_DIGITOS, '', regex=True).str.len()
+            unidad = 'dígitos'
+        else:
+            largo[candidatos] = normalizar_columna_hab(valor[candidatos]).str.strip().str.len()
+            unidad = 'caracteres'
+        desborde = largo > campo.longitud
+        if desborde.any():
+            agregar(desborde, campo.fuente,
+                    largo.astype(str) + f' {unidad}, {campo.nombre} admite {campo.longitud}: se trunca')
+    
+    columnas = ['fila_excel', 'campo', 'valor', 'error']
+    if not problemas:
+        return pd.DataFrame(columns=columnas)
+    return pd.concat(problemas, ignore_index=True)[columnas].sort_values(
+        ['fila_excel', 'campo'], kind='stable', ignore_index=True
+    )
+
+
+def validar_registros_hab(df, primera_fila=0):
+    """
+    Validación previa (ver validar_campos_hab) de las filas de df que se
+    codifican (IdApoderado no vacío), calculando sus campos.
+    """
+    mascara = mascara_apoderado(df).to_numpy(dtype=bool)
+    registros = df[mascara]
+    todos = np.ones(len(registros), dtype=bool)
+    plan = compilar_plan_origen(df.columns)
+    valores = calcular_campos_hab(registros, None, todos, plan)
+    return validar_campos_hab(registros, valores, np.flatnonzero(mascara), primera_fila, todos, plan)
+
+
+# ==================== ARCHIVO DE AUDITORÍA ====================
+
+# Columnas del archivo de auditoría: fila de origen, apoderado y de dónde se
+# tomaron los datos, y luego las fuentes de LAYOUT_HAB en el orden del registro
+COLUMNAS_AUDITORIA = ['fila_excel', 'IdApoderado', 'origen'] + list(
+    dict.fromkeys(campo.fuente for campo in CAMPOS_VARIABLES_HAB)
+)
+
+
+def tabla_auditoria(df, filas, valores, escritos, primera_fila=0, tiene_apoderado=None):
+    """
+    Campos derivados de los registros escritos en el .HAB (ver
+    calcular_campos_hab), antes del relleno a ancho fijo: apellidos y
+    nombres separados, característica y número de teléfono, sexo, etc.
+    
+    Args:
+        df: DataFrame (o bloque) con los datos del Excel
+        filas: Posiciones en df de los registros codificados
+        valores: Campos calculados de esos registros
+        escritos: Máscara de los registros que se escribieron (ver _controlar_enviados)
+        primera_fila: Filas anteriores a df (para el modo por bloques)
+        tiene_apoderado: Máscara de apoderado de los registros codificados,
+            o True si todos lo tienen (por defecto se calcula)
+    
+    Returns:
+        DataFrame con COLUMNAS_AUDITORIA, una fila por registro del .HAB
+    """
+    filas = filas[escritos]
+    if tiene_apoderado is None:
+        tiene_apoderado = mascara_apoderado(df).to_numpy(dtype=bool)[filas]
+    else:
+        tiene_apoderado = np.broadcast_to(np.asarray(tiene_apoderado, dtype=bool), len(escritos))[escritos]
+    datos = {
+        # +2: encabezado en la fila 1 y filas de Excel numeradas desde 1
+        'fila_excel': primera_fila + filas + 2,
+        'IdApoderado': _columna(df, 'IdApoderado').to_numpy(dtype=object)[filas],
+        'origen': np.where(tiene_apoderado, 'apoderado', 'beneficiario'),
+    }
+    for fuente in COLUMNAS_AUDITORIA[3:]:
+        valor = valores[fuente]
+        if isinstance(valor, pd.Series):
+            datos[fuente] = valor.to_numpy(dtype=object)[escritos]
+        else:
+            datos[fuente] = np.full(len(filas), valor, dtype=object)
+    return pd.DataFrame(datos, columns=COLUMNAS_AUDITORIA)
+
+
+class EscritorAuditoria:
+    """
+    Escribe el archivo de auditoría por partes (una por bloque) en el
+    formato elegido, sin acumular las filas en memoria:
+    
+    - parquet: un row group por bloque (pyarrow.parquet.ParquetWriter)
+    - csv: UTF-8 con BOM, como los demás reportes
+    - xlsx: openpyxl en modo write_only
+    
+    Se usa como context manager:
+        with EscritorAuditoria('auditoria_x.parquet', 'parquet') as auditoria:
+            auditoria.agregar(tabla_auditoria(...))
+    """
+    
+    def __init__(self, path, formato, retomar=None):
+        """retomar: (bytes, filas) de un CSV parcial a continuar (ver PuntoDeControl)."""
+        if formato not in FORMATOS_AUDITORIA or formato == 'no':
+            raise ValueError(f"Formato de auditoría no válido: {formato}")
+        if retomar is not None and formato != 'csv':
+            raise ValueError(f"La auditoría en {formato} no se puede retomar")
+        self.path = path
+        self.formato = formato
+        self.filas = 0
+        self._escritor = None
+        self._archivo = None
+        if retomar is not None:
+            bytes_confirmados, self.filas = retomar
+            os.truncate(path, bytes_confirmados)
+            # utf-8 sin BOM: el BOM ya está al principio del archivo
+            self._archivo = open(path, 'a', encoding='utf-8', newline='')
+        elif formato == 'csv':
+            self._archivo = open(path, 'w', encoding='utf-8-sig', newline='')
+            self._archivo.write(','.join(COLUMNAS_AUDITORIA) + '\n')
+        elif formato == 'xlsx':
+            from openpyxl import Workbook
+            
+            self._escritor = Workbook(write_only=True)
+            self._hoja = self._escritor.create_sheet('auditoria')
+            self._hoja.append(COLUMNAS_AUDITORIA)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            
+            self._esquema = pa.schema([
+                (columna, pa.int64() if columna == 'fila_excel' else pa.string())
+                for columna in COLUMNAS_AUDITORIA
+            ])
+            self._escritor = pq.ParquetWriter(path, self._esquema)
+    
+    def agregar(self, tabla):
+        """Agrega las filas de un DataFrame de tabla_auditoria."""
+        if self.formato == 'csv':
+            tabla.to_csv(self._archivo, header=False, index=False)
+        elif self.formato == 'xlsx':
+            for fila in tabla.itertuples(index=False, name=None):
+                self._hoja.append([None if pd.isna(valor) else valor for valor in fila])
+        else:
+            import pyarrow as pa
+            
+            self._escritor.write_table(pa.Table.from_pandas(tabla, schema=self._esquema, preserve_index=False))
+        self.filas += len(tabla)
+    
+    def confirmar(self):
+        """
+        Confirma en disco lo escrito hasta ahora y devuelve el tamaño del
+        archivo en bytes (solo CSV; None en los otros formatos).
+        """
+        if self._archivo is None:
+            return None
+        _confirmar_archivo(self._archivo)
+        return os.fstat(self._archivo.fileno()).st_size
+    
+    def close(self):
+        if self._archivo is not None:
+            self._archivo.close()
+        elif self.formato == 'xlsx':
+            self._escritor.save(self.path)
+        else:
+            self._escritor.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _ruta_auditoria(directorio_salida, base_salida, formato):
+    return os.path.join(directorio_salida, f"auditoria_{base_salida}.{formato}")
+
+
+def _abrir_auditoria(formato, directorio_salida, base_salida, punto_control=None):
+    """
+    EscritorAuditoria de auditoria_<archivo> según formato (None si es
+    'no'). Con un PuntoDeControl con progreso, continúa el CSV parcial.
+    """
+    formato = formato or FORMATO_AUDITORIA
+    if formato == 'no':
+        return None
+    retomar = None
+    if punto_control is not None and punto_control.filas:
+        retomar = (punto_control.bytes_auditoria, punto_control.lineas_generadas)
+    return EscritorAuditoria(_ruta_auditoria(directorio_salida, base_salida, formato), formato, retomar)
+
+
+# ==================== LECTURA POR BLOQUES ====================
+
+def _nombres_columnas(encabezado):
+    """
+    Nombres de columnas a partir de la fila de encabezado, con las mismas
+    reglas que pd.read_excel (Unnamed: i, duplicados .1, .2...) y sin
+    espacios al inicio/final.
+    """
+    celdas = list(encabezado)
+    while celdas and celdas[-1] is None:
+        celdas.pop()
+    
+    nombres = []
+    vistos = {}
+    for i, celda in enumerate(celdas):
+        nombre = f'Unnamed: {i}' if celda is None else str(celda)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f'{nombre}.{vistos[nombre]}'
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre.strip())
+    return nombres
+
+
+def _celda_a_texto(valor):
+    """Convierte una celda de openpyxl a texto como lo hace pd.read_excel(dtype=str)."""
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    if isinstance(valor, datetime):
+        return str(pd.Timestamp(valor))
+    return str(valor)
+
+
+def leer_excel_por_bloques(excel_path, tamano_bloque=None, columnas=None):
+    """
+    Lee la primera hoja de un .xlsx en bloques de filas usando openpyxl en
+    modo read_only, sin cargar el libro completo en memoria.
+    
+    Args:
+        excel_path: Ruta (o archivo abierto) del .xlsx
+        tamano_bloque: Cantidad máxima de filas por bloque
+        columnas: Columnas a leer (por defecto, todas las del encabezado)
+    
+    Yields:
+        DataFrames con las columnas del encabezado (valores texto o None);
+        si la hoja no tiene filas de datos, un único DataFrame vacío
+    """
+    tamano_bloque = tamano_bloque or TAMANO_BLOQUE
+    from openpyxl import load_workbook
+    
+    libro = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        
+        nombres = _nombres_columnas(encabezado)
+        ancho = len(nombres)
+        # Solo se convierten a texto las celdas de las columnas pedidas
+        posiciones = [i for i, nombre in enumerate(nombres) if columnas is None or nombre in columnas]
+        columnas = [nombres[i] for i in posiciones]
+        bloque = []
+        filas_vacias = 0
+        bloques_emitidos = 0
+        
+        for fila in filas:
+            fila = fila[:ancho]
+            
+            # Las filas vacías al final de la hoja se descartan (como pd.read_excel);
+            # las intermedias se conservan. Se mira la fila completa, no solo
+            # las columnas pedidas
+            if all(valor is None for valor in fila):
+                filas_vacias += 1
+                continue
+            if filas_vacias:
+                bloque.extend([None] * len(columnas) for _ in range(filas_vacias))
+                filas_vacias = 0
+            
+            valores = [_celda_a_texto(fila[i]) if i < len(fila) else None for i in posiciones]
+            bloque.append(valores)
+            if len(bloque) >= tamano_bloque:
+                yield pd.DataFrame(bloque, columns=columnas, dtype=object)
+                bloques_emitidos += 1
+                bloque = []
+        
+        # Siempre se emite al menos un bloque (aunque esté vacío) para informar las columnas
+        if bloque or bloques_emitidos == 0:
+            yield pd.DataFrame(bloque, columns=columnas, dtype=object)
+    finally:
+        libro.close()
+
+
+# ==================== LECTURA CSV Y PARQUET ====================
+
+# Valores que pd.read_excel / pd.read_csv interpretan como vacíos por defecto
+VALORES_NULOS = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+# Bytes del inicio de un CSV que se miran para detectar separador y encoding
+_TAMANO_MUESTRA_CSV = 64 * 1024
+
+
+def _extension(origen, nombre=None):
+    """Extensión en minúsculas de una ruta o de un archivo subido (por su nombre)."""
+    nombre = nombre or getattr(origen, 'name', None) or str(origen)
+    return os.path.splitext(nombre)[1].lower()
+
+
+def _detectar_formato_csv(origen):
+    """
+    Mira el inicio del CSV y devuelve (nombres de columnas, separador,
+    encoding). El separador es el más frecuente del encabezado entre
+    , ; tab y |; si el inicio no es UTF-8 válido se usa latin-1 (las
+    exportaciones de Excel en Windows).
+    """
+    if hasattr(origen, 'read'):
+        origen.seek(0)
+        muestra = origen.read(_TAMANO_MUESTRA_CSV)
+        origen.seek(0)
+    else:
+        with open(origen, 'rb') as f:
+            muestra = f.read(_TAMANO_MUESTRA_CSV)
+    
+    try:
+        texto = codecs.getincrementaldecoder('utf-8-sig')().decode(muestra, final=False)
+        encoding = 'utf-8'
+    except UnicodeDecodeError:
+        texto = muestra.decode('latin-1')
+        encoding = 'latin-1'
+    
+    primera_linea = texto.splitlines()[0] if texto else ''
+    separador = max(',;\t|', key=primera_linea.count)
+    encabezado = next(csv.reader([primera_linea], delimiter=separador), [])
+    
+    # Mismos nombres que pd.read_csv: Unnamed: i para vacíos, .1 para duplicados
+    nombres = _nombres_columnas([celda if celda.strip() else None for celda in encabezado])
+    nombres.extend(f'Unnamed: {i}' for i in range(len(nombres), len(encabezado)))
+    return nombres, separador, encoding
+
+
+def _opciones_csv(origen, columnas, encoding=None):
+    """
+    Opciones de pyarrow.csv para leer solo `columnas` (todas si es None),
+    como texto. encoding reemplaza al detectado en el inicio del archivo.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    
+    nombres, separador, encoding_detectado = _detectar_formato_csv(origen)
+    encoding = encoding or encoding_detectado
+    incluidas = [nombre for nombre in nombres if columnas is None or nombre in columnas]
+    return (
+        pacsv.ReadOptions(column_names=nombres, skip_rows=1, encoding=encoding),
+        pacsv.ParseOptions(delimiter=separador),
+        pacsv.ConvertOptions(
+            include_columns=incluidas,
+            # Todo como texto: DNI y CUIL conservan los ceros a la izquierda
+            column_types={nombre: pa.string() for nombre in incluidas},
+            null_values=VALORES_NULOS,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def _es_error_utf8(error):
+    """True si pyarrow falló por texto que no es UTF-8 válido."""
+    return 'utf8' in str(error).lower()
+
+
+def _bloques_csv(origen, tamano_bloque, opciones):
+    """DataFrames de tamano_bloque filas leídos con el lector incremental de pyarrow."""
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    
+    lector = pacsv.open_csv(origen, *opciones)
+    nombres = lector.schema.names
+    lotes = []
+    filas = 0
+    bloques_emitidos = 0
+    for lote in lector:
+        lotes.append(lote)
+        filas += lote.num_rows
+        # Los lotes de pyarrow se miden en bytes: se reagrupan en bloques de filas
+        while filas >= tamano_bloque:
+            tabla = pa.Table.from_batches(lotes, schema=lector.schema)
+            yield _tabla_a_texto(tabla.slice(0, tamano_bloque), nombres)
+            bloques_emitidos += 1
+            resto = tabla.slice(tamano_bloque)
+            lotes = resto.to_batches()
+            filas = resto.num_rows
+    if filas or bloques_emitidos == 0:
+        yield _tabla_a_texto(pa.Table.from_batches(lotes, schema=lector.schema), nombres)
+
+
+def _columnas_parquet(archivo, columnas):
+    """Columnas del Parquet a leer (nombres originales) y sus nombres sin espacios."""
+    nombres = archivo.schema_arrow.names
+    incluidas = [nombre for nombre in nombres if columnas is None or nombre.strip() in columnas]
+    return incluidas, [nombre.strip() for nombre in incluidas]
+
+
+def _tabla_a_texto(tabla, nombres):
+    """
+    Convierte una tabla de pyarrow en DataFrame con valores texto o None,
+    como pd.read_excel(dtype=str): los números enteros sin '.0' y las fechas
+    como Timestamp.
+    """
+    df = tabla.to_pandas()
+    df.columns = nombres
+    for nombre in df.columns:
+        serie = df[nombre]
+        if not pd.api.types.is_string_dtype(serie):
+            df[nombre] = serie.astype(object).map(lambda valor: None if pd.isna(valor) else _celda_a_texto(valor))
+    return df
+
+
+def _como_categorias(df):
+    """
+    Pasa a categoría las COLUMNAS_CATEGORICAS de df: cada localidad, barrio,
+    sucursal, etc. se guarda una vez y las filas solo llevan un código.
+    """
+    for posicion, nombre in enumerate(df.columns):
+        if nombre in COLUMNAS_CATEGORICAS:
+            df.isetitem(posicion, df.iloc[:, posicion].astype('category'))
+    return df
+
+
+def leer_archivo_entrada(origen, nombre=None, columnas=None):
+    """
+    Lee un archivo de entrada completo (.xlsx, .csv o .parquet) con todos
+    los valores como texto y los nombres de columnas sin espacios.
+    
+    Solo se leen las columnas que usa el procesamiento (COLUMNAS_ENTRADA);
+    los CSV y Parquet se leen con pyarrow, lo que evita el costo de
+    openpyxl. Las columnas con pocos valores distintos quedan como
+    categorías (ver COLUMNAS_CATEGORICAS).
+    
+    Args:
+        origen: Ruta o archivo abierto (p. ej. un archivo subido en la app)
+        nombre: Nombre del archivo, para reconocer el formato si origen no es una ruta
+        columnas: Columnas a leer (por defecto COLUMNAS_ENTRADA)
+    """
+    extension = _extension(origen, nombre)
+    columnas = COLUMNAS_ENTRADA if columnas is None else columnas
+    
+    if extension == '.csv':
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        
+        try:
+            tabla = pacsv.read_csv(origen, *_opciones_csv(origen, columnas))
+        except pa.ArrowInvalid as e:
+            # El inicio era UTF-8 válido pero más adelante no: reintentar en latin-1
+            if not _es_error_utf8(e):
+                raise
+            tabla = pacsv.read_csv(origen, *_opciones_csv(origen, columnas, encoding='latin-1'))
+        return _como_categorias(_tabla_a_texto(tabla, tabla.column_names))
+    
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+        
+        archivo = pq.ParquetFile(origen)
+        incluidas, nombres = _columnas_parquet(archivo, columnas)
+        return _como_categorias(_tabla_a_texto(archivo.read(columns=incluidas), nombres))
+    
+    # Las columnas que no se usan se descartan al leer, antes de armar el DataFrame
+    columnas = set(columnas)
+    df = pd.read_excel(origen, dtype=str, usecols=lambda nombre: str(nombre).strip() in columnas)
+    
+    # Limpiar nombres de columnas (quitar espacios al inicio/final)
+    df.columns = df.columns.str.strip()
+    return _como_categorias(df)
+
+
+def leer_por_bloques(origen, tamano_bloque=None, columnas=None):
+    """
+    Versión por bloques de leer_archivo_entrada (ver leer_excel_por_bloques):
+    para CSV y Parquet los bloques salen del lector incremental de pyarrow.
+    
+    Yields:
+        DataFrames de hasta tamano_bloque filas; al menos uno (aunque esté
+        vacío) para informar las columnas
+    """
+    tamano_bloque = tamano_bloque or TAMANO_BLOQUE
+    extension = _extension(origen)
+    columnas = COLUMNAS_ENTRADA if columnas is None else columnas
+    
+    if extension == '.csv':
+        import pyarrow as pa
+        
+        bloques_emitidos = 0
+        try:
+            for bloque in _bloques_csv(origen, tamano_bloque, _opciones_csv(origen, columnas)):
+                yield bloque
+                bloques_emitidos += 1
+        except pa.ArrowInvalid as e:
+            # Texto no UTF-8 antes del primer bloque: se relee en latin-1. Si
+            # aparece más adelante ya no se puede volver atrás.
+            if bloques_emitidos or not _es_error_utf8(e):
+                raise
+            yield from _bloques_csv(origen, tamano_bloque, _opciones_csv(origen, columnas, encoding='latin-1'))
+        return
+    
+    if extension == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        archivo = pq.ParquetFile(origen)
+        incluidas, nombres = _columnas_parquet(archivo, columnas)
+        bloques_emitidos = 0
+        for lote in archivo.iter_batches(batch_size=tamano_bloque, columns=incluidas):
+            yield _tabla_a_texto(pa.Table.from_batches([lote]), nombres)
+            bloques_emitidos += 1
+        if bloques_emitidos == 0:
+            yield _tabla_a_texto(archivo.schema_arrow.empty_table().select(incluidas), nombres)
+        return
+    
+    yield from leer_excel_por_bloques(origen, tamano_bloque, columnas)
+
+
+def _tiene_columnas_minimas(columnas):
+    """
+    Valida columnas mínimas requeridas: campos de apoderado o de beneficiario.
+    Informa por consola si faltan.
+    """
+    tiene_columnas_apoderado = all(col in columnas for col in ['IdApoderado', 'APO_SEXO'])
+    tiene_columnas_beneficiario = all(col in columnas for col in ['NUMERO_DOCUMENTO', 'SEXO'])
+    
+    if not tiene_columnas_apoderado and not tiene_columnas_beneficiario:
+        print(f"   ❌ Error: El archivo debe contener campos de beneficiario o apoderado")
+        print(f"   💡 Campos mínimos beneficiario: SEXO, NUMERO_DOCUMENTO, APELLIDO, NOMBRE, CUIL")
+        print(f"   💡 Campos mínimos apoderado: APO_SEXO, IdApoderado, APO_APELLIDO, APO_NOMBRE, APO_CUIL")
+        return False
+    return True
+
+
+# ==================== MANIFIESTO DE ARCHIVOS PROCESADOS ====================
+
+# Se incrementa el número cuando cambian las reglas de procesamiento, para
+# que los archivos ya procesados se vuelvan a generar; el hash cubre los
+# cambios del diseño de registro
+VERSION_LAYOUT_HAB = '3-' + hashlib.sha1(repr(_DISENO_HAB).encode('utf-8')).hexdigest()[:8]
+
+MANIFIESTO_PROCESADOS = 'manifiesto_procesados.json'
+
+
+def calcular_hash_archivo(path, tamano_lectura=1024 * 1024):
+    """SHA-256 del contenido de un archivo, leído por partes."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for parte in iter(lambda: f.read(tamano_lectura), b''):
+            sha.update(parte)
+    return sha.hexdigest()
+
+
+def _clave_manifiesto(hash_contenido):
+    return f"{hash_contenido}:{VERSION_LAYOUT_HAB}"
+
+
+def _clave_procesado(excel_path, control_enviados=None, auditoria=None, division=None):
+    """
+    Clave de un archivo en el manifiesto de procesados: contenido y
+    VERSION_LAYOUT_HAB, nombre de la salida y las opciones que cambian las
+    salidas (control de enviados, auditoría y división). Con otra opción, o
+    el mismo contenido con otro nombre, el archivo se vuelve a procesar.
+    """
+    opciones = (
+        os.path.splitext(os.path.basename(excel_path))[0],
+        control_enviados or CONTROL_ENVIADOS,
+        auditoria or FORMATO_AUDITORIA,
+        division or DIVISION_HAB or 'no',
+    )
+    return '|'.join((_clave_manifiesto(calcular_hash_archivo(excel_path)),) + opciones)
+
+
+def cargar_manifiesto(directorio_salida):
+    """Carga el manifiesto de archivos procesados ({} si no existe o está dañado)."""
+    path = os.path.join(directorio_salida, MANIFIESTO_PROCESADOS)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️  No se pudo leer el manifiesto {path}, se ignora: {e}")
+        return {}
+
+
+def guardar_manifiesto(directorio_salida, manifiesto):
+    """Guarda el manifiesto de forma atómica (archivo temporal + reemplazo)."""
+    path = os.path.join(directorio_salida, MANIFIESTO_PROCESADOS)
+    temporal = path + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, path)
+
+
+def entrada_manifiesto(resultado):
+    """Entrada del manifiesto para un archivo procesado sin error."""
+    return {
+        'archivo': resultado['archivo'],
+        'hab_path': resultado['hab_path'],
+        'particiones_path': resultado['particiones_path'],
+        'auditoria_path': resultado['auditoria_path'],
+        'lineas_generadas': resultado['lineas_generadas'],
+        'lineas_saltadas': resultado['lineas_saltadas'],
+        'procesado': datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def resultado_desde_manifiesto(manifiesto, clave, excel_path):
+    """
+    Resultado (desde_cache=True) de un archivo que ya figura en el
+    manifiesto con sus salidas en disco; None si hay que procesarlo.
+    """
+    entrada = manifiesto.get(clave)
+    salida = entrada and (entrada.get('particiones_path') or entrada['hab_path'])
+    if not salida or not os.path.exists(salida):
+        return None
+    
+    print(f"♻️  Sin cambios, se omite: {os.path.basename(excel_path)} → {salida}")
+    resultado = _nuevo_resultado(excel_path)
+    resultado.update(
+        hab_path=entrada['hab_path'],
+        particiones_path=entrada.get('particiones_path'),
+        auditoria_path=entrada.get('auditoria_path'),
+        lineas_generadas=entrada['lineas_generadas'],
+        lineas_saltadas=entrada['lineas_saltadas'],
+        desde_cache=True,
+    )
+    return resultado
+
+
+# ==================== ESCRITURA SEGURA Y PUNTOS DE CONTROL ====================
+
+# El .HAB se escribe como <archivo>.HAB.parcial y recién completo se renombra;
+# al lado queda <archivo>.HAB.ok con registros, bytes y SHA-256 (ver lector_hab.py)
+SUFIJO_PARCIAL = '.parcial'
+SUFIJO_CONTROL_HAB = '.ok'
+
+
+def _fsync_directorio(directorio):
+    """Persiste en disco un renombrado dentro de directorio (no disponible en Windows)."""
+    try:
+        descriptor = os.open(directorio or '.', os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def _guardar_json_atomico(path, datos):
+    """Escribe datos como JSON en path sin dejar nunca un archivo a medio escribir."""
+    temporal = path + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, path)
+
+
+def _borrar_si_existe(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _confirmar_archivo(f):
+    """Vacía los buffers de f y espera a que el sistema operativo lo escriba en disco."""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def finalizar_archivo_hab(parcial, output_path, registros, sha256):
+    """
+    Renombra el .HAB parcial (ya confirmado en disco) a output_path y
+    escribe el archivo de control <archivo>.HAB.ok. Un .HAB sin su archivo
+    de control, o que no coincide con él, está incompleto.
+    """
+    os.replace(parcial, output_path)
+    _fsync_directorio(os.path.dirname(output_path))
+    _guardar_json_atomico(output_path + SUFIJO_CONTROL_HAB, {
+        'archivo': os.path.basename(output_path),
+        'registros': registros,
+        'bytes': os.path.getsize(output_path),
+        'sha256': sha256,
+        'version_layout': VERSION_LAYOUT_HAB,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+    })
+
+
+class PuntoDeControl:
+    """
+    Progreso confirmado de un .HAB que se genera por bloques, guardado en
+    checkpoint_<entrada>.json en la carpeta de salida.
+    
+    Cada INTERVALO_PUNTO_CONTROL filas se confirma en disco el .HAB parcial
+    (y la auditoría CSV) y se guardan las filas de la entrada ya
+    procesadas y los bytes escritos. Si el proceso se corta, la próxima
+    ejecución sobre la misma entrada (mismo contenido y diseño de registro)
+    trunca el parcial a esos bytes y sigue desde esa fila, con el mismo
+    nombre de salida y la misma FECHA ALTA.
+    
+    La auditoría en parquet o xlsx no se puede retomar (el archivo recién
+    es legible al cerrarlo): con esos formatos no se usan puntos de control.
+    """
+    
+    def __init__(self, path, clave, base_salida, fecha_alta, formato_auditoria):
+        self.path = path
+        self.clave = clave
+        self.base_salida = base_salida
+        self.fecha_alta = fecha_alta
+        self.formato_auditoria = formato_auditoria
+        self.filas = 0
+        self.bytes = 0
+        self.lineas_generadas = 0
+        self.lineas_saltadas = 0
+        self.bytes_auditoria = None
+        # Si hay un checkpoint en disco que apunta al parcial
+        self.guardado = False
+    
+    @classmethod
+    def cargar(cls, path, clave, formato_auditoria, directorio_salida):
+        """
+        Punto de control guardado para esta entrada, o None si no hay uno
+        que se pueda retomar: otro contenido o diseño (clave), otro formato
+        de auditoría, o salidas parciales que faltan o son más cortas.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            if datos.get('clave') != clave or datos.get('formato_auditoria') != formato_auditoria:
+                return None
+            punto = cls(path, clave, datos['base_salida'], datos['fecha_alta'], formato_auditoria)
+            for atributo in ('filas', 'bytes', 'lineas_generadas', 'lineas_saltadas', 'bytes_auditoria'):
+                setattr(punto, atributo, datos[atributo])
+            
+            parcial = os.path.join(directorio_salida, f"{punto.base_salida}.HAB{SUFIJO_PARCIAL}")
+            if os.path.getsize(parcial) < punto.bytes:
+                return None
+            if formato_auditoria != 'no':
+                auditoria_path = _ruta_auditoria(directorio_salida, punto.base_salida, formato_auditoria)
+                if os.path.getsize(auditoria_path) < (punto.bytes_auditoria or 0):
+                    return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        punto.guardado = True
+        return punto
+    
+    def guardar(self):
+        _guardar_json_atomico(self.path, {
+            'clave': self.clave,
+            'base_salida': self.base_salida,
+            'fecha_alta': self.fecha_alta,
+            'formato_auditoria': self.formato_auditoria,
+            'filas': self.filas,
+            'bytes': self.bytes,
+            'lineas_generadas': self.lineas_generadas,
+            'lineas_saltadas': self.lineas_saltadas,
+            'bytes_auditoria': self.bytes_auditoria,
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+        })
+        self.guardado = True
+    
+    def borrar(self):
+        _borrar_si_existe(self.path)
+
+
+def _ruta_punto_control(directorio_salida, excel_path):
+    return os.path.join(directorio_salida, f"checkpoint_{os.path.splitext(os.path.basename(excel_path))[0]}.json")
+
+
+def _hash_prefijo(path, tamano, tamano_lectura=1024 * 1024):
+    """SHA-256 (objeto hashlib, para seguir actualizándolo) de los primeros `tamano` bytes de path."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while tamano > 0:
+            datos = f.read(min(tamano_lectura, tamano))
+            if not datos:
+                break
+            sha256.update(datos)
+            tamano -= len(datos)
+    return sha256
+
+
+# ==================== MÉTRICAS DE EJECUCIÓN ====================
+
+# Etapas medidas, en el orden del proceso. 'lectura' y 'revision' recorren
+# todas las filas del Excel; el resto, solo los registros .HAB.
+ETAPAS_PROCESO = (
+    'lectura', 'revision', 'mapeo', 'validacion', 'codificacion', 'registro', 'escritura_hab', 'division',
+    'auditoria',
+)
+
+
+def nuevas_metricas():
+    """Dict vacío de métricas: segundos y pico de RSS (MB) por etapa."""
+    return {'tiempos': {}, 'memoria_mb': {}}
+
+
+def pico_memoria_mb():
+    """
+    Pico de memoria residente (RSS) del proceso actual en MB, o None si no
+    se puede obtener en esta plataforma. Es el máximo desde que arrancó el
+    proceso: medido al final de cada etapa, muestra cuál lo hizo subir.
+    """
+    try:
+        import resource
+    except ImportError:
+        return _pico_memoria_windows_mb()
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB; macOS, bytes
+    return pico / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _pico_memoria_windows_mb():
+    """PeakWorkingSetSize del proceso actual vía psapi (None si no está disponible)."""
+    try:
+        import ctypes
+        from ctypes import wintypes
+        
+        class ContadoresMemoria(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+        
+        contadores = ContadoresMemoria()
+        contadores.cb = ctypes.sizeof(contadores)
+        proceso = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(proceso, ctypes.byref(contadores), contadores.cb):
+            return None
+        return contadores.PeakWorkingSetSize / (1024 * 1024)
+    except (ImportError, AttributeError, OSError):
+        return None
+
+
+@contextmanager
+def medir_etapa(metricas, etapa):
+    """
+    Suma a metricas['tiempos'][etapa] los segundos transcurridos dentro del
+    bloque (se acumulan si la etapa se repite, p. ej. un bloque por vez en
+    modo streaming) y registra el pico de RSS al terminar. Con
+    metricas=None no mide nada.
+    """
+    if metricas is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tiempos = metricas['tiempos']
+        tiempos[etapa] = tiempos.get(etapa, 0.0) + time.perf_counter() - inicio
+        metricas['memoria_mb'][etapa] = pico_memoria_mb()
+
+
+_FIN_ITERACION = object()
+
+
+def _medir_iterador(iterable, metricas, etapa):
+    """Recorre iterable midiendo en la etapa solo el tiempo de obtener cada elemento."""
+    iterador = iter(iterable)
+    while True:
+        with medir_etapa(metricas, etapa):
+            elemento = next(iterador, _FIN_ITERACION)
+        if elemento is _FIN_ITERACION:
+            return
+        yield elemento
+
+
+@contextmanager
+def _perfilando(perfil):
+    """Activa el cProfile.Profile perfil dentro del bloque (sin efecto si es None)."""
+    if perfil is None:
+        yield
+        return
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+
+
+# ==================== ETAPAS EN SEGUNDO PLANO ====================
+
+def leer_en_segundo_plano(iterable, maximo=MAX_BLOQUES_EN_COLA):
+    """
+    Recorre iterable en un hilo aparte, adelantándose como máximo `maximo`
+    elementos al consumidor: si la codificación va más lenta que la
+    lectura, el hilo espera (contrapresión) y la memoria queda acotada.
+    
+    Una excepción del iterable se lanza en el consumidor al llegar a ese
+    elemento. Si el consumidor deja de iterar, no se piden más elementos.
+    """
+    iterador = iter(iterable)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='lectura') as hilo:
+        # Un solo hilo: los next() se ejecutan en orden, uno por vez
+        pendientes = deque(hilo.submit(next, iterador, _FIN_ITERACION) for _ in range(maximo))
+        try:
+            while True:
+                elemento = pendientes.popleft().result()
+                if elemento is _FIN_ITERACION:
+                    return
+                pendientes.append(hilo.submit(next, iterador, _FIN_ITERACION))
+                yield elemento
+        finally:
+            for futuro in pendientes:
+                futuro.cancel()
+
+
+class EtapaEnSegundoPlano:
+    """
+    Hilo que ejecuta en orden las tareas que se le encargan (p. ej. las
+    escrituras de cada bloque), con como máximo `maximo` tareas pendientes:
+    encargar() espera a la más vieja si la cola está llena (contrapresión).
+    
+    Si una tarea falla, las siguientes no se ejecutan y la excepción se
+    lanza en el hilo que encarga, en el próximo encargar() o en esperar().
+    Se usa como context manager; al salir por un error se descartan las
+    tareas pendientes.
+    """
+    
+    def __init__(self, maximo=MAX_BLOQUES_EN_COLA):
+        self.maximo = maximo
+        self._hilo = ThreadPoolExecutor(max_workers=1, thread_name_prefix='escritura')
+        self._pendientes = deque()
+        self._error = None
+    
+    def _ejecutar(self, tarea, args):
+        if self._error is not None:
+            return
+        try:
+            tarea(*args)
+        except BaseException as e:
+            self._error = e
+            raise
+    
+    def encargar(self, tarea, *args):
+        while len(self._pendientes) >= self.maximo:
+            self._pendientes.popleft().result()
+        if self._error is not None:
+            raise self._error
+        self._pendientes.append(self._hilo.submit(self._ejecutar, tarea, args))
+    
+    def esperar(self):
+        """Espera a que terminen las tareas encargadas (lanza la primera excepción)."""
+        while self._pendientes:
+            self._pendientes.popleft().result()
+    
+    def close(self):
+        for futuro in self._pendientes:
+            futuro.cancel()
+        self._pendientes.clear()
+        self._hilo.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, tipo, *exc):
+        try:
+            if tipo is None:
+                self.esperar()
+        finally:
+            self.close()
+
+
+def metricas_etapas(metricas, filas_leidas, registros):
+    """
+    Tabla de métricas por etapa (lista de dicts, en el orden de
+    ETAPAS_PROCESO): segundos, filas procesadas, filas por segundo y pico
+    de RSS del proceso al terminar la etapa.
+    
+    Args:
+        metricas: Dict de nuevas_metricas() (o un resultado de procesar_archivo_excel)
+        filas_leidas: Filas del Excel
+        registros: Registros .HAB generados
+    """
+    tabla = []
+    for etapa in ETAPAS_PROCESO:
+        if etapa not in metricas['tiempos']:
+            continue
+        segundos = metricas['tiempos'][etapa]
+        filas = filas_leidas if etapa in ('lectura', 'revision') else registros
+        tabla.append({
+            'etapa': etapa,
+            'segundos': round(segundos, 4),
+            'filas': filas,
+            'filas_por_segundo': round(filas / segundos) if segundos > 0 else None,
+            'pico_rss_mb': metricas['memoria_mb'].get(etapa),
+        })
+    return tabla
+
+
+def generar_reporte_ejecucion(resultado, modo):
+    """Reporte de ejecución de un archivo (serializable a JSON) a partir de su resultado."""
+    reporte = {
+        'archivo': resultado['archivo'],
+        'modo': modo,
+        'version_layout': VERSION_LAYOUT_HAB,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'error': resultado['error'],
+        'filas_leidas': resultado['filas_leidas'],
+        'lineas_generadas': resultado['lineas_generadas'],
+        'lineas_saltadas': resultado['lineas_saltadas'],
+        'valores_no_latin1': resultado['valores_no_latin1'],
+        'errores_validacion': resultado['errores_validacion'],
+        'lineas_repetidas': resultado['lineas_repetidas'],
+        'hab_path': resultado['hab_path'],
+        'particiones_path': resultado['particiones_path'],
+        'auditoria_path': resultado['auditoria_path'],
+        'caracteres_path': resultado['caracteres_path'],
+        'validacion_path': resultado['validacion_path'],
+        'repetidos_path': resultado['repetidos_path'],
+        'perfil_path': resultado['perfil_path'],
+        'total_segundos': resultado['tiempos'].get('total'),
+        'pico_rss_mb': pico_memoria_mb(),
+        'etapas': metricas_etapas(resultado, resultado['filas_leidas'], resultado['lineas_generadas']),
+    }
+    return reporte
+
+
+def _cerrar_ejecucion(resultado, modo, directorio_salida, base_salida, perfil):
+    """
+    Guarda, junto a las salidas, el reporte JSON de la ejecución y, si se
+    perfiló, las estadísticas de cProfile (.prof, ver con python -m pstats).
+    """
+    try:
+        if perfil is not None:
+            perfil_path = os.path.join(directorio_salida, f"perfil_{base_salida}.prof")
+            perfil.dump_stats(perfil_path)
+            resultado['perfil_path'] = perfil_path
+            print(f"   🔬 Perfil de codificación guardado: {perfil_path}")
+        
+        reporte_path = os.path.join(directorio_salida, f"reporte_{base_salida}.json")
+        with open(reporte_path, 'w', encoding='utf-8') as f:
+            json.dump(generar_reporte_ejecucion(resultado, modo), f, ensure_ascii=False, indent=2)
+        resultado['reporte_path'] = reporte_path
+    except OSError as e:
+        print(f"   ⚠️  No se pudo guardar el reporte de ejecución: {e}")
+
+
+# ==================== PROCESAMIENTO PRINCIPAL ====================
+
+def _nuevo_resultado(excel_path):
+    """Resultado estructurado del procesamiento de un archivo (ver procesar_archivo_excel)."""
+    return {
+        'archivo': os.path.basename(excel_path),
+        'hab_path': None,
+        'particiones_path': None,
+        'auditoria_path': None,
+        'reporte_path': None,
+        'caracteres_path': None,
+        'validacion_path': None,
+        'repetidos_path': None,
+        'perfil_path': None,
+        'filas_leidas': 0,
+        'lineas_generadas': 0,
+        'lineas_saltadas': 0,
+        'valores_no_latin1': 0,
+        'errores_validacion': 0,
+        'lineas_repetidas': 0,
+        **nuevas_metricas(),
+        'error': None,
+        'desde_cache': False,
+    }
+
+
+def procesar_archivo_excel(excel_path, streaming=None, tamano_bloque=None, directorio_salida=None, perfilar=False,
+                           control_enviados=None, auditoria=None, division=None, lectura=None):
+    """
+    Procesa un archivo Excel individual y genera el archivo .HAB
+    
+    Args:
+        excel_path: Ruta del archivo .xlsx (también acepta .csv y .parquet)
+        streaming: Si es True, lee y escribe por bloques de filas con memoria
+            acotada (por defecto MODO_STREAMING)
+        tamano_bloque: Filas por bloque en modo streaming (por defecto TAMANO_BLOQUE)
+        directorio_salida: Carpeta de salida (por defecto PROCESADOS_DIR)
+        perfilar: Si es True, perfila con cProfile el mapeo y la codificación
+            y guarda las estadísticas (.prof) junto a las salidas
+        control_enviados: 'marcar', 'omitir' o 'no' (por defecto
+            CONTROL_ENVIADOS): qué hacer con las personas que ya figuran en
+            el registro de enviados de la carpeta de salida
+        auditoria: Formato del archivo de auditoría con los campos derivados
+            de cada registro del .HAB: 'parquet', 'csv', 'xlsx' o 'no' (por
+            defecto FORMATO_AUDITORIA)
+        division: Dividir el .HAB en partes: 'sucursal', 'registros:N',
+            'bytes:N', 'sucursal:N' o 'no' (por defecto DIVISION_HAB; ver
+            dividir_hab.py)
+        lectura: Future con el DataFrame de excel_path ya leyéndose en otro
+            hilo (opcional, sin streaming; ver _ejecutar_en_serie). La etapa
+            'lectura' mide solo la espera
+    
+    Returns:
+        Dict con archivo, rutas generadas (incluido el reporte JSON de la
+        ejecución y, si se dividió el .HAB, el manifiesto de particiones), filas_leidas, lineas_generadas, lineas_saltadas,
+        lineas_repetidas (personas ya enviadas), tiempos
+        y memoria_mb (segundos y pico de RSS por etapa) y error (None si
+        terminó bien)
+    """
+    if streaming is None:
+        streaming = MODO_STREAMING
+    if streaming:
+        return _procesar_archivo_excel_streaming(
+            excel_path, tamano_bloque, directorio_salida, perfilar, control_enviados, auditoria, division
+        )
+    
+    directorio_salida = directorio_salida or PROCESADOS_DIR
+    resultado = _nuevo_resultado(excel_path)
+    tiempos = resultado['tiempos']
+    perfil = cProfile.Profile() if perfilar else None
+    registro = None
+    escritor_auditoria = None
+    inicio = time.perf_counter()
+    
+    filename = os.path.basename(excel_path)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base_salida = f"{os.path.splitext(filename)[0]}_{timestamp}"
+    print(f"\n🔄 Procesando archivo: {filename}")
+    
+    try:
+        with medir_etapa(resultado, 'lectura'):
+            # Leer archivo Excel (o CSV / Parquet)
+            df = lectura.result() if lectura is not None else leer_archivo_entrada(excel_path)
+        resultado['filas_leidas'] = len(df)
+        
+        print(f"   ✅ Archivo cargado con {len(df)} filas y {len(df.columns)} columnas.")
+        print(f"   📋 Columnas disponibles: {list(df.columns)}")
+        
+        # Validar columnas mínimas requeridas
+        if not _tiene_columnas_minimas(df.columns):
+            resultado['error'] = 'Faltan columnas mínimas de beneficiario o apoderado'
+            return resultado
+        _informar_columnas_faltantes(df.columns)
+        
+        # Contar registros con apoderado válido (IdApoderado no vacío)
+        registros_con_apoderado = 0
+        if 'IdApoderado' in df.columns:
+            registros_con_apoderado = int(mascara_apoderado(df).sum())
+            print(f"   📊 Registros con apoderado válido (IdApoderado): {registros_con_apoderado}")
+            print(f"   📊 Registros sin apoderado válido: {len(df) - registros_con_apoderado}")
+        
+        # Revisión previa: caracteres que no existen en latin-1
+        with medir_etapa(resultado, 'revision'):
+            problemas = revisar_caracteres_hab(df)
+        _informar_caracteres(problemas, resultado, directorio_salida, base_salida)
+        
+        # Generar archivo .HAB
+        print(f"   📝 Generando archivo .HAB...")
+        
+        hab_path = os.path.join(directorio_salida, f"{base_salida}.HAB")
+        
+        registro = _abrir_registro(control_enviados, directorio_salida)
+        escritor_auditoria = _abrir_auditoria(auditoria, directorio_salida, base_salida)
+        validacion = []
+        lineas_hab, lineas_saltadas = generar_archivo_hab(
+            df, hab_path, resultado, perfil, registro, escritor_auditoria, validacion
+        )
+        resultado.update(hab_path=hab_path, lineas_generadas=lineas_hab, lineas_saltadas=lineas_saltadas)
+        _informar_validacion(pd.concat(validacion, ignore_index=True), resultado, directorio_salida, base_salida)
+        _informar_repetidos(registro, resultado, directorio_salida, base_salida)
+        
+        print(f"   ✅ Archivo .HAB generado: {hab_path}")
+        print(f"   📊 Total de líneas creadas en archivo .HAB: {lineas_hab}")
+        if lineas_saltadas > 0:
+            print(f"   ⚠️  Registros saltados (IdApoderado vacío): {lineas_saltadas}")
+        
+        _dividir_hab(division, resultado, registro)
+        _cerrar_auditoria(escritor_auditoria, resultado)
+        escritor_auditoria = None
+        
+    except Exception as e:
+        resultado['error'] = str(e)
+        print(f"   ❌ Error procesando archivo {filename}: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    finally:
+        if registro is not None:
+            registro.close()
+        if escritor_auditoria is not None:
+            escritor_auditoria.close()
+        tiempos['total'] = time.perf_counter() - inicio
+        _cerrar_ejecucion(resultado, 'completo', directorio_salida, base_salida, perfil)
+    
+    return resultado
+
+
+def _procesar_archivo_excel_streaming(excel_path, tamano_bloque=None, directorio_salida=None, perfilar=False,
+                                      control_enviados=None, auditoria=None, division=None):
+    """
+    Igual que procesar_archivo_excel, pero leyendo el Excel por bloques y
+    escribiendo el .HAB y la auditoría a medida que se leen, para que la
+    memoria no dependa del tamaño del archivo.
+    
+    Lectura, codificación y escritura corren en hilos separados unidos por
+    colas de MAX_BLOQUES_EN_COLA bloques (ver leer_en_segundo_plano y
+    EtapaEnSegundoPlano): mientras se codifica un bloque se lee el
+    siguiente y se escribe el anterior. Los tiempos de las etapas se
+    solapan, así que su suma puede superar el total.
+    """
+    directorio_salida = directorio_salida or PROCESADOS_DIR
+    resultado = _nuevo_resultado(excel_path)
+    tiempos = resultado['tiempos']
+    perfil = cProfile.Profile() if perfilar else None
+    registro = None
+    escritor_auditoria = None
+    lector = None
+    bloques = None
+    inicio = time.perf_counter()
+    
+    filename = os.path.basename(excel_path)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base_salida = f"{os.path.splitext(filename)[0]}_{timestamp}"
+    print(f"\n🔄 Procesando archivo (streaming): {filename}")
+    
+    try:
+        # Solo se mide como lectura el tiempo de obtener cada bloque del Excel
+        lector = leer_por_bloques(excel_path, tamano_bloque)
+        bloques = leer_en_segundo_plano(_medir_iterador(lector, resultado, 'lectura'))
+        primer_bloque = next(bloques)
+        columnas = list(primer_bloque.columns)
+        
+        print(f"   ✅ Archivo abierto con {len(columnas)} columnas.")
+        print(f"   📋 Columnas disponibles: {columnas}")
+        
+        # Validar columnas mínimas requeridas
+        if not _tiene_columnas_minimas(columnas):
+            resultado['error'] = 'Faltan columnas mínimas de beneficiario o apoderado'
+            return resultado
+        _informar_columnas_faltantes(columnas)
+        
+        punto_control = _abrir_punto_control(excel_path, directorio_salida, auditoria, base_salida)
+        if punto_control is not None and punto_control.filas:
+            base_salida = punto_control.base_salida
+            print(f"   ⏯️  Se retoma {base_salida}.HAB desde la fila {punto_control.filas + 2} "
+                  f"({punto_control.lineas_generadas} líneas ya escritas)")
+        
+        print(f"   📝 Generando archivo .HAB por bloques...")
+        
+        hab_path = os.path.join(directorio_salida, f"{base_salida}.HAB")
+        
+        problemas = []
+        
+        def bloques_revisados():
+            for bloque in itertools.chain([primer_bloque], bloques):
+                with medir_etapa(resultado, 'revision'):
+                    problemas.append(revisar_caracteres_hab(bloque, resultado['filas_leidas']))
+                resultado['filas_leidas'] += len(bloque)
+                yield bloque
+        
+        # En streaming la lectura, la codificación y la escritura se intercalan:
+        # cada etapa suma lo que tardó en todos los bloques
+        registro = _abrir_registro(control_enviados, directorio_salida)
+        escritor_auditoria = _abrir_auditoria(auditoria, directorio_salida, base_salida, punto_control)
+        validacion = []
+        lineas_hab, lineas_saltadas = generar_archivo_hab_por_bloques(
+            bloques_revisados(), hab_path, resultado, perfil, registro, escritor_auditoria, validacion, punto_control
+        )
+        resultado.update(hab_path=hab_path, lineas_generadas=lineas_hab, lineas_saltadas=lineas_saltadas)
+        _informar_repetidos(registro, resultado, directorio_salida, base_salida)
+        _informar_caracteres(pd.concat(problemas, ignore_index=True), resultado, directorio_salida, base_salida)
+        _informar_validacion(pd.concat(validacion, ignore_index=True), resultado, directorio_salida, base_salida)
+        
+        print(f"   ✅ Archivo .HAB generado: {hab_path}")
+        print(f"   📊 Total de líneas creadas en archivo .HAB: {lineas_hab}")
+        if lineas_saltadas > 0:
+            print(f"   ⚠️  Registros saltados (IdApoderado vacío): {lineas_saltadas}")
+        
+        _dividir_hab(division, resultado, registro)
+        _cerrar_auditoria(escritor_auditoria, resultado)
+        escritor_auditoria = None
+        
+    except Exception as e:
+        resultado['error'] = str(e)
+        print(f"   ❌ Error procesando archivo {filename}: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    finally:
+        # Detiene la lectura en segundo plano si el proceso terminó antes
+        if bloques is not None:
+            bloques.close()
+        if lector is not None:
+            lector.close()
+        if registro is not None:
+            registro.close()
+        if escritor_auditoria is not None:
+            escritor_auditoria.close()
+        tiempos['total'] = time.perf_counter() - inicio
+        _cerrar_ejecucion(resultado, 'streaming', directorio_salida, base_salida, perfil)
+    
+    return resultado
+
+
+def _abrir_punto_control(excel_path, directorio_salida, auditoria, base_salida):
+    """
+    PuntoDeControl de la entrada: el guardado por una ejecución anterior que
+    se cortó (si se puede retomar) o uno nuevo para base_salida. None si los
+    puntos de control están desactivados o la auditoría no es CSV.
+    """
+    formato_auditoria = auditoria or FORMATO_AUDITORIA
+    if not INTERVALO_PUNTO_CONTROL:
+        return None
+    if formato_auditoria not in ('csv', 'no'):
+        print(f"   ⚠️  Con auditoría {formato_auditoria} no se guardan puntos de control: si se corta, se reprocesa desde el inicio")
+        return None
+    clave = _clave_manifiesto(calcular_hash_archivo(excel_path))
+    path = _ruta_punto_control(directorio_salida, excel_path)
+    punto_control = PuntoDeControl.cargar(path, clave, formato_auditoria, directorio_salida)
+    if punto_control is None:
+        punto_control = PuntoDeControl(
+            path, clave, base_salida, datetime.now().strftime('%Y%m%d'), formato_auditoria
+        )
+    return punto_control
+
+
+def _informar_columnas_faltantes(columnas):
+    """Informa las columnas de entrada ausentes, que se toman como vacías (ver compilar_plan_origen)."""
+    faltantes = compilar_plan_origen(columnas).faltantes
+    if faltantes:
+        print(f"   ⚠️  Columnas ausentes (se toman como vacías): {', '.join(faltantes)}")
+
+
+def _dividir_hab(division, resultado, registro):
+    """
+    Divide el .HAB generado según division (ver dividir_hab.py). Las partes
+    reemplazan al .HAB completo: hab_path queda en None y particiones_path
+    apunta al manifiesto con los registros y el SHA-256 de cada parte.
+    """
+    division = division or DIVISION_HAB
+    if not division or division == 'no':
+        return
+    # Importación diferida: dividir_hab usa el diseño de registro de este módulo
+    from dividir_hab import dividir_archivo_hab
+    
+    with medir_etapa(resultado, 'division'):
+        manifiesto = dividir_archivo_hab(resultado['hab_path'], division, workers=MAX_WORKERS, registro=registro)
+    resultado.update(hab_path=None, particiones_path=manifiesto['manifiesto_path'])
+    print(f"   ✂️  .HAB dividido ({division}) en {len(manifiesto['partes'])} archivos")
+    for parte in manifiesto['partes'][:10]:
+        print(f"      {parte['archivo']}: {parte['registros']} registros")
+    if len(manifiesto['partes']) > 10:
+        print(f"      ... y {len(manifiesto['partes']) - 10} más")
+    print(f"   📄 Manifiesto de particiones: {manifiesto['manifiesto_path']}")
+
+
+def _cerrar_auditoria(escritor_auditoria, resultado):
+    """Cierra el archivo de auditoría (si se pidió) y lo informa en el resultado."""
+    if escritor_auditoria is None:
+        return
+    with medir_etapa(resultado, 'auditoria'):
+        escritor_auditoria.close()
+    resultado['auditoria_path'] = escritor_auditoria.path
+    print(f"   💾 Auditoría guardada ({escritor_auditoria.filas} registros): {escritor_auditoria.path}")
+
+
+def _informar_caracteres(problemas, resultado, directorio_salida, base_salida):
+    """
+    Informa los valores con caracteres fuera de latin-1 (ver
+    revisar_caracteres_hab) y los guarda en caracteres_<archivo>.csv junto a
+    las salidas.
+    """
+    resultado['valores_no_latin1'] = len(problemas)
+    if problemas.empty:
+        return
+    
+    print(f"   ⚠️  Valores con caracteres fuera de latin-1 (se aproximan en el .HAB): {len(problemas)}")
+    for problema in problemas.head(10).itertuples(index=False):
+        print(f"      fila {problema.fila_excel}, {problema.columna}: "
+              f"'{problema.valor}' → '{problema.valor_hab}' ({problema.caracteres})")
+    if len(problemas) > 10:
+        print(f"      ... y {len(problemas) - 10} más")
+    
+    caracteres_path = os.path.join(directorio_salida, f"caracteres_{base_salida}.csv")
+    problemas.to_csv(caracteres_path, index=False, encoding='utf-8-sig')
+    resultado['caracteres_path'] = caracteres_path
+    print(f"   📄 Detalle guardado en: {caracteres_path}")
+
+
+def _informar_validacion(problemas, resultado, directorio_salida, base_salida):
+    """
+    Informa los problemas de la validación previa (ver validar_campos_hab)
+    y los guarda en validacion_<archivo>.csv junto a las salidas.
+    """
+    resultado['errores_validacion'] = len(problemas)
+    if problemas.empty:
+        return
+    
+    print(f"   ⚠️  Problemas de validación (el banco puede rechazar esos registros): {len(problemas)}")
+    for error, cantidad in problemas['error'].value_counts().head(10).items():
+        print(f"      {cantidad:>8}  {error}")
+    
+    validacion_path = os.path.join(directorio_salida, f"validacion_{base_salida}.csv")
+    problemas.to_csv(validacion_path, index=False, encoding='utf-8-sig')
+    resultado['validacion_path'] = validacion_path
+    print(f"   📄 Detalle guardado en: {validacion_path}")
+
+
+def _abrir_registro(control_enviados, directorio_salida):
+    """RegistroEnviados de la carpeta de salida según control_enviados (None si es 'no')."""
+    if control_enviados is None:
+        control_enviados = CONTROL_ENVIADOS
+    if control_enviados == 'no':
+        return None
+    return RegistroEnviados(
+        os.path.join(directorio_salida, REGISTRO_ENVIADOS), omitir=control_enviados == 'omitir'
+    )
+
+
+def _informar_repetidos(registro, resultado, directorio_salida, base_salida):
+    """
+    Informa las personas que ya figuraban en el registro de enviados o que
+    se repiten dentro del mismo archivo y las guarda en
+    repetidos_<archivo>.csv junto a las salidas.
+    """
+    if registro is None or not registro.repetidos:
+        return
+    
+    resultado['lineas_repetidas'] = len(registro.repetidos)
+    accion = "omitidas del .HAB" if registro.omitir else "incluidas igualmente en el .HAB"
+    print(f"   ⚠️  Personas ya enviadas en otro .HAB o repetidas en este ({accion}): {len(registro.repetidos)}")
+    for repetido in registro.repetidos[:10]:
+        anterior = (f"{repetido['archivo_hab_anterior']} ({repetido['fecha_anterior']})"
+                    if repetido['archivo_hab_anterior'] else repetido['motivo'])
+        print(f"      CUIL {repetido['cuil']} {repetido['apellido']} {repetido['nombre']}: {anterior}")
+    if len(registro.repetidos) > 10:
+        print(f"      ... y {len(registro.repetidos) - 10} más")
+    
+    repetidos_path = os.path.join(directorio_salida, f"repetidos_{base_salida}.csv")
+    pd.DataFrame(registro.repetidos).to_csv(repetidos_path, index=False, encoding='utf-8-sig')
+    resultado['repetidos_path'] = repetidos_path
+    print(f"   📄 Detalle guardado en: {repetidos_path}")
+
+
+def _procesar_archivo_aislado(excel_path, streaming, directorio_salida, perfilar=False, control_enviados=None,
+                              auditoria=None, division=None, lectura=None):
+    """
+    Ejecuta procesar_archivo_excel capturando cualquier excepción, para que
+    un archivo con error no afecte al resto del lote. Se usa tanto en el
+    proceso principal como en los procesos del pool.
+    """
+    try:
+        return procesar_archivo_excel(
+            excel_path, streaming=streaming, directorio_salida=directorio_salida, perfilar=perfilar,
+            control_enviados=control_enviados, auditoria=auditoria, division=division, lectura=lectura,
+        )
+    except Exception as e:
+        print(f"❌ Error general procesando {os.path.basename(excel_path)}: {e}")
+        resultado = _nuevo_resultado(excel_path)
+        resultado['error'] = str(e)
+        return resultado
+
+
+def _ejecutar_lote(excel_files, workers, streaming, directorio_salida, perfilar=False, control_enviados=None,
+                  auditoria=None, division=None):
+    """Procesa los archivos (en paralelo si workers > 1) y devuelve {ruta: resultado}."""
+    workers = min(workers or MAX_WORKERS or os.cpu_count() or 1, len(excel_files))
+    
+    if workers <= 1:
+        return _ejecutar_en_serie(
+            excel_files, streaming, directorio_salida, perfilar, control_enviados, auditoria, division
+        )
+    
+    print(f"⚙️  Procesando en paralelo con {workers} procesos")
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {
+            pool.submit(
+                _procesar_archivo_aislado, f, streaming, directorio_salida, perfilar, control_enviados, auditoria,
+                division,
+            ): f
+            for f in excel_files
+        }
+        for futuro in as_completed(futuros):
+            excel_file = futuros[futuro]
+            try:
+                resultados[excel_file] = futuro.result()
+            except Exception as e:
+                # El proceso del pool terminó de forma anormal (p. ej. falta de memoria)
+                print(f"❌ Error general procesando {os.path.basename(excel_file)}: {e}")
+                resultado = _nuevo_resultado(excel_file)
+                resultado['error'] = str(e) or type(e).__name__
+                resultados[excel_file] = resultado
+    
+    return resultados
+
+
+def _ejecutar_en_serie(excel_files, streaming, directorio_salida, perfilar=False, control_enviados=None,
+                      auditoria=None, division=None):
+    """
+    Procesa los archivos de a uno. Sin streaming, un hilo lee el archivo
+    siguiente mientras se procesa el actual (como máximo uno adelantado, así
+    que hay a lo sumo dos archivos en memoria); en streaming el solapamiento
+    ya ocurre dentro de cada archivo.
+    """
+    if streaming or len(excel_files) == 1:
+        return {
+            f: _procesar_archivo_aislado(
+                f, streaming, directorio_salida, perfilar, control_enviados, auditoria, division
+            )
+            for f in excel_files
+        }
+    
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='lectura') as hilo:
+        siguiente = hilo.submit(leer_archivo_entrada, excel_files[0])
+        for posicion, excel_file in enumerate(excel_files):
+            lectura = siguiente
+            # Un solo hilo: la lectura siguiente empieza cuando termina la actual
+            if posicion + 1 < len(excel_files):
+                siguiente = hilo.submit(leer_archivo_entrada, excel_files[posicion + 1])
+            resultados[excel_file] = _procesar_archivo_aislado(
+                excel_file, streaming, directorio_salida, perfilar, control_enviados, auditoria, division, lectura
+            )
+            # El DataFrame del archivo procesado ya no hace falta
+            del lectura
+    return resultados
+
+
+def procesar_lote(excel_files, workers=None, streaming=None, directorio_salida=None, forzar=False,
+                  perfilar=False, control_enviados=None, auditoria=None, division=None):
+    """
+    Procesa varios archivos Excel, en paralelo con un pool de procesos si
+    workers > 1. Cada archivo se procesa de forma aislada: un error en uno
+    no detiene a los demás.
+    
+    Los archivos que ya figuran en el manifiesto de directorio_salida (mismo
+    contenido, nombre y opciones de salida, ver _clave_procesado) no se
+    vuelven a procesar: se informa el .HAB generado anteriormente.
+    
+    Args:
+        excel_files: Lista de rutas .xlsx
+        workers: Cantidad de procesos (por defecto MAX_WORKERS, o la cantidad de CPUs)
+        streaming: Modo streaming (por defecto MODO_STREAMING)
+        directorio_salida: Carpeta de salida (por defecto PROCESADOS_DIR)
+        forzar: Si es True, procesa todos los archivos aunque no hayan cambiado
+        perfilar: Perfilar con cProfile la codificación de cada archivo
+        control_enviados: 'marcar', 'omitir' o 'no' (por defecto CONTROL_ENVIADOS)
+        auditoria: 'parquet', 'csv', 'xlsx' o 'no' (por defecto FORMATO_AUDITORIA)
+        division: División del .HAB en partes (por defecto DIVISION_HAB; ver procesar_archivo_excel)
+    
+    Returns:
+        Lista de resultados (ver procesar_archivo_excel), en el orden de excel_files
+    """
+    if streaming is None:
+        streaming = MODO_STREAMING
+    directorio_salida = directorio_salida or PROCESADOS_DIR
+    
+    manifiesto = cargar_manifiesto(directorio_salida)
+    resultados = {}
+    claves = {}
+    
+    for excel_file in excel_files:
+        try:
+            claves[excel_file] = _clave_procesado(excel_file, control_enviados, auditoria, division)
+        except OSError as e:
+            print(f"⚠️  No se pudo calcular el hash de {os.path.basename(excel_file)}: {e}")
+            continue
+        
+        resultado = None if forzar else resultado_desde_manifiesto(manifiesto, claves[excel_file], excel_file)
+        if resultado is not None:
+            resultados[excel_file] = resultado
+    
+    pendientes = [f for f in excel_files if f not in resultados]
+    if pendientes:
+        procesados = _ejecutar_lote(
+            pendientes, workers, streaming, directorio_salida, perfilar, control_enviados, auditoria, division
+        )
+        resultados.update(procesados)
+        
+        for excel_file, resultado in procesados.items():
+            if resultado['error'] or excel_file not in claves:
+                continue
+            manifiesto[claves[excel_file]] = entrada_manifiesto(resultado)
+        guardar_manifiesto(directorio_salida, manifiesto)
+    
+    return [resultados[f] for f in excel_files]
+
+
+def imprimir_resumen(resultados):
+    """Imprime el resumen consolidado de un lote de archivos procesados."""
+    print("\n📋 Resumen por archivo:")
+    for r in resultados:
+        total = r['tiempos'].get('total', 0)
+        if r['error']:
+            print(f"   ❌ {r['archivo']}: {r['error']} ({total:.1f}s)")
+        elif r['desde_cache']:
+            print(f"   ♻️  {r['archivo']}: sin cambios, {r['lineas_generadas']} líneas en "
+                  f"{r['particiones_path'] or r['hab_path']}")
+        else:
+            print(f"   ✅ {r['archivo']}: {r['lineas_generadas']} líneas, "
+                  f"{r['lineas_saltadas']} saltadas ({total:.1f}s)")
+            if r['lineas_repetidas']:
+                print(f"      ⚠️  {r['lineas_repetidas']} personas ya enviadas en otro .HAB "
+                      f"(ver {r['repetidos_path']})")
+            if r['valores_no_latin1']:
+                print(f"      ⚠️  {r['valores_no_latin1']} valores con caracteres fuera de latin-1 "
+                      f"(ver {r['caracteres_path']})")
+            if r['errores_validacion']:
+                print(f"      ⚠️  {r['errores_validacion']} problemas de validación "
+                      f"(ver {r['validacion_path']})")
+            for m in metricas_etapas(r, r['filas_leidas'], r['lineas_generadas']):
+                velocidad = f"{m['filas_por_segundo']:,} filas/s" if m['filas_por_segundo'] else "-"
+                memoria = f"{m['pico_rss_mb']:.0f} MB" if m['pico_rss_mb'] is not None else "-"
+                print(f"      ⏱️  {m['etapa']:<16} {m['segundos']:>8.2f}s  {velocidad:>18}  pico RSS {memoria}")
+    
+    archivos_procesados = sum(1 for r in resultados if not r['error'])
+    archivos_con_error = len(resultados) - archivos_procesados
+    
+    print("\n🎉 Procesamiento completado!")
     print(f"📊 Archivos procesados exitosamente: {archivos_procesados}")
+    print(f"📊 Total de líneas creadas: {sum(r['lineas_generadas'] for r in resultados)}")
+    print(f"📊 Total de registros saltados: {sum(r['lineas_saltadas'] for r in resultados)}")
+    repetidas = sum(r['lineas_repetidas'] for r in resultados)
+    if repetidas > 0:
+        print(f"⚠️  Personas ya enviadas en otros .HAB: {repetidas}")
     if archivos_con_error > 0:
         print(f"⚠️  Archivos con error: {archivos_con_error}")
 
 
+def carpetas_trabajo(directorio_entrada=None, directorio_salida=None):
+    """
+    Carpetas de entrada y de salida: por defecto FERIAS_NOC_DIR y
+    PROCESADOS_DIR; con otra entrada, la salida por defecto es
+    <entrada>/procesados_directo.
+    """
+    if directorio_entrada is None:
+        return FERIAS_NOC_DIR, directorio_salida or PROCESADOS_DIR
+    return directorio_entrada, directorio_salida or os.path.join(directorio_entrada, SUBDIR_PROCESADOS)
+
+
+def main(workers=None, streaming=None, forzar=False, perfilar=False, control_enviados=None, auditoria=None,
+         division=None, directorio_entrada=None, directorio_salida=None):
+    """
+    Función principal que procesa todos los archivos de entrada (.xlsx, .csv, .parquet)
+    
+    Args:
+        directorio_entrada: Carpeta con los archivos a procesar (por defecto FERIAS_NOC_DIR)
+        directorio_salida: Carpeta de salida (por defecto PROCESADOS_DIR)
+        workers: Cantidad de procesos en paralelo (por defecto MAX_WORKERS)
+        streaming: Modo streaming (por defecto MODO_STREAMING)
+        forzar: Reprocesar también los archivos sin cambios
+        perfilar: Guardar un perfil cProfile (.prof) de la codificación de cada archivo
+        control_enviados: 'marcar', 'omitir' o 'no' (por defecto CONTROL_ENVIADOS)
+        auditoria: 'parquet', 'csv', 'xlsx' o 'no' (por defecto FORMATO_AUDITORIA)
+        division: División del .HAB en partes (por defecto DIVISION_HAB)
+    """
+    directorio_entrada, directorio_salida = carpetas_trabajo(directorio_entrada, directorio_salida)
+    print("🚀 Iniciando procesamiento directo de archivos Excel...")
+    print(f"📁 Directorio de entrada: {directorio_entrada}")
+    print(f"📁 Directorio de salida: {directorio_salida}")
+    
+    # Crear directorio de salida si no existe
+    os.makedirs(directorio_salida, exist_ok=True)
+    
+    # Buscar archivos de entrada en el directorio
+    all_excel_files = sorted(
+        path for extension in EXTENSIONES_ENTRADA
+        for path in glob.glob(os.path.join(glob.escape(directorio_entrada), f"*{extension}"))
+    )
+    
+    # Filtrar archivos temporales de Excel
+    excel_files = [f for f in all_excel_files if not os.path.basename(f).startswith('~$')]
+    formatos = ', '.join(EXTENSIONES_ENTRADA)
+    
+    if not excel_files:
+        print(f"❌ No se encontraron archivos ({formatos}) en {directorio_entrada}")
+        print(f"\n💡 Uso alternativo: Puedes llamar a la función directamente:")
+        print(f"   from procesar_excel_directo import procesar_archivo_excel")
+        print(f"   procesar_archivo_excel('ruta/al/archivo.xlsx')")
+        return
+    
+    print(f"📋 Se encontraron {len(excel_files)} archivo(s) ({formatos}) para procesar\n")
+    
+    resultados = procesar_lote(excel_files, workers=workers, streaming=streaming, directorio_salida=directorio_salida,
+                               forzar=forzar, perfilar=perfilar, control_enviados=control_enviados,
+                               auditoria=auditoria, division=division)
+    imprimir_resumen(resultados)
+    return resultados
+
+
+def cli(argv=None):
+    """
+    Punto de entrada de la línea de comandos. openpyxl y pyarrow se
+    importan recién en los lectores y escritores que los usan.
+    """
+    parser = argparse.ArgumentParser(description="Genera archivos .HAB a partir de los Excel de la carpeta de entrada")
+    parser.add_argument("--entrada", default=None, metavar="CARPETA",
+                        help="Carpeta con los archivos a procesar (por defecto FERIAS_NOC_DIR: "
+                             "<HAB_BASE_DIR>/PPP)")
+    parser.add_argument("--salida", default=None, metavar="CARPETA",
+                        help="Carpeta de salida (por defecto <entrada>/procesados_directo)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Cantidad de archivos a procesar en paralelo (por defecto, uno por CPU)")
+    parser.add_argument("--streaming", action="store_true", default=None,
+                        help="Leer y escribir por bloques de filas (memoria acotada)")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocesar todos los archivos, aunque no hayan cambiado desde la última ejecución")
+    parser.add_argument("--perfilar", action="store_true",
+                        help="Perfilar con cProfile el mapeo y la codificación (.prof junto a las salidas)")
+    parser.add_argument("--enviados", choices=['marcar', 'omitir', 'no'], default=None,
+                        help="Personas que ya figuran en el registro de enviados: informarlas (marcar), "
+                             "sacarlas del .HAB (omitir) o no controlar (por defecto CONTROL_ENVIADOS)")
+    parser.add_argument("--auditoria", choices=FORMATOS_AUDITORIA, default=None,
+                        help="Formato del archivo con los campos derivados de cada registro del .HAB, "
+                             "o 'no' para no generarlo (por defecto FORMATO_AUDITORIA)")
+    parser.add_argument("--dividir", default=None, metavar="DIVISION",
+                        help="Dividir cada .HAB en partes: sucursal, registros:N, bytes:N, sucursal:N "
+                             "(por sucursal, hasta N registros) o no (por defecto DIVISION_HAB)")
+    parser.add_argument("--vigilar", action="store_true",
+                        help="Modo servicio: vigilar la carpeta de entrada y procesar cada archivo nuevo al llegar "
+                             "(ver vigilar_entrada.py)")
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers debe ser al menos 1")
+    if args.entrada and not os.path.isdir(args.entrada):
+        parser.error(f"No existe la carpeta de entrada: {args.entrada}")
+    if args.dividir and args.dividir != 'no':
+        from dividir_hab import parsear_division
+        try:
+            parsear_division(args.dividir)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.vigilar:
+        from vigilar_entrada import vigilar
+        vigilar(directorio_entrada=args.entrada, directorio_salida=args.salida, workers=args.workers,
+                streaming=args.streaming, perfilar=args.perfilar, control_enviados=args.enviados,
+                auditoria=args.auditoria, division=args.dividir)
+    else:
+        main(workers=args.workers, streaming=args.streaming, forzar=args.force, perfilar=args.perfilar,
+             control_enviados=args.enviados, auditoria=args.auditoria, division=args.dividir,
+             directorio_entrada=args.entrada, directorio_salida=args.salida)
+    return 0
+
+
 if __name__ == "__main__":
-    main()
+    raise SystemExit(cli())
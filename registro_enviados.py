@@ -0,0 +1,359 @@
+"""
+Registro de personas ya enviadas al banco en archivos .HAB.
+
+Base SQLite con índices por CUIL y por NRO DOCUMENTO. Antes de escribir un
+.HAB se consultan en bloque las claves de todos sus registros y quedan
+reservadas a nombre de ese archivo; recién cuando el archivo quedó completo
+en disco la reserva pasa a envío. Así la misma persona que aparece en
+exportaciones distintas (o dos veces en la misma, o en dos archivos que se
+generan a la vez) se detecta antes de que el banco rechace el alta días
+después.
+
+Uso desde línea de comandos:
+    python registro_enviados.py resumen registro_enviados.sqlite
+    python registro_enviados.py buscar registro_enviados.sqlite 20123456789
+    python registro_enviados.py importar registro_enviados.sqlite anteriores/*.HAB
+    python registro_enviados.py olvidar registro_enviados.sqlite archivo.HAB
+"""
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Nombre de la base dentro de la carpeta de salida
+REGISTRO_ENVIADOS = 'registro_enviados.sqlite'
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS enviados (
+    id INTEGER PRIMARY KEY,
+    cuil TEXT,
+    nro_documento TEXT,
+    archivo_hab TEXT NOT NULL,
+    origen TEXT,
+    fecha TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_enviados_cuil ON enviados (cuil);
+CREATE INDEX IF NOT EXISTS idx_enviados_nro_documento ON enviados (nro_documento);
+CREATE INDEX IF NOT EXISTS idx_enviados_archivo_hab ON enviados (archivo_hab);
+
+-- Personas de los .HAB que se están generando (de cualquier proceso); las
+-- escritas pasan a enviados con confirmar_reservas
+CREATE TABLE IF NOT EXISTS reservas (
+    id INTEGER PRIMARY KEY,
+    cuil TEXT,
+    nro_documento TEXT,
+    archivo_hab TEXT NOT NULL,
+    escrita INTEGER NOT NULL,
+    fecha TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservas_cuil ON reservas (cuil);
+CREATE INDEX IF NOT EXISTS idx_reservas_nro_documento ON reservas (nro_documento);
+CREATE INDEX IF NOT EXISTS idx_reservas_archivo_hab ON reservas (archivo_hab);
+"""
+
+# Claves de una consulta en bloque (de la conexión, solo dentro de una transacción)
+_ESQUEMA_CONSULTA = """
+CREATE TEMP TABLE IF NOT EXISTS consulta (posicion INTEGER PRIMARY KEY, cuil TEXT, nro_documento TEXT);
+CREATE INDEX IF NOT EXISTS temp.idx_consulta_cuil ON consulta (cuil);
+CREATE INDEX IF NOT EXISTS temp.idx_consulta_nro_documento ON consulta (nro_documento);
+"""
+
+# Una reserva de otro archivo más vieja que esto es de un proceso que se cortó
+# sin liberarla: ya no bloquea a nadie
+VIGENCIA_RESERVA = timedelta(hours=12)
+
+
+def normalizar_clave(valor):
+    """CUIL o DNI como dígitos sin ceros a la izquierda (None si no tiene dígitos)."""
+    if valor is None:
+        return None
+    digitos = ''.join(c for c in str(valor) if '0' <= c <= '9').lstrip('0')
+    return digitos or None
+
+
+class RegistroEnviados:
+    """
+    Registro persistente de personas enviadas, por CUIL y por DNI.
+
+    Se usa como context manager:
+        with RegistroEnviados('registro_enviados.sqlite', omitir=True) as registro:
+            ya_enviados = registro.buscar(cuils, documentos)
+
+    omitir indica qué hacer con las personas ya enviadas al generar un
+    .HAB (True: sacarlas del archivo; False: solo informarlas). Las
+    encontradas se acumulan en repetidos para el reporte.
+
+    Al generar un .HAB, controlar consulta cada bloque y, en la misma
+    transacción corta, reserva sus personas a nombre del archivo. Las
+    escritas se registran todas juntas con confirmar_reservas cuando el
+    archivo está completo; si la generación falla, liberar_reservas. Un
+    corte abrupto no deja registradas personas de un .HAB que no existe.
+
+    La base usa WAL y transacciones IMMEDIATE, así varios procesos del
+    pool pueden compartirla: como la consulta y la reserva de cada bloque
+    son atómicas, dos archivos que se generan a la vez (completos o por
+    bloques) no pueden llevar a la misma persona. El bloqueo de escritura
+    nunca se mantiene mientras se escribe el .HAB.
+    """
+
+    def __init__(self, path, omitir=False, timeout=60):
+        self.path = path
+        self.omitir = omitir
+        self.repetidos = []
+        # isolation_level=None: las transacciones se abren explícitamente
+        self.conexion = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conexion.execute('PRAGMA journal_mode=WAL')
+        self.conexion.executescript(_ESQUEMA)
+        self.conexion.executescript(_ESQUEMA_CONSULTA)
+
+    def close(self):
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conexion.execute('SELECT COUNT(*) FROM enviados').fetchone()[0]
+
+    @contextmanager
+    def transaccion(self):
+        """Transacción con bloqueo de escritura (reentrante: si ya hay una abierta, se usa esa)."""
+        if self.conexion.in_transaction:
+            yield
+            return
+        self.conexion.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.conexion.execute('ROLLBACK')
+            raise
+        self.conexion.execute('COMMIT')
+
+    def buscar(self, cuils, documentos):
+        """
+        Busca en bloque personas ya enviadas. Las claves se cargan en una
+        tabla temporal y se cruzan con los índices de CUIL y de DNI, así que
+        cada registro cuesta una búsqueda en índice sin importar cuántos
+        envíos históricos haya.
+
+        Args:
+            cuils: Secuencia de CUIL (cualquier formato; vacíos se ignoran)
+            documentos: Secuencia de DNI, del mismo largo que cuils
+
+        Returns:
+            Dict posición → (archivo_hab, fecha) de un envío anterior, solo
+            para las posiciones encontradas
+        """
+        claves = [(normalizar_clave(cuil), normalizar_clave(documento)) for cuil, documento in zip(cuils, documentos)]
+        with self.transaccion():
+            return self._buscar_enviados(claves)
+
+    def controlar(self, cuils, documentos, archivo_hab):
+        """
+        Como buscar, y además encuentra las personas reservadas por otro
+        .HAB que se está generando y las repetidas dentro de archivo_hab
+        (en bloques anteriores o antes en esta misma consulta). En la misma
+        transacción reserva todas las personas a nombre de archivo_hab; las
+        encontradas, si omitir, como no escritas.
+
+        Returns:
+            Dict posición → (archivo_hab, fecha) del envío o la reserva de
+            otro archivo, o (None, None) si se repite en el mismo archivo
+        """
+        claves = [(normalizar_clave(cuil), normalizar_clave(documento)) for cuil, documento in zip(cuils, documentos)]
+        vigentes = (datetime.now() - VIGENCIA_RESERVA).isoformat(timespec='seconds')
+        fecha = datetime.now().isoformat(timespec='seconds')
+        with self.transaccion():
+            encontrados = self._buscar_enviados(claves, vaciar=False)
+            for columna in ('cuil', 'nro_documento'):
+                filas = self.conexion.execute(
+                    f'SELECT c.posicion, r.archivo_hab, r.fecha FROM consulta c '
+                    f'JOIN reservas r ON r.{columna} = c.{columna} '
+                    f'WHERE r.escrita AND r.archivo_hab != ? AND r.fecha >= ?',
+                    (archivo_hab, vigentes),
+                )
+                for posicion, otro_archivo, fecha_reserva in filas:
+                    encontrados.setdefault(posicion, (otro_archivo, fecha_reserva))
+            for columna in ('cuil', 'nro_documento'):
+                filas = self.conexion.execute(
+                    f'SELECT c.posicion FROM consulta c WHERE '
+                    f'EXISTS (SELECT 1 FROM reservas r WHERE r.{columna} = c.{columna} AND r.archivo_hab = ?) OR '
+                    f'EXISTS (SELECT 1 FROM consulta d WHERE d.{columna} = c.{columna} AND d.posicion < c.posicion)',
+                    (archivo_hab,),
+                )
+                for (posicion,) in filas:
+                    encontrados.setdefault(posicion, (None, None))
+            self.conexion.execute('DELETE FROM consulta')
+            self.conexion.executemany(
+                'INSERT INTO reservas (cuil, nro_documento, archivo_hab, escrita, fecha) VALUES (?, ?, ?, ?, ?)',
+                (
+                    (cuil, documento, archivo_hab, not (self.omitir and posicion in encontrados), fecha)
+                    for posicion, (cuil, documento) in enumerate(claves)
+                    if cuil or documento
+                ),
+            )
+        return encontrados
+
+    def _buscar_enviados(self, claves, vaciar=True):
+        """Cruza las claves normalizadas con enviados (dentro de una transacción)."""
+        encontrados = {}
+        self.conexion.execute('DELETE FROM consulta')
+        self.conexion.executemany(
+            'INSERT INTO consulta VALUES (?, ?, ?)',
+            ((posicion, cuil, documento) for posicion, (cuil, documento) in enumerate(claves)),
+        )
+        for columna in ('cuil', 'nro_documento'):
+            filas = self.conexion.execute(
+                f'SELECT c.posicion, e.archivo_hab, e.fecha FROM consulta c '
+                f'JOIN enviados e ON e.{columna} = c.{columna}'
+            )
+            for posicion, archivo_hab, fecha in filas:
+                encontrados.setdefault(posicion, (archivo_hab, fecha))
+        if vaciar:
+            self.conexion.execute('DELETE FROM consulta')
+        return encontrados
+
+    def registrar(self, cuils, documentos, archivo_hab, origen=None):
+        """Registra como enviadas las personas de un .HAB. Devuelve la cantidad registrada."""
+        fecha = datetime.now().isoformat(timespec='seconds')
+        filas = [
+            (cuil, documento, archivo_hab, origen, fecha)
+            for cuil, documento in zip(map(normalizar_clave, cuils), map(normalizar_clave, documentos))
+            if cuil or documento
+        ]
+        with self.transaccion():
+            self.conexion.executemany(
+                'INSERT INTO enviados (cuil, nro_documento, archivo_hab, origen, fecha) VALUES (?, ?, ?, ?, ?)',
+                filas,
+            )
+        return len(filas)
+
+    def confirmar_reservas(self, archivo_hab, origen=None):
+        """
+        Registra como enviadas las personas escritas reservadas a nombre de
+        archivo_hab (ya completo en disco) y libera su reserva. Devuelve la
+        cantidad registrada.
+        """
+        fecha = datetime.now().isoformat(timespec='seconds')
+        with self.transaccion():
+            cursor = self.conexion.execute(
+                'INSERT INTO enviados (cuil, nro_documento, archivo_hab, origen, fecha) '
+                'SELECT cuil, nro_documento, archivo_hab, ?, ? FROM reservas WHERE archivo_hab = ? AND escrita',
+                (origen, fecha, archivo_hab),
+            )
+            self.conexion.execute('DELETE FROM reservas WHERE archivo_hab = ?', (archivo_hab,))
+        return cursor.rowcount
+
+    def liberar_reservas(self, archivo_hab):
+        """Libera las personas reservadas a nombre de archivo_hab (no se completó o se vuelve a empezar)."""
+        with self.transaccion():
+            self.conexion.execute('DELETE FROM reservas WHERE archivo_hab = ?', (archivo_hab,))
+
+    def olvidar(self, archivo_hab):
+        """
+        Borra los registros de un .HAB (p. ej. si finalmente no se envió), y
+        sus reservas si quedaron de una generación cortada. Devuelve cuántos
+        registros borró.
+        """
+        with self.transaccion():
+            cursor = self.conexion.execute('DELETE FROM enviados WHERE archivo_hab = ?', (archivo_hab,))
+            self.conexion.execute('DELETE FROM reservas WHERE archivo_hab = ?', (archivo_hab,))
+        return cursor.rowcount
+
+    def consultar(self, clave):
+        """Envíos de una persona por CUIL o DNI: lista de (cuil, nro_documento, archivo_hab, fecha)."""
+        clave = normalizar_clave(clave)
+        return self.conexion.execute(
+            'SELECT cuil, nro_documento, archivo_hab, fecha FROM enviados '
+            'WHERE cuil = ? UNION SELECT cuil, nro_documento, archivo_hab, fecha FROM enviados '
+            'WHERE nro_documento = ? ORDER BY fecha',
+            (clave, clave),
+        ).fetchall()
+
+    def resumen(self):
+        """Lista de (archivo_hab, personas, fecha) ordenada por fecha de registro."""
+        return self.conexion.execute(
+            'SELECT archivo_hab, COUNT(*), MIN(fecha) FROM enviados GROUP BY archivo_hab ORDER BY MIN(fecha)'
+        ).fetchall()
+
+
+# ==================== LÍNEA DE COMANDOS ====================
+
+def _cmd_resumen(args):
+    with RegistroEnviados(args.registro) as registro:
+        filas = registro.resumen()
+        print(f"📚 {args.registro}: {len(registro)} personas en {len(filas)} archivos .HAB")
+    for archivo_hab, cantidad, fecha in filas:
+        print(f"   {fecha}  {cantidad:>8}  {archivo_hab}")
+    return 0
+
+
+def _cmd_buscar(args):
+    with RegistroEnviados(args.registro) as registro:
+        envios = registro.consultar(args.clave)
+    if not envios:
+        print(f"✅ {args.clave} no figura en el registro")
+        return 1
+    for cuil, documento, archivo_hab, fecha in envios:
+        print(f"   {fecha}  CUIL {cuil or '-'}  DNI {documento or '-'}  {archivo_hab}")
+    return 0
+
+
+def _cmd_importar(args):
+    # Importación diferida: lector_hab depende del generador, que usa este módulo
+    from lector_hab import ArchivoHAB
+
+    with RegistroEnviados(args.registro) as registro:
+        for path in args.archivos:
+            with ArchivoHAB(path) as hab:
+                cuils = [valor for valor, _ in hab.claves('NRO CLAVE FISCAL')]
+                documentos = [valor for valor, _ in hab.claves('NRO DOCUMENTO')]
+            archivo_hab = os.path.basename(path)
+            with registro.transaccion():
+                registro.olvidar(archivo_hab)
+                cantidad = registro.registrar(cuils, documentos, archivo_hab, origen='importado')
+            print(f"📥 {archivo_hab}: {cantidad} personas")
+    return 0
+
+
+def _cmd_olvidar(args):
+    with RegistroEnviados(args.registro) as registro:
+        for archivo_hab in args.archivos:
+            borrados = registro.olvidar(os.path.basename(archivo_hab))
+            print(f"🗑️  {os.path.basename(archivo_hab)}: {borrados} personas quitadas del registro")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registro de personas ya enviadas en archivos .HAB")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    resumen = subparsers.add_parser('resumen', help="Archivos registrados y cantidad de personas")
+    resumen.add_argument('registro')
+    resumen.set_defaults(funcion=_cmd_resumen)
+
+    buscar = subparsers.add_parser('buscar', help="Buscar los envíos de una persona por CUIL o DNI")
+    buscar.add_argument('registro')
+    buscar.add_argument('clave')
+    buscar.set_defaults(funcion=_cmd_buscar)
+
+    importar = subparsers.add_parser('importar', help="Registrar archivos .HAB enviados anteriormente")
+    importar.add_argument('registro')
+    importar.add_argument('archivos', nargs='+')
+    importar.set_defaults(funcion=_cmd_importar)
+
+    olvidar = subparsers.add_parser('olvidar', help="Quitar del registro las personas de un .HAB no enviado")
+    olvidar.add_argument('registro')
+    olvidar.add_argument('archivos', nargs='+')
+    olvidar.set_defaults(funcion=_cmd_olvidar)
+
+    args = parser.parse_args(argv)
+    return args.funcion(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,67 @@
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import procesar_excel_directo  # noqa: E402
+
+# Valores de borde que se reparten entre las filas: acentos, textos largos,
+# vacíos, dígitos no ASCII, separadores en documentos y celulares
+VALORES_TEXTO = ['Pérez', 'Ñandú ü', "D'Angelo Núñez", 'GARCÍA LÓPEZ  MARTÍN', '', None, 'x' * 40, 'ana maría']
+VALORES_NUMERO = ['20-12345678-9', '12345678', '123 ', '1²3', '', None, '0', '123456789012345']
+VALORES_CELULAR = ['011 45678901', '+54 9 351 555-1234', '12', '', None]
+VALORES_SEXO = ['F', 'M', 'MUJER', 'varon', '1', '02', '', None]
+VALORES_APODERADO = ['A1', '  ', None, '7', '']
+SUCURSALES = ['70', '123', '00123', '20123', '']
+
+
+def filas_entrada(cantidad):
+    """Filas de entrada (beneficiarios con y sin apoderado) con CUIL y DNI distintos en cada una."""
+    filas = []
+    for i in range(cantidad):
+        fila = {'IdApoderado': VALORES_APODERADO[i % len(VALORES_APODERADO)]}
+        for j, (campo, (apoderado, beneficiario)) in enumerate(procesar_excel_directo.MAPEO_APODERADO.items()):
+            if campo in ('CUIL', 'NRO_DOCUMENTO'):
+                fila[apoderado] = str((30 if campo == 'CUIL' else 40) * 10 ** 6 + 2 * i)
+                fila[beneficiario] = str((30 if campo == 'CUIL' else 40) * 10 ** 6 + 2 * i + 1)
+                continue
+            if campo == 'COD_BCO_CBA':
+                valores = SUCURSALES
+            elif campo == 'SEXO':
+                valores = VALORES_SEXO
+            elif campo == 'CELULAR_POST':
+                valores = VALORES_CELULAR
+            elif campo in ('FEC_NACIMIENTO', 'ALTURA_ORACLE', 'CPA'):
+                valores = VALORES_NUMERO
+            else:
+                valores = VALORES_TEXTO
+            fila[apoderado] = valores[(i + j) % len(valores)]
+            fila[beneficiario] = valores[(i + 2 * j + 1) % len(valores)]
+        filas.append(fila)
+    return pd.DataFrame(filas, dtype=object)
+
+
+class _FechaFija(datetime):
+    """datetime con now() fijo: la FECHA ALTA no cambia entre generaciones."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2026, 1, 2, 10, 30, 0)
+
+
+@pytest.fixture
+def fecha_fija(monkeypatch):
+    monkeypatch.setattr(procesar_excel_directo, 'datetime', _FechaFija)
+    return '20260102'
+
+
+@pytest.fixture
+def entrada_csv(tmp_path):
+    """CSV de entrada con 2500 filas."""
+    path = tmp_path / 'entrada.csv'
+    filas_entrada(2500).to_csv(path, index=False, encoding='utf-8')
+    return str(path)
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+import procesar_excel_directo as p
+from dividir_hab import dividir_archivo_hab
+from lector_hab import comparar_hab, verificar_control
+from registro_enviados import REGISTRO_ENVIADOS, RegistroEnviados
+
+from conftest import filas_entrada
+
+
+def _procesar(entrada, directorio, **opciones):
+    os.makedirs(directorio, exist_ok=True)
+    resultado = p.procesar_archivo_excel(entrada, directorio_salida=str(directorio), **opciones)
+    assert resultado['error'] is None
+    return resultado
+
+
+def _leer(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_contenido_igual_a_lineas(fecha_fija):
+    """El codificador columnar genera lo mismo que generar_linea_hab fila por fila."""
+    df = filas_entrada(200)
+    con_apoderado = p.mascara_apoderado(df)
+    esperado = ''.join(
+        p.generar_linea_hab(fila) + '\r\n' for _, fila in df[con_apoderado].iterrows()
+    ).encode('latin-1')
+
+    contenido, lineas_generadas, lineas_saltadas = p.generar_contenido_hab(df)
+    assert contenido == esperado
+    assert (lineas_generadas, lineas_saltadas) == (con_apoderado.sum(), (~con_apoderado).sum())
+
+    avances = []
+    por_bloques = p.generar_contenido_hab(df, avance=lambda filas, total: avances.append(filas), tamano_bloque=37)
+    assert por_bloques == (contenido, lineas_generadas, lineas_saltadas)
+    assert avances[0] == 0 and avances[-1] == len(df)
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_registro_no_repite_envios(tmp_path, entrada_csv, streaming):
+    """Una entrada enviada dos veces con 'omitir' no repite personas en el segundo .HAB."""
+    primero = _procesar(entrada_csv, tmp_path / 'salida', streaming=streaming, control_enviados='omitir')
+    assert primero['lineas_generadas'] > 0
+
+    with RegistroEnviados(str(tmp_path / 'salida' / REGISTRO_ENVIADOS)) as registro:
+        enviados = len(registro)
+    assert enviados == primero['lineas_generadas']
+
+    copia = tmp_path / 'reenvio.csv'
+    copia.write_bytes(_leer(entrada_csv))
+    segundo = _procesar(str(copia), tmp_path / 'salida', streaming=streaming, control_enviados='omitir')
+    assert segundo['lineas_generadas'] == 0
+    assert segundo['lineas_repetidas'] == primero['lineas_generadas']
+    assert _leer(segundo['hab_path']) == b''
+
+    with RegistroEnviados(str(tmp_path / 'salida' / REGISTRO_ENVIADOS)) as registro:
+        assert len(registro) == enviados
+
+
+def test_retomar_tras_corte(tmp_path, entrada_csv, fecha_fija, monkeypatch, capsys):
+    """Tras un corte, se retoma desde el punto de control (truncando lo escrito después) y el .HAB es el mismo."""
+    monkeypatch.setattr(p, 'INTERVALO_PUNTO_CONTROL', 500)
+    completo = _procesar(entrada_csv, tmp_path / 'completo', streaming=True, tamano_bloque=300)
+
+    codificar = p._codificar_con_apoderado
+    bloques = []
+
+    def cortar(*args, **kwargs):
+        bloques.append(None)
+        if len(bloques) == 6:
+            raise RuntimeError('corte')
+        return codificar(*args, **kwargs)
+
+    monkeypatch.setattr(p, '_codificar_con_apoderado', cortar)
+    directorio = tmp_path / 'cortado'
+    os.makedirs(directorio)
+    cortado = p.procesar_archivo_excel(entrada_csv, streaming=True, tamano_bloque=300, directorio_salida=str(directorio))
+    assert cortado['error'] == 'corte'
+    monkeypatch.setattr(p, '_codificar_con_apoderado', codificar)
+
+    parciales = [nombre for nombre in os.listdir(directorio) if nombre.endswith('.HAB' + p.SUFIJO_PARCIAL)]
+    assert len(parciales) == 1
+    assert os.path.exists(directorio / 'checkpoint_entrada.json')
+    # Registros escritos después del último punto de control: se descartan al retomar
+    with open(directorio / parciales[0], 'ab') as f:
+        f.write(b'9' * p.ANCHO_REGISTRO_HAB + b'\r\n')
+
+    capsys.readouterr()
+    retomado = _procesar(entrada_csv, directorio, streaming=True, tamano_bloque=300)
+    assert 'Se retoma' in capsys.readouterr().out
+    assert os.path.basename(retomado['hab_path']) == parciales[0][:-len(p.SUFIJO_PARCIAL)]
+    assert _leer(retomado['hab_path']) == _leer(completo['hab_path'])
+    assert verificar_control(retomado['hab_path']) == []
+    assert not os.path.exists(directorio / 'checkpoint_entrada.json')
+
+
+@pytest.mark.parametrize('division', ['sucursal', 'registros:100', 'sucursal:50'])
+def test_dividir_y_comparar(tmp_path, entrada_csv, division):
+    """Las partes reunidas tienen los mismos registros que el .HAB completo."""
+    resultado = _procesar(entrada_csv, tmp_path)
+    manifiesto = dividir_archivo_hab(resultado['hab_path'], division, conservar=True)
+
+    reunido = tmp_path / 'reunido.HAB'
+    with open(reunido, 'wb') as f:
+        for parte in manifiesto['partes']:
+            path = tmp_path / parte['archivo']
+            assert verificar_control(str(path)) == []
+            f.write(_leer(path))
+
+    comparacion = comparar_hab(resultado['hab_path'], str(reunido), clave='CUIL')
+    assert comparacion['iguales'] == resultado['lineas_generadas']
+    assert not (comparacion['solo_anterior'] or comparacion['solo_nuevo'] or comparacion['distintos'])
+    assert not (comparacion['duplicados_anterior'] or comparacion['duplicados_nuevo'])
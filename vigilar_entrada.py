@@ -0,0 +1,292 @@
+"""
+Modo servicio: vigila la carpeta de entrada y genera los .HAB a medida que
+llegan exportaciones nuevas.
+
+La carpeta se sondea cada INTERVALO_SONDEO segundos (sin dependencias del
+sistema operativo). Un archivo se procesa recién cuando su tamaño y fecha
+de modificación no cambiaron durante ESPERA_ESTABLE segundos, se puede
+abrir y Excel no lo tiene abierto (archivo de bloqueo ~$). Los archivos
+estables entran en una cola acotada (MAX_EN_COLA) que atiende un pool de
+procesos que se mantiene vivo entre archivos, así que pandas y el resto de
+las dependencias se importan una sola vez por proceso. Al terminar, la
+entrada se mueve a la subcarpeta archivados/ de la entrada (o a con_error/
+si falló) para que no se vuelva a tomar.
+
+Uso desde línea de comandos:
+    python procesar_excel_directo.py --vigilar
+    python procesar_excel_directo.py --vigilar --workers 2 --enviados omitir
+    python procesar_excel_directo.py --vigilar --entrada /datos/ppp --salida /datos/hab
+"""
+import os
+import queue
+import shutil
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import procesar_excel_directo as proceso
+
+# Segundos entre sondeos de la carpeta de entrada
+INTERVALO_SONDEO = 2.0
+
+# Segundos que un archivo debe quedar sin cambios antes de procesarlo
+ESPERA_ESTABLE = 5.0
+
+# Archivos estables esperando un proceso libre; el resto espera en la carpeta
+MAX_EN_COLA = 100
+
+# Entradas ya procesadas (y con error): subcarpetas de la carpeta de entrada
+SUBDIR_ARCHIVADOS = "archivados"
+SUBDIR_ERRORES = "con_error"
+
+
+def _log(mensaje):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {mensaje}", flush=True)
+
+
+def es_archivo_entrada(nombre):
+    """True si el nombre es un archivo de entrada y no un archivo de bloqueo o temporal de Excel."""
+    return (
+        not nombre.startswith(('~$', '.'))
+        and os.path.splitext(nombre)[1].lower() in proceso.EXTENSIONES_ENTRADA
+    )
+
+
+def _bloqueado_por_excel(nombre, nombres):
+    """
+    True si Excel tiene abierto el archivo: crea ~$<nombre> (el nombre
+    completo) en la misma carpeta mientras está abierto.
+    """
+    return f"~${nombre}" in nombres
+
+
+def _se_puede_abrir(path):
+    """False si el archivo todavía está bloqueado (p. ej. mientras se copia en Windows)."""
+    try:
+        with open(path, 'rb') as f:
+            f.read(1)
+        return True
+    except OSError:
+        return False
+
+
+class DetectorEstables:
+    """
+    Detecta archivos de entrada estables en una carpeta, por sondeo.
+
+    Cada llamada a sondear() compara tamaño y fecha de modificación con el
+    sondeo anterior; un archivo es estable cuando esa firma no cambió
+    durante `espera` segundos.
+    """
+
+    def __init__(self, directorio, espera=ESPERA_ESTABLE):
+        self.directorio = directorio
+        self.espera = espera
+        # path → (firma, momento desde el que no cambia)
+        self._vistos = {}
+
+    def sondear(self, ahora=None):
+        """Lista de rutas estables, de la más vieja a la más nueva."""
+        ahora = time.monotonic() if ahora is None else ahora
+        try:
+            entradas = [entrada for entrada in os.scandir(self.directorio) if entrada.is_file()]
+        except OSError as e:
+            _log(f"⚠️  No se pudo leer {self.directorio}: {e}")
+            return []
+        nombres = {entrada.name for entrada in entradas}
+
+        vistos = {}
+        estables = []
+        for entrada in entradas:
+            if not es_archivo_entrada(entrada.name):
+                continue
+            estado = entrada.stat()
+            firma = (estado.st_size, estado.st_mtime_ns)
+            anterior = self._vistos.get(entrada.path)
+            desde = anterior[1] if anterior and anterior[0] == firma else ahora
+            vistos[entrada.path] = (firma, desde)
+            if (
+                estado.st_size > 0
+                and ahora - desde >= self.espera
+                and not _bloqueado_por_excel(entrada.name, nombres)
+                and _se_puede_abrir(entrada.path)
+            ):
+                estables.append((estado.st_mtime_ns, entrada.path))
+        self._vistos = vistos
+        return [path for _, path in sorted(estables)]
+
+
+def _mover(path, directorio):
+    """
+    Mueve path a directorio sin pisar un archivo con el mismo nombre.
+    Devuelve la ruta nueva (o la original si no se pudo mover).
+    """
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, os.path.basename(path))
+    if os.path.exists(destino):
+        base, extension = os.path.splitext(destino)
+        destino = f"{base}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}{extension}"
+    try:
+        shutil.move(path, destino)
+    except OSError as e:
+        _log(f"⚠️  No se pudo mover {os.path.basename(path)} a {directorio}: {e}")
+        return path
+    return destino
+
+
+def _iniciar_worker():
+    """
+    Prepara cada proceso del pool: ignora Ctrl+C (el proceso principal
+    decide cuándo terminar y espera los archivos en curso) y precarga
+    pyarrow, que procesar_excel_directo importa dentro de sus lectores.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import pyarrow.csv  # noqa: F401
+    import pyarrow.parquet  # noqa: F401
+
+
+def _agregar(resultados, resultado):
+    if resultado is not None:
+        resultados.append(resultado)
+
+
+def vigilar(directorio_entrada=None, directorio_salida=None, workers=None, streaming=None, perfilar=False,
+            control_enviados=None, auditoria=None, division=None, archivados_dir=None, errores_dir=None,
+            intervalo=INTERVALO_SONDEO, espera=ESPERA_ESTABLE, max_en_cola=MAX_EN_COLA, detener=None):
+    """
+    Vigila directorio_entrada y procesa cada archivo estable con
+    procesar_archivo_excel, hasta Ctrl+C o hasta que se active detener.
+
+    Args:
+        directorio_entrada: Carpeta a vigilar (por defecto FERIAS_NOC_DIR)
+        directorio_salida: Carpeta de salida (ver procesar_excel_directo.carpetas_trabajo)
+        workers: Procesos del pool (por defecto MAX_WORKERS, o la cantidad de CPUs)
+        streaming, perfilar, control_enviados, auditoria, division: Como en
+            procesar_archivo_excel
+        archivados_dir: Destino de las entradas procesadas (por defecto <entrada>/archivados)
+        errores_dir: Destino de las entradas con error (por defecto <entrada>/con_error)
+        intervalo: Segundos entre sondeos
+        espera: Segundos sin cambios para considerar estable un archivo
+        max_en_cola: Tamaño máximo de la cola de archivos pendientes
+        detener: threading.Event opcional para terminar el servicio
+
+    Returns:
+        Lista de resultados de los archivos procesados (ver procesar_archivo_excel)
+    """
+    directorio_entrada, directorio_salida = proceso.carpetas_trabajo(directorio_entrada, directorio_salida)
+    archivados_dir = archivados_dir or os.path.join(directorio_entrada, SUBDIR_ARCHIVADOS)
+    errores_dir = errores_dir or os.path.join(directorio_entrada, SUBDIR_ERRORES)
+    workers = workers or proceso.MAX_WORKERS or os.cpu_count() or 1
+    if streaming is None:
+        streaming = proceso.MODO_STREAMING
+    os.makedirs(directorio_salida, exist_ok=True)
+
+    detector = DetectorEstables(directorio_entrada, espera)
+    cola = queue.Queue(maxsize=max_en_cola)
+    pendientes = set()  # en la cola o en proceso
+    en_proceso = {}  # futuro → path
+    resultados = []
+
+    _log(f"👀 Vigilando {directorio_entrada} (cada {intervalo:g}s, {workers} procesos). Ctrl+C para terminar.")
+    # El with cierra el pool aunque un segundo Ctrl+C corte la espera del finally
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker) as pool:
+        try:
+            while detener is None or not detener.is_set():
+                # Archivos nuevos y estables a la cola; si está llena, esperan en la carpeta
+                for path in detector.sondear():
+                    if path in pendientes:
+                        continue
+                    try:
+                        cola.put_nowait(path)
+                    except queue.Full:
+                        break
+                    pendientes.add(path)
+                    _log(f"📥 Detectado: {os.path.basename(path)}")
+
+                # De la cola a los procesos libres
+                while len(en_proceso) < workers and not cola.empty():
+                    path = cola.get_nowait()
+                    futuro = _despachar(pool, path, directorio_salida, streaming, perfilar, control_enviados,
+                                        auditoria, division)
+                    en_proceso[futuro] = path
+
+                if not en_proceso:
+                    time.sleep(intervalo)
+                    continue
+                terminados, _ = wait(list(en_proceso), timeout=intervalo, return_when=FIRST_COMPLETED)
+                for futuro in terminados:
+                    path = en_proceso.pop(futuro)
+                    pendientes.discard(path)
+                    _agregar(resultados, _terminar(futuro, path, directorio_salida, archivados_dir, errores_dir))
+        except KeyboardInterrupt:
+            _log("🛑 Deteniendo: se terminan los archivos en proceso...")
+        finally:
+            for futuro in list(en_proceso):
+                path = en_proceso.pop(futuro)
+                _agregar(resultados, _terminar(futuro, path, directorio_salida, archivados_dir, errores_dir))
+    return resultados
+
+
+def _despachar(pool, path, directorio_salida, streaming, perfilar, control_enviados, auditoria, division):
+    """Envía un archivo al pool (ver _procesar_vigilado)."""
+    _log(f"⚙️  Procesando: {os.path.basename(path)}")
+    return pool.submit(
+        _procesar_vigilado, path, directorio_salida, streaming, perfilar, control_enviados, auditoria, division,
+    )
+
+
+def _procesar_vigilado(path, directorio_salida, streaming, perfilar, control_enviados, auditoria, division):
+    """
+    En un proceso del pool: calcula la clave del archivo (el hash no frena
+    el sondeo de la carpeta) y, si ya figura en el manifiesto (mismo
+    contenido, nombre y opciones, ver _clave_procesado), devuelve ese
+    resultado sin procesarlo.
+
+    Returns:
+        Tupla (clave, resultado); (None, None) si el archivo no se pudo leer
+    """
+    try:
+        clave = proceso._clave_procesado(path, control_enviados, auditoria, division)
+    except OSError:
+        return None, None
+    resultado = proceso.resultado_desde_manifiesto(proceso.cargar_manifiesto(directorio_salida), clave, path)
+    if resultado is None:
+        resultado = proceso._procesar_archivo_aislado(
+            path, streaming, directorio_salida, perfilar, control_enviados, auditoria, division,
+        )
+    return clave, resultado
+
+
+def _terminar(futuro, path, directorio_salida, archivados_dir, errores_dir):
+    """
+    Registra el resultado de un archivo en el manifiesto y mueve la entrada.
+    Devuelve el resultado, o None si el archivo se reintenta en el próximo sondeo.
+    """
+    try:
+        clave, resultado = futuro.result()
+    except BaseException as e:
+        # El proceso del pool terminó de forma anormal (p. ej. falta de memoria)
+        clave, resultado = None, proceso._nuevo_resultado(path)
+        resultado['error'] = str(e) or type(e).__name__
+
+    nombre = os.path.basename(path)
+    if resultado is None:
+        _log(f"⚠️  No se pudo leer {nombre}, se reintenta en el próximo sondeo")
+        return None
+    if resultado['error']:
+        _log(f"❌ {nombre}: {resultado['error']} → {_mover(path, errores_dir)}")
+        return resultado
+    if resultado['desde_cache']:
+        _log(f"🗄️  Archivado: {_mover(path, archivados_dir)}")
+        return resultado
+
+    # Solo el proceso principal escribe el manifiesto
+    manifiesto = proceso.cargar_manifiesto(directorio_salida)
+    manifiesto[clave] = proceso.entrada_manifiesto(resultado)
+    proceso.guardar_manifiesto(directorio_salida, manifiesto)
+
+    salida = resultado['particiones_path'] or resultado['hab_path']
+    _log(f"✅ {nombre}: {resultado['lineas_generadas']} líneas en {resultado['tiempos'].get('total', 0):.1f}s → {salida}")
+    _log(f"🗄️  Archivado: {_mover(path, archivados_dir)}")
+    return resultado